@@ -1,9 +1,10 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, RedirectResponse, Response, StreamingResponse
 from pydantic import BaseModel
 import asyncio
 import json
 import logging
+import mimetypes
 from typing import AsyncGenerator, Optional, List
 import os
 from dotenv import load_dotenv
@@ -14,15 +15,14 @@ import time
 import traceback
 import concurrent.futures
 from portia.execution_hooks import ExecutionHooks as BaseExecutionHooks
-from portia import PlanBuilderV2, Input
 from portia.builder.reference import StepOutput
 from pydantic import BaseModel
 import concurrent.futures
 
 # Import from main.py
 from main import (
-    plan,
-    portia,
+    get_ugc_plan,
+    get_product_ad_plan,
     prebuild_character_urls,
     validate_url,
     get_character_url,
@@ -33,6 +33,8 @@ from main import (
     PRODUCT_DESCRIPTION_SYSTEM_PROMPT,
     DIALOG_GENERATION_SYSTEM_PROMPT,
     generate_product_ad,
+    CREATE_PREDICTIONS_TOOL_ID,
+    GET_PREDICTIONS_TOOL_ID,
 )
 from portia import (
     PlanRunState,
@@ -47,12 +49,27 @@ from social_scheduler import (
     ChannelDetection,
     CaptionGeneration,
     SchedulingData,
-    social_scheduler_plan,
+    get_social_scheduler_plan,
     create_simple_social_scheduler_plan,
     create_sheets_integration_plan,
     convert_natural_time_to_iso,
+    publish_scheduled_post,
+    ADD_ROW_TO_SHEET_TOOL_ID,
 )
-from utils.config import get_portia_with_custom_tools
+from utils.config import get_ephemeral_portia, get_portia, get_run_replicator
+from utils.hook_routing import run_hooks
+from utils.post_queue import ScheduledPostQueue
+from utils.dedupe import DuplicatePostError, duplicate_index, request_fingerprint
+from utils.instrumentation import instrumentation
+from utils.step_events import step_completed_event, step_started_event
+from utils.media_store import MediaNotConfiguredError, local_media, media_store
+from utils.media_mirror import media_mirror
+from utils.media_uploads import store_upload
+from utils.rate_limits import rate_limiter
+from utils.circuit_breaker import STATE_VALUES, circuit_breakers
+from utils.hedging import hedger
+from utils import http_pool, metrics
+from utils.cost_ledger import GROUP_BY_COLUMNS, bind_job, cost_ledger, unbind_job, with_job_context
 
 load_dotenv()
 
@@ -80,6 +97,234 @@ def safe_json_dumps(data):
 running_plans = {}
 # plan_clarifications removed - no longer needed without clarifications
 
+# Local scheduled-post queue, created on startup
+post_queue: Optional[ScheduledPostQueue] = None
+
+
+# Metrics: step/prediction samples come from the instrumentation listeners,
+# everything else is read from the live objects when /metrics is scraped
+instrumentation.add_listener(metrics.observe_step)
+instrumentation.add_prediction_listener(metrics.observe_prediction)
+instrumentation.add_run_listener(metrics.plan_runs.update)
+metrics.registry.collector(
+    "ugc_tracked_plan_runs", "Plan runs held for /plan-status", lambda: [({}, len(running_plans))]
+)
+metrics.registry.collector(
+    "ugc_scheduled_post_queue_depth",
+    "Posts waiting in the local scheduling queue",
+    lambda: [({}, post_queue.depth())] if post_queue else [],
+)
+metrics.registry.collector(
+    "ugc_cache_hit_ratio",
+    "Hit ratio of in-process caches",
+    lambda: [
+        (
+            {"cache": "social_request_dedupe"},
+            metrics.hit_ratio(duplicate_index.stats["coalesced"], duplicate_index.stats["misses"]),
+        )
+    ],
+)
+metrics.registry.counter_collector(
+    "ugc_duplicate_posts_rejected_total",
+    "Scheduled posts rejected as duplicates",
+    lambda: [({}, duplicate_index.stats["rejected"])],
+)
+
+metrics.registry.counter_collector(
+    "ugc_rate_limit_waits_total",
+    "Outbound calls that queued for a rate-limit token, by bucket",
+    lambda: [({"bucket": key}, stats["waited"]) for key, stats in rate_limiter.snapshot()["buckets"].items()],
+)
+metrics.registry.counter_collector(
+    "ugc_rate_limit_wait_seconds_total",
+    "Total seconds outbound calls spent queued for rate-limit tokens, by bucket",
+    lambda: [({"bucket": key}, stats["wait_seconds"]) for key, stats in rate_limiter.snapshot()["buckets"].items()],
+)
+metrics.registry.collector(
+    "ugc_predictions_in_flight",
+    "Replicate predictions holding a concurrency slot, by model version",
+    lambda: [({"version": version}, slots["in_use"]) for version, slots in rate_limiter.snapshot()["predictions"].items()],
+)
+metrics.registry.collector(
+    "ugc_predictions_waiting",
+    "Prediction creates queued for a concurrency slot, by model version",
+    lambda: [({"version": version}, slots["waiting"]) for version, slots in rate_limiter.snapshot()["predictions"].items()],
+)
+
+metrics.registry.collector(
+    "ugc_circuit_state",
+    "Upstream circuit state by tool (0 closed, 1 half open, 2 open)",
+    lambda: [({"tool": tool_id}, STATE_VALUES[b["state"]]) for tool_id, b in circuit_breakers.snapshot().items()],
+)
+metrics.registry.counter_collector(
+    "ugc_circuit_rejected_calls_total",
+    "Tool calls failed fast by an open circuit",
+    lambda: [({"tool": tool_id}, b["rejected"]) for tool_id, b in circuit_breakers.snapshot().items()],
+)
+
+metrics.registry.counter_collector(
+    "ugc_hedged_calls_total",
+    "Hedge-eligible create_predictions calls, by outcome",
+    lambda: [({"outcome": outcome}, count) for outcome, count in hedger.counts().items()],
+)
+
+
+def _replicator():
+    # Only report once the replicator exists; scraping must not build the Portia config
+    return get_run_replicator() if get_run_replicator.is_built() else None
+
+
+metrics.registry.collector(
+    "ugc_plan_run_replication_pending",
+    "Finished plan runs waiting to be copied to cloud storage",
+    lambda: [({}, _replicator().pending())] if _replicator() else [],
+)
+metrics.registry.counter_collector(
+    "ugc_plan_run_replications_total",
+    "Plan runs copied to cloud storage, by result",
+    lambda: [({"result": result}, count) for result, count in _replicator().stats.items()] if _replicator() else [],
+)
+
+
+metrics.registry.collector(
+    "ugc_media_mirror_pending",
+    "Finished videos waiting to be mirrored locally",
+    lambda: [({}, media_mirror.pending())] if media_mirror.enabled else [],
+)
+metrics.registry.counter_collector(
+    "ugc_media_mirrors_total",
+    "Finished videos mirrored locally, by result",
+    lambda: [
+        ({"result": result}, count) for result, count in media_mirror.counts().items() if result != "bytes"
+    ] if media_mirror.enabled else [],
+)
+metrics.registry.counter_collector(
+    "ugc_media_mirrored_bytes_total",
+    "Bytes of finished videos stored by the mirror",
+    lambda: [({}, media_mirror.counts()["bytes"])] if media_mirror.enabled else [],
+)
+
+
+# Cost ledger: every plan-running request is a job; steps and polled predictions
+# charge their estimated OpenAI/Replicate cost to it
+instrumentation.add_listener(cost_ledger.record_step)
+instrumentation.add_prediction_listener(cost_ledger.record_prediction)
+
+
+@app.middleware("http")
+async def bind_cost_job(request: Request, call_next):
+    """Open a cost-ledger job for /execute-* requests and return its id in X-Job-Id"""
+    if not request.url.path.startswith("/execute-"):
+        return await call_next(request)
+    # The job row is an SQLite insert; keep it off the event loop
+    job = await asyncio.to_thread(cost_ledger.start_job, request.url.path, request.headers.get("X-Customer-Id"))
+    token = bind_job(job)
+    try:
+        response = await call_next(request)
+    finally:
+        unbind_job(token)
+    response.headers["X-Job-Id"] = job.job_id
+    return response
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Count requests and time them per route template"""
+    started_at = time.perf_counter()
+    metrics.http_requests_in_flight.inc()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        metrics.http_requests_in_flight.dec()
+        route = request.scope.get("route")
+        # Use the route template so path parameters don't create new series
+        route_path = getattr(route, "path", None) or "unmatched"
+        metrics.http_requests_total.inc(route=route_path, method=request.method, status=status)
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - started_at, route=route_path, method=request.method
+        )
+
+
+@app.on_event("startup")
+def start_post_queue():
+    """Start the local scheduled-post dispatcher"""
+    global post_queue
+    post_queue = ScheduledPostQueue(
+        publish=lambda post: publish_scheduled_post(get_portia(), post)
+    )
+    post_queue.start()
+
+
+@app.on_event("startup")
+def warm_up_portia():
+    """Build the Portia client, tool registry and UGC plan in the background"""
+    # Keeps startup (and the health check) fast while sparing the first request the cold build
+    if os.getenv("PORTIA_WARMUP_ON_STARTUP", "true").lower() not in ("1", "true", "yes"):
+        return
+
+    def warm_up():
+        started_at = time.perf_counter()
+        try:
+            get_portia()
+            get_ugc_plan()
+            get_social_scheduler_plan()
+            logger.info(f"Portia warmed up in {time.perf_counter() - started_at:.2f}s")
+        except Exception as e:
+            logger.warning(f"Portia warmup failed, will retry on first request: {e}")
+
+    threading.Thread(target=warm_up, name="portia-warmup", daemon=True).start()
+
+
+@app.on_event("startup")
+def start_media_mirror():
+    """Resume mirroring downloads left pending by the previous run"""
+    media_mirror.start()
+
+
+@app.on_event("shutdown")
+def stop_post_queue():
+    if post_queue:
+        post_queue.stop()
+
+
+@app.on_event("shutdown")
+def close_http_pool():
+    http_pool.close_all()
+
+
+@app.on_event("shutdown")
+def stop_media_mirror():
+    media_mirror.stop()
+
+
+@app.on_event("shutdown")
+def stop_run_replication():
+    """Give queued plan runs a chance to reach cloud storage"""
+    replicator = _replicator()
+    if replicator:
+        replicator.stop()
+
+
+# Upstream tools each flow depends on; new requests are shed with 503 while any circuit is open
+UGC_UPSTREAMS = (CREATE_PREDICTIONS_TOOL_ID, GET_PREDICTIONS_TOOL_ID)
+SOCIAL_UPSTREAMS = (CREATE_PREDICTIONS_TOOL_ID, ADD_ROW_TO_SHEET_TOOL_ID)
+
+
+def shed_if_unavailable(tool_ids):
+    """Fail fast with 503 instead of starting a run against a degraded upstream"""
+    unavailable = circuit_breakers.unavailable(*tool_ids)
+    if unavailable:
+        tool_id, retry_after = unavailable
+        metrics.requests_shed_total.inc(tool=tool_id)
+        raise HTTPException(
+            status_code=503,
+            detail=f"Upstream {tool_id.rsplit(':', 1)[-1]} is unavailable, retry later",
+            headers={"Retry-After": str(int(retry_after) + 1)},
+        )
+
 
 # Request models
 class UGCGeneratorRequest(BaseModel):
@@ -108,6 +353,7 @@ class SocialSchedulerRequest(BaseModel):
     media_url: str  # Video URL from UGC generation
     product_description: str  # Product description from UGC
     dialog: str  # Dialog text from UGC
+    use_local_queue: bool = False  # Dispatch from the local queue instead of writing the sheet now
 
 
 # SocialClarificationResponse model removed - no longer needed without clarifications
@@ -120,11 +366,6 @@ class StepOutput(BaseModel):
     output: str
     status: str
 
-class PredictionPolling(BaseModel):
-    id:str
-    status:str
-
-
 class UGCGeneratorResponse(BaseModel):
     plan_id: str
     plan_run_id: str
@@ -227,14 +468,14 @@ async def stream_ugc_execution(
             nonlocal plan_run, execution_error, execution_completed
             try:
                 logger.info("Starting plan execution in separate thread")
-                plan_run = portia.run_plan(plan, plan_run_inputs=plan_inputs)
+                plan_run = get_portia().run_plan(get_ugc_plan(), plan_run_inputs=plan_inputs)
                 execution_completed = True
             except Exception as e:
                 execution_error = e
                 execution_completed = True
 
         # Start execution in background thread
-        execution_thread = threading.Thread(target=run_portia)
+        execution_thread = threading.Thread(target=with_job_context(run_portia))
         execution_thread.start()
 
         # Wait for plan to start
@@ -336,7 +577,7 @@ async def stream_ugc_execution(
                     nonlocal video_result, polling_error, polling_completed
                     try:
                         video_result = poll_prediction_until_complete(
-                            portia, prediction_id
+                            get_ephemeral_portia(), prediction_id
                         )
                         polling_completed = True
                     except Exception as e:
@@ -344,7 +585,7 @@ async def stream_ugc_execution(
                         polling_completed = True
 
                 # Start polling in background thread
-                polling_thread = threading.Thread(target=poll_video)
+                polling_thread = threading.Thread(target=with_job_context(poll_video))
                 polling_thread.start()
 
                 # Wait for polling completion with periodic status updates
@@ -363,7 +604,8 @@ async def stream_ugc_execution(
                     if isinstance(video_result, list) and len(video_result) > 0:
                         result_item = video_result[0]
                         if isinstance(result_item, dict) and "output" in result_item:
-                            video_url = result_item["output"]
+                            # Registering the mirror writes to SQLite; keep it off the event loop
+                            video_url = await asyncio.to_thread(media_mirror.mirror, result_item["output"])
 
                     yield f"data: {safe_json_dumps({'type': 'video_ready', 'plan_run_id': plan_run_id, 'video_url': video_url, 'full_result': video_result})}\n\n"
                 else:
@@ -389,6 +631,7 @@ async def stream_ugc_execution(
 @app.post("/execute-ugc", response_model=UGCGeneratorResponse)
 async def execute_ugc(request: UGCGeneratorRequest):
     """Execute UGC generation and return the complete result"""
+    shed_if_unavailable(UGC_UPSTREAMS)
     try:
         logger.info(
             f"Starting synchronous UGC execution for request: {request.model_dump()}"
@@ -418,14 +661,14 @@ async def execute_ugc(request: UGCGeneratorRequest):
             nonlocal plan_run, execution_error, execution_completed
             try:
                 logger.info("Executing plan synchronously in separate thread")
-                plan_run = portia.run_plan(plan, plan_run_inputs=plan_inputs)
+                plan_run = get_portia().run_plan(get_ugc_plan(), plan_run_inputs=plan_inputs)
                 execution_completed = True
             except Exception as e:
                 execution_error = e
                 execution_completed = True
 
         # Start execution in background thread
-        execution_thread = threading.Thread(target=run_portia_sync)
+        execution_thread = threading.Thread(target=with_job_context(run_portia_sync))
         execution_thread.start()
 
         # Wait for completion
@@ -488,10 +731,10 @@ async def execute_ugc(request: UGCGeneratorRequest):
 
                 # Poll in separate thread to avoid event loop conflicts
                 def poll_video_sync():
-                    return poll_prediction_until_complete(portia, prediction_id)
+                    return poll_prediction_until_complete(get_ephemeral_portia(), prediction_id)
 
                 with concurrent.futures.ThreadPoolExecutor() as executor:
-                    future = executor.submit(poll_video_sync)
+                    future = executor.submit(with_job_context(poll_video_sync))
                     final_video_result = future.result(timeout=1200)  # 2 minute timeout
 
                 if (
@@ -501,7 +744,7 @@ async def execute_ugc(request: UGCGeneratorRequest):
                 ):
                     result_item = final_video_result[0]
                     if isinstance(result_item, dict) and "output" in result_item:
-                        video_url = result_item["output"]
+                        video_url = media_mirror.mirror(result_item["output"])
                         logger.info(
                             f"Video generation completed successfully: {video_url}"
                         )
@@ -530,6 +773,7 @@ async def execute_ugc(request: UGCGeneratorRequest):
 @app.post("/execute-ugc-stream")
 async def execute_ugc_stream(request: UGCGeneratorRequest):
     """Execute UGC generation with streaming response using Server-Sent Events (SSE)"""
+    shed_if_unavailable(UGC_UPSTREAMS)
     return StreamingResponse(
         stream_ugc_execution(request),
         media_type="text/event-stream",
@@ -570,6 +814,7 @@ async def health_check():
 @app.post("/execute-ugc-realtime")
 async def execute_ugc_realtime(request: UGCGeneratorRequest):
     """TRUE REAL-TIME streaming endpoint using Portia execution hooks"""
+    shed_if_unavailable(UGC_UPSTREAMS)
 
     async def generate():
         try:
@@ -596,40 +841,14 @@ async def execute_ugc_realtime(request: UGCGeneratorRequest):
 
             # Define streaming hook functions
             def before_step_hook(plan, plan_run, step):
-                logger.info(f"Hook: Before step - {getattr(step, 'task', 'Unknown')}")
-                event_queue.put(
-                    {
-                        "type": "step_started",
-                        "step_index": getattr(plan_run, "current_step_index", 0),
-                        "step_name": getattr(step, "task", "Unknown Step"),
-                        "tool_id": getattr(step, "tool_id", "unknown"),
-                        "message": f"Starting step: {getattr(step, 'task', 'Unknown Step')}",
-                        "plan_run_id": str(plan_run.id),
-                    }
-                )
+                event = step_started_event(plan, plan_run, step)
+                logger.info(f"Hook: Before step - {event['step_id']}")
+                event_queue.put(event)
 
             def after_step_hook(plan, plan_run, step, output):
-                logger.info(f"Hook: After step - {getattr(step, 'task', 'Unknown')}")
-                # Get the step output
-                output_value = ""
-                if hasattr(output, "value"):
-                    output_value = str(output.value)[:200]  # Truncate long outputs
-                elif hasattr(output, "summary"):
-                    output_value = str(output.summary)[:200]
-                else:
-                    output_value = str(output)[:200]
-
-                event_queue.put(
-                    {
-                        "type": "step_completed",
-                        "step_index": getattr(plan_run, "current_step_index", 0),
-                        "step_name": getattr(step, "task", "Unknown Step"),
-                        "tool_id": getattr(step, "tool_id", "unknown"),
-                        "output": output_value,
-                        "message": f"Completed step: {getattr(step, 'task', 'Unknown Step')}",
-                        "plan_run_id": str(plan_run.id),
-                    }
-                )
+                event = step_completed_event(plan, plan_run, step, output)
+                logger.info(f"Hook: After step - {event['step_id']}")
+                event_queue.put(event)
 
             # Run Portia in a separate thread with streaming hooks
             plan_run_result = None
@@ -641,29 +860,21 @@ async def execute_ugc_realtime(request: UGCGeneratorRequest):
                 try:
                     logger.info("Starting plan execution with custom hooks")
 
-                    # Temporarily modify the portia instance's execution hooks
-                    original_hooks = portia.execution_hooks
+                    portia = get_portia()
 
-                    # Create new hooks that include our event capturing
+                    # Route the shared instance's hooks to our event capturing for this run only
                     custom_hooks = BaseExecutionHooks(
                         before_step_execution=before_step_hook,
                         after_step_execution=after_step_hook,
                     )
 
-                    # Set the custom hooks
-                    portia.execution_hooks = custom_hooks
-
-                    try:
-                        # Run the plan with our custom hooks
+                    with run_hooks(custom_hooks):
                         plan_run_result = portia.run_plan(
-                            plan, plan_run_inputs=plan_inputs
-                        )
-                        logger.info(
-                            f"Plan execution completed with state: {plan_run_result.state}"
+                            get_ugc_plan(), plan_run_inputs=plan_inputs
                         )
-                    finally:
-                        # Restore original hooks
-                        portia.execution_hooks = original_hooks
+                    logger.info(
+                        f"Plan execution completed with state: {plan_run_result.state}"
+                    )
 
                     # Handle clarifications
                     # Clarification handling removed - no longer needed
@@ -719,7 +930,7 @@ async def execute_ugc_realtime(request: UGCGeneratorRequest):
                                     f"Starting video polling for prediction: {prediction_id}"
                                 )
                                 final_video_result = poll_prediction_until_complete(
-                                    portia, prediction_id
+                                    get_ephemeral_portia(), prediction_id
                                 )
 
                                 if final_video_result:
@@ -733,7 +944,7 @@ async def execute_ugc_realtime(request: UGCGeneratorRequest):
                                             isinstance(result_item, dict)
                                             and "output" in result_item
                                         ):
-                                            video_url = result_item["output"]
+                                            video_url = media_mirror.mirror(result_item["output"])
 
                                     event_queue.put(
                                         {
@@ -773,7 +984,7 @@ async def execute_ugc_realtime(request: UGCGeneratorRequest):
                     execution_completed = True
 
             # Start execution in background thread
-            execution_thread = threading.Thread(target=run_portia)
+            execution_thread = threading.Thread(target=with_job_context(run_portia))
             execution_thread.start()
 
             # Stream events in real-time as they come from the hooks
@@ -844,10 +1055,66 @@ async def get_prebuild_characters():
     }
 
 
+@app.get("/upload/status")
+async def upload_status():
+    """Which media backend stores uploads and whether it is configured"""
+    return {"backend": media_store.name, "ready": media_store.ready()}
+
+
+@app.post("/upload")
+async def upload_media(file: UploadFile = File(...)):
+    """Store a product image sent as multipart/form-data and return the URL the plans consume"""
+    if file.content_type and not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=415, detail=f"Expected an image, got {file.content_type}")
+    # The body is spooled to a temporary file while it streams in; storing reads it in chunks
+    try:
+        result = await asyncio.to_thread(store_upload, file.file, file.content_type)
+    except MediaNotConfiguredError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Upload of {file.filename} failed: {e}")
+        raise HTTPException(status_code=502, detail=f"Upload failed: {e}")
+    finally:
+        await file.close()
+    return result
+
+
+def media_file_response(media_name: str, request: Request) -> Response:
+    path = local_media.path(media_name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Media {media_name} not found")
+    # The name is the content hash, so it is a strong ETag and the file never changes
+    etag = f'"{media_name.split(".")[0]}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    # FileResponse answers Range requests and uses zero-copy sends when the server supports them
+    return FileResponse(path, headers=headers, media_type=mimetypes.guess_type(media_name)[0])
+
+
+@app.get("/media/mirror/{mirror_id}")
+async def get_mirrored_media(mirror_id: str, request: Request):
+    """Serve a mirrored output, or redirect to the upstream URL until it is downloaded"""
+    mirrored = await asyncio.to_thread(media_mirror.lookup, mirror_id)
+    if mirrored is None:
+        raise HTTPException(status_code=404, detail=f"Mirror {mirror_id} not found")
+    source_url, media_name = mirrored
+    if media_name is None:
+        return RedirectResponse(source_url, status_code=307)
+    return media_file_response(media_name, request)
+
+
+@app.get("/media/{media_name}")
+async def get_media(media_name: str, request: Request):
+    """Serve a file from the local content-addressed media store"""
+    return media_file_response(media_name, request)
+
+
 # Product Ads Endpoints
 @app.post("/execute-product-ad")
 async def execute_product_ad(request: ProductAdRequest):
     """Execute Product Ad generation and return the complete result"""
+    shed_if_unavailable(UGC_UPSTREAMS)
     try:
         logger.info(
             f"Starting Product Ad execution for request: {request.model_dump()}"
@@ -866,74 +1133,8 @@ async def execute_product_ad(request: ProductAdRequest):
                 logger.info("Executing Product Ad generation in separate thread")
                 # result = generate_product_ad()  # This will use the input prompts - REMOVED: was causing terminal input prompts
 
-                # Import required modules
-                
-                # Pydantic schema for Product Ad prediction output
-                class ProductAdPrediction(BaseModel):
-                    """Product Ad Prediction model"""
-                    product_url: Optional[str]  # Made optional
-                    ad_prompt: str
-                    id: str
-                    status: str
-
-                # Create product ad generation plan with optional image
-                product_ad_plan = (
-                    PlanBuilderV2("Product Ad Generator")
-                    .input(name="product_url", description="Product image URL (optional)")
-                    .input(name="ad_prompt", description="Ad prompt from user")
-                    .single_tool_agent_step(
-                        tool="portia:mcp:custom:mcp.replicate.com:create_predictions",
-                        task="""
-                        Call the Replicate tool with this structure. 
-                        
-                        IF product_url is provided (not empty/null):
-                        {
-                          "version": "7428dcc4cdb6d758301c2ae57ca01279e9b6899c5cb01f18f4d577c412b14390",
-                          "input": {
-                            "prompt": [use the ad_prompt input],
-                            "lighting": "studio",
-                            "audio_mode": "off",
-                            "image_style": "studio",
-                            "camera_movement": "auto",
-                            "reference_image": [use the product_url input]
-                          },
-                          "jq_filter": "{id: .id, status: .status}",
-                          "Prefer": "wait=1"
-                        }
-                        
-                        IF product_url is empty/null (text-only ad):
-                        {
-                          "version": "7428dcc4cdb6d758301c2ae57ca01279e9b6899c5cb01f18f4d577c412b14390",
-                          "input": {
-                            "prompt": [use the ad_prompt input],
-                            "lighting": "studio",
-                            "audio_mode": "off",
-                            "image_style": "studio",
-                            "camera_movement": "auto"
-                          },
-                          "jq_filter": "{id: .id, status: .status}",
-                          "Prefer": "wait=1"
-                        }
-                        
-                        DO NOT include "reference_image" field if product_url is empty.
-                        DO NOT OMIT THE "version" FIELD. It is required.
-                        ONLY RETURN "id" and "status" in the output JSON.
-                        EXAMPLE OUTPUT:
-                        {
-                            "id": "example-id-123456",
-                            "status": "starting"
-                        }
-                        """,
-                        inputs=[Input("product_url"), Input("ad_prompt")],
-                        step_name="generate_product_ad",
-                        output_schema=PredictionPolling,
-
-                    )
-                    .final_output(
-                        output_schema=UGC_Prediction,
-                    )
-                    .build()
-                )
+                # Fixed-argument plan: the model input is built in code, no agent turn
+                product_ad_plan = get_product_ad_plan("studio")
 
                 # Run the product ad plan
                 plan_inputs = {
@@ -941,7 +1142,7 @@ async def execute_product_ad(request: ProductAdRequest):
                     "ad_prompt": request.ad_prompt,
                 }
 
-                plan_run = portia.run_plan(product_ad_plan, plan_run_inputs=plan_inputs)
+                plan_run = get_portia().run_plan(product_ad_plan, plan_run_inputs=plan_inputs)
 
                 # Extract prediction data from final output
                 prediction_output = plan_run.outputs.final_output.value
@@ -959,10 +1160,10 @@ async def execute_product_ad(request: ProductAdRequest):
 
                     # Poll in separate thread with timeout (same as UGC)
                     def poll_product_ad_sync():
-                        return poll_prediction_until_complete(portia, prediction_id)
+                        return poll_prediction_until_complete(get_ephemeral_portia(), prediction_id)
 
                     with concurrent.futures.ThreadPoolExecutor() as executor:
-                        future = executor.submit(poll_product_ad_sync)
+                        future = executor.submit(with_job_context(poll_product_ad_sync))
                         final_result = future.result(timeout=1200)  # 20 minute timeout
 
                     if (
@@ -972,7 +1173,7 @@ async def execute_product_ad(request: ProductAdRequest):
                     ):
                         result_item = final_result[0]
                         if isinstance(result_item, dict) and "output" in result_item:
-                            video_url = result_item["output"]
+                            video_url = media_mirror.mirror(result_item["output"])
                             logger.info(
                                 f"Product Ad generation completed successfully: {video_url}"
                             )
@@ -1020,7 +1221,7 @@ async def execute_product_ad(request: ProductAdRequest):
                 execution_error = e
 
         # Start execution in background thread
-        execution_thread = threading.Thread(target=run_product_ad_sync)
+        execution_thread = threading.Thread(target=with_job_context(run_product_ad_sync))
         execution_thread.start()
 
         # Wait for completion
@@ -1041,13 +1242,22 @@ async def execute_product_ad(request: ProductAdRequest):
 @app.post("/execute-social-scheduler-simple")
 async def execute_social_scheduler_simple(request: SocialSchedulerRequest):
     """Execute simplified social scheduler workflow without clarifications"""
+    shed_if_unavailable(SOCIAL_UPSTREAMS)
+    # Identical requests (client retries) share one run instead of scheduling twice
+    fingerprint = request_fingerprint("/execute-social-scheduler-simple", request.model_dump())
+    lease = duplicate_index.begin_request(fingerprint)
     try:
+        if not lease.is_owner:
+            logger.info("Coalescing duplicate simple social scheduler request")
+            result = await lease.wait(timeout=600)
+            return {**result, "coalesced": True}
+
         logger.info(
             f"Starting simple social scheduler execution for request: {request.model_dump()}"
         )
 
-        # Get Portia instance with custom tools
-        social_portia = get_portia_with_custom_tools()
+        # Shared Portia instance
+        social_portia = await asyncio.to_thread(get_portia)
 
         # Use the simplified social scheduler plan
         scheduler_plan = create_simple_social_scheduler_plan()
@@ -1065,7 +1275,7 @@ async def execute_social_scheduler_simple(request: SocialSchedulerRequest):
                     },
                 )
 
-            future = executor.submit(run_scheduler_plan)
+            future = executor.submit(with_job_context(run_scheduler_plan))
             scheduler_run = future.result(timeout=600)  # 3 minute timeout
 
         if scheduler_run.state != PlanRunState.COMPLETE:
@@ -1101,37 +1311,57 @@ async def execute_social_scheduler_simple(request: SocialSchedulerRequest):
             channel=captions_result.channel,
         )
 
-        # Save to Google Sheets
-        sheets_plan = create_sheets_integration_plan(final_data)
-        
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            def run_sheets_plan():
-                return social_portia.run_plan(
-                    sheets_plan,
-                    plan_run_inputs={
-                        "media_url": final_data.media_url,
-                        "instagram_caption": final_data.instagram_caption,
-                        "date_time": final_data.date_time,
-                        "twitter_post": final_data.twitter_post,
-                        "channel": final_data.channel,
-                    },
-                )
+        # Reject a post already scheduled for this media/channel/time before calling Make.com
+        duplicate_index.check_and_record_post(final_data)
+
+        queued_post_id = None
+        try:
+            if request.use_local_queue:
+                # The local dispatcher publishes through Make.com when the post is due
+                queued_post_id = post_queue.enqueue(final_data)
+            else:
+                # Save to Google Sheets
+                sheets_plan = create_sheets_integration_plan(final_data)
+
+                with concurrent.futures.ThreadPoolExecutor() as executor:
+                    def run_sheets_plan():
+                        return social_portia.run_plan(
+                            sheets_plan,
+                            plan_run_inputs={
+                                "media_url": final_data.media_url,
+                                "instagram_caption": final_data.instagram_caption,
+                                "date_time": final_data.date_time,
+                                "twitter_post": final_data.twitter_post,
+                                "channel": final_data.channel,
+                            },
+                        )
 
-            future = executor.submit(run_sheets_plan)
-            sheets_run = future.result(timeout=180)  # 1 minute timeout
+                    future = executor.submit(with_job_context(run_sheets_plan))
+                    sheets_run = future.result(timeout=180)  # 1 minute timeout
+        except Exception:
+            duplicate_index.forget_post(final_data)
+            raise
 
         # Return the complete result
-        return {
+        result = {
             "status": "completed",
             "instagram_caption": final_data.instagram_caption,
             "twitter_post": final_data.twitter_post,
             "channel": final_data.channel,
             "scheduled_time": scheduled_time,
             "media_url": final_data.media_url,
+            "queued_post_id": queued_post_id,
             "message": "Social media post has been scheduled successfully!",
         }
+        lease.complete(result)
+        return result
 
+    except DuplicatePostError as e:
+        lease.fail(e)
+        logger.warning(f"Rejected duplicate social post: {str(e)}")
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
+        lease.fail(e)
         logger.error(f"Error in simple social scheduler execution: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
@@ -1141,13 +1371,20 @@ async def execute_social_scheduler_simple(request: SocialSchedulerRequest):
 @app.post("/execute-social-scheduler", response_model=SocialSchedulerResponse)
 async def execute_social_scheduler(request: SocialSchedulerRequest):
     """Execute social scheduler workflow with clarification handling"""
+    shed_if_unavailable(SOCIAL_UPSTREAMS)
+    fingerprint = request_fingerprint("/execute-social-scheduler", request.model_dump())
+    lease = duplicate_index.begin_request(fingerprint)
     try:
+        if not lease.is_owner:
+            logger.info("Coalescing duplicate social scheduler request")
+            return await lease.wait(timeout=600)
+
         logger.info(
             f"Starting social scheduler execution for request: {request.model_dump()}"
         )
 
-        # Get Portia instance with custom tools
-        social_portia = get_portia_with_custom_tools()
+        # Shared Portia instance
+        social_portia = await asyncio.to_thread(get_portia)
 
         # Step 1: Generate initial captions
         # Use ThreadPoolExecutor to avoid event loop conflicts
@@ -1156,7 +1393,7 @@ async def execute_social_scheduler(request: SocialSchedulerRequest):
 
             def run_social_plan():
                 return social_portia.run_plan(
-                    social_scheduler_plan,
+                    get_social_scheduler_plan(),
                     plan_run_inputs={
                         "user_prompt": request.user_prompt,
                         "media_url": request.media_url,
@@ -1165,7 +1402,7 @@ async def execute_social_scheduler(request: SocialSchedulerRequest):
                     },
                 )
 
-            future = executor.submit(run_social_plan)
+            future = executor.submit(with_job_context(run_social_plan))
             caption_run = future.result(timeout=600)  # 2 minute timeout
 
         generated_captions = caption_run.outputs.final_output.value
@@ -1201,9 +1438,11 @@ async def execute_social_scheduler(request: SocialSchedulerRequest):
             scheduling_complete=False,
         )
 
+        lease.complete(response)
         return response
 
     except Exception as e:
+        lease.fail(e)
         logger.error(f"Error in social scheduler execution: {str(e)}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
@@ -1212,49 +1451,38 @@ async def execute_social_scheduler(request: SocialSchedulerRequest):
 @app.post("/execute-social-scheduler-realtime")
 async def execute_social_scheduler_realtime(request: SocialSchedulerRequest):
     """Execute simplified social scheduler workflow with real-time streaming"""
+    shed_if_unavailable(SOCIAL_UPSTREAMS)
     
     async def stream_simple_scheduler():
+        fingerprint = request_fingerprint("/execute-social-scheduler-realtime", request.model_dump())
+        lease = duplicate_index.begin_request(fingerprint)
         try:
+            if not lease.is_owner:
+                # A retry of a request that is still running or just finished: replay its result
+                logger.info("Coalescing duplicate realtime social scheduler request")
+                yield f"data: {safe_json_dumps({'type': 'duplicate', 'message': 'Identical request already in progress, waiting for its result...'})}\n\n"
+                result = await lease.wait(timeout=600)
+                yield f"data: {safe_json_dumps({**result, 'coalesced': True})}\n\n"
+                return
+
             yield f"data: {safe_json_dumps({'type': 'started', 'message': 'Starting social media scheduling...'})}\n\n"
             
-            # Get Portia instance
-            social_portia = get_portia_with_custom_tools()
+            # Shared Portia instance
+            social_portia = await asyncio.to_thread(get_portia)
             
             # Create event queue for this execution
             event_queue = queue.Queue()
 
             # Define streaming hook functions
             def before_step_hook(plan, plan_run, step):
-                logger.info(f"Hook: Before step - {getattr(step, 'task', 'Unknown')}")
-                event_queue.put({
-                    'type': 'step_started',
-                    'step_index': getattr(plan_run, 'current_step_index', 0),
-                    'step_name': getattr(step, 'task', 'Unknown Step'),
-                    'tool_id': getattr(step, 'tool_id', 'unknown'),
-                    'message': f"Starting: {getattr(step, 'task', 'Unknown Step')}",
-                    'plan_run_id': str(plan_run.id),
-                })
+                event = step_started_event(plan, plan_run, step)
+                logger.info(f"Hook: Before step - {event['step_id']}")
+                event_queue.put(event)
 
             def after_step_hook(plan, plan_run, step, output):
-                logger.info(f"Hook: After step - {getattr(step, 'task', 'Unknown')}")
-                # Get the step output
-                output_value = ""
-                if hasattr(output, 'value'):
-                    output_value = str(output.value)[:200]  # Truncate long outputs
-                elif hasattr(output, 'summary'):
-                    output_value = str(output.summary)[:200]
-                else:
-                    output_value = str(output)[:200]
-
-                event_queue.put({
-                    'type': 'step_completed',
-                    'step_index': getattr(plan_run, 'current_step_index', 0),
-                    'step_name': getattr(step, 'task', 'Unknown Step'),
-                    'tool_id': getattr(step, 'tool_id', 'unknown'),
-                    'output': output_value,
-                    'message': f"Completed: {getattr(step, 'task', 'Unknown Step')}",
-                    'plan_run_id': str(plan_run.id),
-                })
+                event = step_completed_event(plan, plan_run, step, output)
+                logger.info(f"Hook: After step - {event['step_id']}")
+                event_queue.put(event)
 
             # Run Portia execution in a separate thread with streaming hooks
             scheduler_run = None
@@ -1266,21 +1494,14 @@ async def execute_social_scheduler_realtime(request: SocialSchedulerRequest):
                 try:
                     logger.info("Starting plan execution with custom hooks")
 
-                    # Temporarily modify the social_portia instance's execution hooks
-                    original_hooks = social_portia.execution_hooks
-
-                    # Create new hooks that include our event capturing
+                    # Route the shared instance's hooks to our event capturing for this run only
                     custom_hooks = BaseExecutionHooks(
                         before_step_execution=before_step_hook,
                         after_step_execution=after_step_hook,
                     )
 
-                    # Set the custom hooks
-                    social_portia.execution_hooks = custom_hooks
-
-                    try:
-                        # Run the plan with our custom hooks
-                        scheduler_plan = create_simple_social_scheduler_plan()
+                    scheduler_plan = create_simple_social_scheduler_plan()
+                    with run_hooks(custom_hooks):
                         scheduler_run = social_portia.run_plan(
                             scheduler_plan,
                             plan_run_inputs={
@@ -1290,10 +1511,7 @@ async def execute_social_scheduler_realtime(request: SocialSchedulerRequest):
                                 "dialog": request.dialog,
                             },
                         )
-                        logger.info(f"Plan execution completed with state: {scheduler_run.state}")
-                    finally:
-                        # Restore original hooks
-                        social_portia.execution_hooks = original_hooks
+                    logger.info(f"Plan execution completed with state: {scheduler_run.state}")
 
                     execution_completed = True
 
@@ -1303,7 +1521,7 @@ async def execute_social_scheduler_realtime(request: SocialSchedulerRequest):
                     execution_completed = True
 
             # Start execution in background thread
-            execution_thread = threading.Thread(target=run_scheduler)
+            execution_thread = threading.Thread(target=with_job_context(run_scheduler))
             execution_thread.start()
 
             # Stream events in real-time as they come from the hooks
@@ -1388,24 +1606,36 @@ async def execute_social_scheduler_realtime(request: SocialSchedulerRequest):
                 channel=captions_result.channel,
             )
 
-            # Save to Google Sheets
-            sheets_plan = create_sheets_integration_plan(final_data)
-            
-            def run_sheets():
-                return social_portia.run_plan(
-                    sheets_plan,
-                    plan_run_inputs={
-                        "media_url": final_data.media_url,
-                        "instagram_caption": final_data.instagram_caption,
-                        "date_time": final_data.date_time,
-                        "twitter_post": final_data.twitter_post,
-                        "channel": final_data.channel,
-                    },
-                )
+            # Reject a post already scheduled for this media/channel/time before calling Make.com
+            duplicate_index.check_and_record_post(final_data)
+
+            queued_post_id = None
+            try:
+                if request.use_local_queue:
+                    # The local dispatcher publishes through Make.com when the post is due
+                    queued_post_id = post_queue.enqueue(final_data)
+                else:
+                    # Save to Google Sheets
+                    sheets_plan = create_sheets_integration_plan(final_data)
 
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                future = executor.submit(run_sheets)
-                sheets_run = future.result(timeout=180)
+                    def run_sheets():
+                        return social_portia.run_plan(
+                            sheets_plan,
+                            plan_run_inputs={
+                                "media_url": final_data.media_url,
+                                "instagram_caption": final_data.instagram_caption,
+                                "date_time": final_data.date_time,
+                                "twitter_post": final_data.twitter_post,
+                                "channel": final_data.channel,
+                            },
+                        )
+
+                    with concurrent.futures.ThreadPoolExecutor() as executor:
+                        future = executor.submit(with_job_context(run_sheets))
+                        sheets_run = future.result(timeout=180)
+            except Exception:
+                duplicate_index.forget_post(final_data)
+                raise
 
             # Send final result
             result = {
@@ -1416,14 +1646,24 @@ async def execute_social_scheduler_realtime(request: SocialSchedulerRequest):
                 "channel": final_data.channel,
                 "scheduled_time": scheduled_time,
                 "media_url": final_data.media_url,
+                "queued_post_id": queued_post_id,
                 "message": "Social media post has been scheduled successfully!",
             }
             
+            lease.complete(result)
             yield f"data: {safe_json_dumps(result)}\n\n"
 
+        except DuplicatePostError as e:
+            lease.fail(e)
+            logger.warning(f"Rejected duplicate social post: {str(e)}")
+            yield f"data: {safe_json_dumps({'type': 'error', 'duplicate': True, 'message': str(e)})}\n\n"
         except Exception as e:
+            lease.fail(e)
             logger.error(f"Error in simplified social scheduler streaming: {str(e)}")
             yield f"data: {safe_json_dumps({'type': 'error', 'message': str(e)})}\n\n"
+        finally:
+            # Early returns and client disconnects must not leave followers waiting
+            lease.fail(RuntimeError("Social scheduler run did not complete"))
     
     return StreamingResponse(
         stream_simple_scheduler(),
@@ -1436,6 +1676,65 @@ async def execute_social_scheduler_realtime(request: SocialSchedulerRequest):
     )
 
 
+@app.get("/scheduled-posts")
+async def list_scheduled_posts(status: Optional[str] = None, limit: int = 100):
+    """List posts in the local scheduling queue, ordered by date_time"""
+    return {
+        "queue_depth": post_queue.depth(),
+        "posts": post_queue.list_posts(status=status, limit=limit),
+    }
+
+
+@app.get("/scheduled-posts/{post_id}")
+async def get_scheduled_post(post_id: int):
+    """Get a single queued post"""
+    post = post_queue.get(post_id)
+    if not post:
+        raise HTTPException(status_code=404, detail=f"Scheduled post {post_id} not found")
+    return post
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of request, plan-run, queue and Replicate metrics"""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/costs")
+async def get_costs(group_by: str = "route", since: Optional[str] = None):
+    """Estimated OpenAI/Replicate cost aggregated by route, customer, step or model"""
+    if group_by not in GROUP_BY_COLUMNS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"group_by must be one of: {', '.join(GROUP_BY_COLUMNS)}",
+        )
+    return {"group_by": group_by, "groups": cost_ledger.aggregate(group_by, since)}
+
+
+@app.get("/costs/jobs/{job_id}")
+async def get_job_costs(job_id: str):
+    """Cost entries of a single job (the X-Job-Id response header)"""
+    job = cost_ledger.job_costs(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@app.get("/instrumentation/steps")
+async def get_step_instrumentation():
+    """Latency percentiles, tool ids and token usage per step name, slowest first"""
+    return {"steps": instrumentation.step_percentiles()}
+
+
+@app.get("/instrumentation/recent")
+async def get_recent_instrumentation(limit: int = 100):
+    """Most recent step records and polled Replicate predictions"""
+    return {
+        "steps": instrumentation.recent_records(limit),
+        "predictions": instrumentation.recent_predictions(limit),
+    }
+
+
 # resume_social_streaming and resume_social_plan functions completely removed - no longer needed without clarifications
 
 # @app.post("/resolve-social-clarification/{plan_run_id}") - removed, no longer needed without clarifications
@@ -0,0 +1,294 @@
+"""
+Load generator for the FastAPI server.
+
+Drives /execute-ugc, /execute-ugc-realtime, /execute-product-ad and
+/execute-social-scheduler-simple with a fixed number of concurrent clients and
+records latency percentiles, error rates, and the server's thread count and
+memory over time (sampled from /metrics).
+
+By default it starts its own server with PORTIA_OFFLINE=1, so every request
+hits the stub tools and stub LLM:
+
+    python benchmarks/bench_load.py --concurrency 16 --duration 60
+    python benchmarks/bench_load.py --base-url http://localhost:8000 --endpoints ugc,social
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.instrumentation import percentile  # noqa: E402
+
+PRODUCT_URL = "https://stub.local/product.png"
+
+ENDPOINTS = {
+    "ugc": "/execute-ugc",
+    "ugc_realtime": "/execute-ugc-realtime",
+    "product_ad": "/execute-product-ad",
+    "social": "/execute-social-scheduler-simple",
+}
+STREAMING_ENDPOINTS = {"ugc_realtime"}
+
+METRIC_LINE = re.compile(r"^(\w+)(\{[^}]*\})?\s+(\S+)$")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", help="Target an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the spawned server")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma separated: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to generate load")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests (0 = use duration)")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-request timeout (s)")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between /metrics samples")
+    parser.add_argument("--tool-latency", type=float, default=0.05, help="Stub tool latency for the spawned server")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Stub LLM latency for the spawned server")
+    parser.add_argument("--polls", type=int, default=1, help="Polls until a stub prediction succeeds")
+    parser.add_argument("--json", dest="json_path", help="Write results and the timeline to this file")
+    return parser.parse_args()
+
+
+def request_body(endpoint: str, n: int) -> Dict[str, Any]:
+    if endpoint in ("ugc", "ugc_realtime"):
+        return {
+            "character_choice": "2",
+            "prebuild_character_choice": n % 9 + 1,
+            "product_url": PRODUCT_URL,
+            "dialog_choice": "2",
+        }
+    if endpoint == "product_ad":
+        return {"product_url": PRODUCT_URL, "ad_prompt": f"Rotating studio shot #{n}"}
+    # Unique media URL and prompt per request so dedupe neither coalesces nor rejects them
+    return {
+        "user_prompt": f"Post this to Instagram in {n % 48 + 1} hours",
+        "media_url": f"https://stub.local/video-{n}.mp4",
+        "product_description": "A white shampoo bottle with a black cap",
+        "dialog": "This shampoo leaves my hair feeling fresh.",
+    }
+
+
+class Results:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.first_event: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.statuses: Dict[str, Dict[str, int]] = {}
+        self.timeline: List[Dict[str, Any]] = []
+
+    def record(self, endpoint: str, seconds: float, status: str, ok: bool, first_event: Optional[float] = None):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        counts = self.statuses.setdefault(endpoint, {})
+        counts[status] = counts.get(status, 0) + 1
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        if first_event is not None:
+            self.first_event.setdefault(endpoint, []).append(first_event)
+
+    def summary(self) -> Dict[str, Any]:
+        summary = {}
+        for endpoint, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            errors = self.errors.get(endpoint, 0)
+            entry = {
+                "requests": len(latencies),
+                "errors": errors,
+                "error_rate": errors / len(latencies),
+                "statuses": self.statuses.get(endpoint, {}),
+                **{f"p{p}_ms": percentile(latencies, p) * 1000 for p in (50, 90, 95, 99)},
+                "max_ms": latencies[-1] * 1000,
+            }
+            if endpoint in self.first_event:
+                first = sorted(self.first_event[endpoint])
+                entry["first_event_p50_ms"] = percentile(first, 50) * 1000
+                entry["first_event_p95_ms"] = percentile(first, 95) * 1000
+            summary[endpoint] = entry
+        return summary
+
+
+async def send(client: httpx.AsyncClient, endpoint: str, n: int, results: Results) -> None:
+    path = ENDPOINTS[endpoint]
+    started_at = time.perf_counter()
+    try:
+        if endpoint in STREAMING_ENDPOINTS:
+            first_event = None
+            ok = True
+            async with client.stream("POST", path, json=request_body(endpoint, n)) as response:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    if first_event is None:
+                        first_event = time.perf_counter() - started_at
+                    try:
+                        event = json.loads(line[6:])
+                    except ValueError:
+                        continue
+                    if event.get("type") == "error":
+                        ok = False
+            ok = ok and response.status_code == 200
+            results.record(
+                endpoint, time.perf_counter() - started_at, str(response.status_code), ok, first_event
+            )
+        else:
+            response = await client.post(path, json=request_body(endpoint, n))
+            results.record(
+                endpoint,
+                time.perf_counter() - started_at,
+                str(response.status_code),
+                response.status_code == 200,
+            )
+    except httpx.HTTPError as e:
+        results.record(endpoint, time.perf_counter() - started_at, type(e).__name__, False)
+
+
+def parse_metrics(text: str) -> Dict[str, float]:
+    """Sum samples per metric name (and keep resident memory separately)"""
+    values: Dict[str, float] = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        if name == "ugc_process_memory_bytes":
+            name = f"{name}_{'resident' if 'resident' in (labels or '') else 'virtual'}"
+        values[name] = values.get(name, 0.0) + float(value)
+    return values
+
+
+async def sample_server(client: httpx.AsyncClient, results: Results, interval: float, stop: asyncio.Event):
+    started_at = time.perf_counter()
+    while not stop.is_set():
+        try:
+            response = await client.get("/metrics", timeout=10)
+            values = parse_metrics(response.text)
+            results.timeline.append(
+                {
+                    "t": round(time.perf_counter() - started_at, 2),
+                    "threads": values.get("ugc_process_threads"),
+                    "rss_mb": (values.get("ugc_process_memory_bytes_resident") or 0) / 1e6,
+                    "http_in_flight": values.get("ugc_http_requests_in_flight"),
+                    "plan_runs_in_flight": values.get("ugc_plan_runs_in_flight", 0.0),
+                }
+            )
+        except httpx.HTTPError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_load(base_url: str, args) -> Results:
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    results = Results()
+    counter = itertools.count()
+    deadline = time.perf_counter() + args.duration
+    limits = httpx.Limits(max_connections=args.concurrency + 2, max_keepalive_connections=args.concurrency + 2)
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_server(client, results, args.sample_interval, stop))
+
+        async def worker():
+            while True:
+                n = next(counter)
+                if args.requests and n >= args.requests:
+                    return
+                if not args.requests and time.perf_counter() >= deadline:
+                    return
+                await send(client, endpoints[n % len(endpoints)], n, results)
+
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        stop.set()
+        await sampler
+    return results
+
+
+def start_server(args) -> subprocess.Popen:
+    state_dir = tempfile.mkdtemp(prefix="ugc-load-")
+    env = {
+        **os.environ,
+        "PORTIA_OFFLINE": "1",
+        "STUB_TOOL_LATENCY_SECONDS": str(args.tool_latency),
+        "STUB_LLM_LATENCY_SECONDS": str(args.llm_latency),
+        "STUB_POLLS_TO_COMPLETE": str(args.polls),
+        "SCHEDULED_POSTS_DB": os.path.join(state_dir, "scheduled_posts.db"),
+        "COST_LEDGER_DB": os.path.join(state_dir, "cost_ledger.db"),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_server:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=ROOT,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    for _ in range(120):
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("Server did not become healthy within 60s")
+
+
+def print_results(summary: Dict[str, Any], timeline: List[Dict[str, Any]]) -> None:
+    print(f"\n{'endpoint':<14} {'reqs':>6} {'err%':>6} {'p50':>9} {'p90':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for endpoint, entry in summary.items():
+        print(
+            f"{endpoint:<14} {entry['requests']:>6} {entry['error_rate'] * 100:>5.1f}% "
+            f"{entry['p50_ms']:>7.0f}ms {entry['p90_ms']:>7.0f}ms {entry['p95_ms']:>7.0f}ms "
+            f"{entry['p99_ms']:>7.0f}ms {entry['max_ms']:>7.0f}ms"
+        )
+        if "first_event_p50_ms" in entry:
+            print(f"{'':<14} first event p50={entry['first_event_p50_ms']:.0f}ms p95={entry['first_event_p95_ms']:.0f}ms")
+    if timeline:
+        threads = [s["threads"] for s in timeline if s["threads"] is not None]
+        rss = [s["rss_mb"] for s in timeline if s["rss_mb"]]
+        print(
+            f"\n🧵 threads max={max(threads, default=0):.0f} "
+            f"💾 rss start={rss[0] if rss else 0:.0f}MB max={max(rss, default=0):.0f}MB "
+            f"end={rss[-1] if rss else 0:.0f}MB ({len(timeline)} samples)"
+        )
+
+
+def main():
+    args = parse_args()
+    server = None if args.base_url else start_server(args)
+    base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+    try:
+        started_at = time.perf_counter()
+        results = asyncio.run(run_load(base_url, args))
+        elapsed = time.perf_counter() - started_at
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+
+    summary = results.summary()
+    total = sum(entry["requests"] for entry in summary.values())
+    print(f"\n🚀 {total} requests in {elapsed:.1f}s ({total / elapsed:.2f} req/s) at concurrency {args.concurrency}")
+    print_results(summary, results.timeline)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"config": vars(args), "endpoints": summary, "timeline": results.timeline}, f, indent=2)
+        print(f"\n💾 Results written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Offline orchestration benchmark for the UGC, product-ad and scheduler flows.
+
+Runs the real plans against the stub tool registry and stub LLM
+(PORTIA_OFFLINE=1), so the numbers are Portia/framework overhead plus the
+configured stub latencies. Needs no network or API keys.
+
+    python benchmarks/bench_orchestration.py --iterations 20 --tool-latency 0.05
+    python benchmarks/bench_orchestration.py --flows ugc,social --json results.json
+
+Compare the GPT-4o text steps through Replicate with direct OpenAI calls
+(TEXT_GENERATION_PROVIDER) by running both providers with a realistic LLM latency:
+
+    python benchmarks/bench_orchestration.py --llm-latency 1.5 --text-provider replicate --json replicate.json
+    python benchmarks/bench_orchestration.py --llm-latency 1.5 --text-provider openai --json openai.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLOWS = ("ugc", "product_ad", "social")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10, help="Runs per flow")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per flow")
+    parser.add_argument("--flows", default=",".join(FLOWS), help="Comma separated: " + ", ".join(FLOWS))
+    parser.add_argument("--tool-latency", type=float, default=0.05, help="Stub tool latency (s)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Stub LLM latency (s)")
+    parser.add_argument("--polls", type=int, default=3, help="Polls until a stub prediction succeeds")
+    parser.add_argument(
+        "--text-provider",
+        choices=("replicate", "openai"),
+        default="replicate",
+        help="TEXT_GENERATION_PROVIDER for the description, dialog and caption steps",
+    )
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file")
+    return parser.parse_args()
+
+
+def configure_offline(args) -> None:
+    """Must run before anything imports utils.config"""
+    os.environ["PORTIA_OFFLINE"] = "1"
+    os.environ["STUB_TOOL_LATENCY_SECONDS"] = str(args.tool_latency)
+    os.environ["STUB_LLM_LATENCY_SECONDS"] = str(args.llm_latency)
+    os.environ["STUB_POLLS_TO_COMPLETE"] = str(args.polls)
+    os.environ["TEXT_GENERATION_PROVIDER"] = args.text_provider
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def build_flows() -> Dict[str, Callable[[int], Any]]:
+    from main import create_product_ad_plan, get_ugc_plan, poll_prediction_until_complete
+    from social_scheduler import (
+        SchedulingData,
+        convert_natural_time_to_iso,
+        create_sheets_integration_plan,
+        create_simple_social_scheduler_plan,
+    )
+    from utils.config import get_ephemeral_portia, get_portia
+
+    portia = get_portia()
+    polling_portia = get_ephemeral_portia()
+    plan = get_ugc_plan()
+
+    def ugc(i: int):
+        # Alternate between the custom-avatar and prebuilt-character branches
+        custom = i % 2 == 0
+        run = portia.run_plan(
+            plan,
+            plan_run_inputs={
+                "character_choice": "1" if custom else "2",
+                "custom_character_url": "https://stub.local/character.png" if custom else "",
+                "prebuild_character_choice": 0 if custom else 1,
+                "product_url": "https://stub.local/product.png",
+                "dialog_choice": "2",
+                "custom_dialog": "",
+            },
+        )
+        prediction = run.outputs.final_output.value
+        return poll_prediction_until_complete(polling_portia, prediction.id, delay_seconds=0)
+
+    def product_ad(i: int):
+        run = portia.run_plan(
+            create_product_ad_plan(),
+            plan_run_inputs={
+                "product_url": "https://stub.local/product.png",
+                "ad_prompt": "Studio shot of the bottle rotating slowly",
+            },
+        )
+        prediction = run.outputs.final_output.value
+        return poll_prediction_until_complete(polling_portia, prediction.id, delay_seconds=0)
+
+    def social(i: int):
+        scheduler_run = portia.run_plan(
+            create_simple_social_scheduler_plan(),
+            plan_run_inputs={
+                "user_prompt": "Post this to Instagram and Twitter tomorrow at 3pm",
+                "media_url": "https://stub.local/video.mp4",
+                "product_description": "A white shampoo bottle with a black cap",
+                "dialog": "This shampoo leaves my hair feeling fresh.",
+            },
+        )
+        outputs = scheduler_run.outputs.step_outputs
+        captions = outputs["generate_captions"].value
+        final_data = SchedulingData(
+            media_url="https://stub.local/video.mp4",
+            instagram_caption=captions.instagram_caption,
+            date_time=convert_natural_time_to_iso(outputs["extract_time"].value.extracted_time),
+            twitter_post=captions.twitter_post or "",
+            channel=captions.channel,
+        )
+        return portia.run_plan(
+            create_sheets_integration_plan(final_data),
+            plan_run_inputs=final_data.model_dump(),
+        )
+
+    return {"ugc": ugc, "product_ad": product_ad, "social": social}
+
+
+def summarize_steps(records: List[Any], llm_latency: float) -> Dict[str, Dict[str, float]]:
+    """Per-step wall time and overhead (wall minus stub tool and LLM time)"""
+    from utils.instrumentation import percentile
+
+    by_step: Dict[str, List[Any]] = {}
+    for record in records:
+        by_step.setdefault(f"{record.plan_name} / {record.step_name}", []).append(record)
+    summary = {}
+    for name, step_records in by_step.items():
+        overhead = sorted(
+            max(r.wall_seconds - r.tool_seconds - r.llm_calls * llm_latency, 0.0) for r in step_records
+        )
+        wall = sorted(r.wall_seconds for r in step_records)
+        summary[name] = {
+            "count": len(step_records),
+            "wall_p50_ms": percentile(wall, 50) * 1000,
+            "overhead_p50_ms": percentile(overhead, 50) * 1000,
+            "overhead_p95_ms": percentile(overhead, 95) * 1000,
+        }
+    return summary
+
+
+def run_benchmark(args) -> Dict[str, Any]:
+    from utils.instrumentation import instrumentation, percentile
+
+    flows = build_flows()
+    selected = [name.strip() for name in args.flows.split(",") if name.strip()]
+    collected: List[Any] = []
+    instrumentation.add_listener(collected.append)
+
+    results = {"config": vars(args), "flows": {}}
+    for name in selected:
+        flow = flows[name]
+        for i in range(args.warmup):
+            flow(i)
+        collected.clear()
+
+        durations = []
+        errors = 0
+        started_at = time.perf_counter()
+        for i in range(args.iterations):
+            run_started = time.perf_counter()
+            try:
+                flow(i)
+            except Exception as e:
+                errors += 1
+                print(f"❌ {name} run {i} failed: {e}")
+            durations.append(time.perf_counter() - run_started)
+        elapsed = time.perf_counter() - started_at
+
+        durations.sort()
+        results["flows"][name] = {
+            "runs": args.iterations,
+            "errors": errors,
+            "throughput_per_second": args.iterations / elapsed if elapsed else 0.0,
+            "run_p50_ms": percentile(durations, 50) * 1000,
+            "run_p95_ms": percentile(durations, 95) * 1000,
+            "steps": summarize_steps(collected, args.llm_latency),
+        }
+    return results
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    for name, flow in results["flows"].items():
+        print(f"\n=== {name} ===")
+        print(
+            f"runs={flow['runs']} errors={flow['errors']} "
+            f"throughput={flow['throughput_per_second']:.2f}/s "
+            f"p50={flow['run_p50_ms']:.1f}ms p95={flow['run_p95_ms']:.1f}ms"
+        )
+        print(f"{'step':<70} {'n':>5} {'wall p50':>10} {'ovh p50':>10} {'ovh p95':>10}")
+        steps = sorted(flow["steps"].items(), key=lambda item: -item[1]["overhead_p50_ms"])
+        for step_name, step in steps:
+            print(
+                f"{step_name[:70]:<70} {step['count']:>5} {step['wall_p50_ms']:>9.1f}ms "
+                f"{step['overhead_p50_ms']:>9.1f}ms {step['overhead_p95_ms']:>9.1f}ms"
+            )
+
+
+def main():
+    args = parse_args()
+    configure_offline(args)
+    results = run_benchmark(args)
+    print_results(results)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
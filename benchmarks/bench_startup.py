@@ -0,0 +1,106 @@
+"""
+Cold-start benchmark for the CLI and API server import path.
+
+Each measurement runs in a fresh interpreter, so nothing is cached between
+runs. It times importing utils.config, main and api_server, and then the first
+`get_portia()` call (config, tool registry and client construction). The
+imports should stay cheap; the real work is deferred to the first
+`get_portia()` call.
+
+    python benchmarks/bench_startup.py --repeats 5
+    python benchmarks/bench_startup.py --online   # real PortiaToolRegistry (needs keys)
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.instrumentation import percentile  # noqa: E402
+
+# Each probe prints a JSON object of phase -> seconds
+PROBES = {
+    "import utils.config": "import utils.config",
+    "import main": "import main",
+    "import api_server": "import api_server",
+    "import main + get_portia()": "import main\n_t1 = time.perf_counter()\nutils.config.get_portia()",
+    "import main + get_portia() + plan": (
+        "import main\n_t1 = time.perf_counter()\nutils.config.get_portia()\nmain.get_ugc_plan()"
+    ),
+}
+
+PROBE_TEMPLATE = """
+import json, time
+_t0 = time.perf_counter()
+_t1 = None
+{body}
+import utils.config
+_end = time.perf_counter()
+print(json.dumps({{"total": _end - _t0, "import": (_t1 or _end) - _t0, "first_use": (_end - _t1) if _t1 else 0.0}}))
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters per probe")
+    parser.add_argument("--online", action="store_true", help="Do not set PORTIA_OFFLINE=1")
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file")
+    return parser.parse_args()
+
+
+def run_probe(body: str, env: Dict[str, str]) -> Dict[str, float]:
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE_TEMPLATE.format(body=body)],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=600,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else "probe failed")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    env = {**os.environ, "PORTIA_WARMUP_ON_STARTUP": "false"}
+    if not args.online:
+        env["PORTIA_OFFLINE"] = "1"
+        env["ANONYMIZED_TELEMETRY"] = "false"
+
+    results = {"config": vars(args), "probes": {}}
+    print(f"{'probe':<36} {'import p50':>11} {'first use p50':>14} {'total p50':>10} {'total max':>10}")
+    for name, body in PROBES.items():
+        samples: List[Dict[str, float]] = []
+        try:
+            for _ in range(args.repeats):
+                samples.append(run_probe(body, env))
+        except Exception as e:
+            print(f"{name:<36} ❌ {e}")
+            results["probes"][name] = {"error": str(e)}
+            continue
+        entry = {}
+        for phase in ("import", "first_use", "total"):
+            values = sorted(sample[phase] for sample in samples)
+            entry[f"{phase}_p50_ms"] = percentile(values, 50) * 1000
+            entry[f"{phase}_max_ms"] = values[-1] * 1000
+        results["probes"][name] = entry
+        print(
+            f"{name:<36} {entry['import_p50_ms']:>9.0f}ms {entry['first_use_p50_ms']:>12.0f}ms "
+            f"{entry['total_p50_ms']:>8.0f}ms {entry['total_max_ms']:>8.0f}ms"
+        )
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Offline benchmark of fixed-argument Replicate calls: agent step vs direct call.
+
+Builds the product-ad prediction both ways and runs them against the stub
+tools and stub LLM (PORTIA_OFFLINE=1):
+
+    agent   single_tool_agent_step, an LLM turn writes the tool arguments
+    direct  the plan main.py ships: arguments built and validated in code,
+            then invoke_tool_step (no LLM call)
+
+Set --llm-latency to a realistic GPT-4o round trip to see what each removed
+agent turn saves per job (the UGC plan drops two of them, the product-ad plan one).
+
+    python benchmarks/bench_tool_steps.py --iterations 20 --llm-latency 1.5
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INPUTS = {
+    "product_url": "https://stub.local/product.png",
+    "ad_prompt": "Studio shot of the bottle rotating slowly",
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10, help="Runs per variant")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per variant")
+    parser.add_argument("--tool-latency", type=float, default=0.05, help="Stub tool latency (s)")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Stub LLM latency (s)")
+    parser.add_argument("--json", dest="json_path", help="Write the results to this file")
+    return parser.parse_args()
+
+
+def configure_offline(args) -> None:
+    """Must run before anything imports utils.config"""
+    os.environ["PORTIA_OFFLINE"] = "1"
+    os.environ["STUB_TOOL_LATENCY_SECONDS"] = str(args.tool_latency)
+    os.environ["STUB_LLM_LATENCY_SECONDS"] = str(args.llm_latency)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+
+def agent_plan():
+    """The product-ad plan as it was before the direct call"""
+    from portia import PlanBuilderV2
+    from portia.builder.reference import Input
+
+    from main import CREATE_PREDICTIONS_TOOL_ID, PRODUCT_AD_MODEL_VERSION, PREDICTION_JQ_FILTER, PredictionPolling
+
+    return (
+        PlanBuilderV2("Product Ad Generator (agent step)")
+        .input(name="product_url", description="Product image URL (optional)")
+        .input(name="ad_prompt", description="Ad prompt from user")
+        .single_tool_agent_step(
+            tool=CREATE_PREDICTIONS_TOOL_ID,
+            task=f"""
+        Call the tool with this EXACT structure:
+        {{
+          "version": "{PRODUCT_AD_MODEL_VERSION}",
+          "input": {{
+            "prompt": [use the ad_prompt input],
+            "lighting": "auto",
+            "audio_mode": "off",
+            "image_style": "studio",
+            "camera_movement": "auto",
+            "reference_image": [use the product_url input]
+          }},
+          "jq_filter": "{PREDICTION_JQ_FILTER}",
+          "Prefer": "wait=1"
+        }}
+        ONLY RETURN "id" and "status" in the output JSON.
+        """,
+            inputs=[Input("product_url"), Input("ad_prompt")],
+            step_name="generate_product_ad",
+            output_schema=PredictionPolling,
+        )
+        .final_output()
+        .build()
+    )
+
+
+def run_benchmark(args) -> Dict[str, Any]:
+    from main import get_product_ad_plan
+    from utils.config import get_portia
+    from utils.instrumentation import instrumentation, percentile
+
+    portia = get_portia()
+    variants = {"agent": agent_plan(), "direct": get_product_ad_plan()}
+    collected: List[Any] = []
+    instrumentation.add_listener(collected.append)
+
+    results = {"config": vars(args), "variants": {}}
+    for name, plan in variants.items():
+        for _ in range(args.warmup):
+            portia.run_plan(plan, plan_run_inputs=INPUTS)
+        collected.clear()
+
+        durations = []
+        errors = 0
+        for i in range(args.iterations):
+            started_at = time.perf_counter()
+            try:
+                run = portia.run_plan(plan, plan_run_inputs=INPUTS)
+                if not run.outputs.final_output.value.id:
+                    raise ValueError("no prediction id")
+            except Exception as e:
+                errors += 1
+                print(f"❌ {name} run {i} failed: {e}")
+            durations.append(time.perf_counter() - started_at)
+
+        durations.sort()
+        results["variants"][name] = {
+            "runs": args.iterations,
+            "errors": errors,
+            "run_p50_ms": percentile(durations, 50) * 1000,
+            "run_p95_ms": percentile(durations, 95) * 1000,
+            "llm_calls_per_run": sum(r.llm_calls for r in collected) / max(args.iterations, 1),
+        }
+    agent, direct = results["variants"]["agent"], results["variants"]["direct"]
+    results["saved_p50_ms"] = agent["run_p50_ms"] - direct["run_p50_ms"]
+    return results
+
+
+def print_results(results: Dict[str, Any]) -> None:
+    print(f"{'variant':<10} {'runs':>5} {'errors':>7} {'p50':>10} {'p95':>10} {'llm calls':>10}")
+    for name, variant in results["variants"].items():
+        print(
+            f"{name:<10} {variant['runs']:>5} {variant['errors']:>7} {variant['run_p50_ms']:>8.1f}ms "
+            f"{variant['run_p95_ms']:>8.1f}ms {variant['llm_calls_per_run']:>10.1f}"
+        )
+    print(f"\nSaved per call (p50): {results['saved_p50_ms']:.1f}ms")
+
+
+def main():
+    args = parse_args()
+    configure_offline(args)
+    results = run_benchmark(args)
+    print_results(results)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,24 @@
 from portia import PlanBuilderV2
 from portia.builder.reference import StepOutput, Input
-from pydantic import BaseModel
-from utils.config import portia
+from pydantic import AnyHttpUrl, BaseModel, ConfigDict, Field
+from typing import Optional
+from utils.config import get_ephemeral_portia, get_portia
+from utils.circuit_breaker import circuit_breakers
+from utils.instrumentation import instrumentation
+from utils.plan_steps import register_plan
+from utils.text_generation import TEXT_GENERATION_PROVIDER, generate_structured
+import functools
 import json
 
+CREATE_PREDICTIONS_TOOL_ID = "portia:mcp:custom:mcp.replicate.com:create_predictions"
+GET_PREDICTIONS_TOOL_ID = "portia:mcp:custom:mcp.replicate.com:get_predictions"
+
+# Replicate model versions called with fixed arguments (invoke_tool_step, no agent turn)
+AVATAR_MODEL_VERSION = "706321a35bebe81c99cb83a6b6db6b1cc0b7281f8da9be48a438de5e0aea3183"
+UGC_VIDEO_MODEL_VERSION = "07a0f547a5c73f587de8251543f9f07e7b38fc4b3af7512bfaeebba428216270"
+PRODUCT_AD_MODEL_VERSION = "7428dcc4cdb6d758301c2ae57ca01279e9b6899c5cb01f18f4d577c412b14390"
+PREDICTION_JQ_FILTER = "{id: .id, status: .status}"
+
 
 # Predefined character URLs
 prebuild_character_urls = [
@@ -215,11 +230,17 @@ def pick_first_url(value: object) -> str:
         import json
 
         data = value
-        if isinstance(value, str):
+        # Raw MCP tool output (invoke_tool_step) wraps the JSON text in content items
+        if isinstance(data, dict) and isinstance(data.get("content"), list):
+            texts = [item.get("text") for item in data["content"] if isinstance(item, dict)]
+            data = next((text for text in texts if text), "")
+        if isinstance(data, str):
             try:
-                data = json.loads(value)
+                data = json.loads(data)
             except json.JSONDecodeError:
-                return value
+                return data
+        if isinstance(data, dict) and "output" in data:
+            data = data["output"]
         if isinstance(data, list) and data:
             return str(data[0])
         if isinstance(data, str):
@@ -307,7 +328,7 @@ def extract_id_and_status(value):
     """Robustly extract prediction id and status from various shapes.
 
     Handles:
-    - dicts with id/status
+    - dicts with id/status and pydantic models
     - strings containing JSON
     - single_tool_agent_step wrapped dict: { content: [{ text: "{\"id\":..., \"status\":...}" }] }
     - fallback regex over string representation
@@ -317,6 +338,10 @@ def extract_id_and_status(value):
     print(f"[DEBUG] extract_id_and_status input type: {type(value)}")
     print(f"[DEBUG] extract_id_and_status input value: {value}")
 
+    # 0) Plan outputs parsed into a model (PredictionPolling)
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+
     # 1) Wrapped structure from single_tool_agent_step
     try:
         print(f"[DEBUG] Checking if wrapped structure...")
@@ -392,33 +417,49 @@ def extract_id_and_status(value):
         return None, None
 
 
+@functools.lru_cache(maxsize=None)
+def get_polling_plan():
+    """Single get_predictions call, built once and run for every poll"""
+    return register_plan(
+        PlanBuilderV2("Poll Replicate prediction")
+        .input(name="prediction_id", description="Replicate prediction id")
+        .invoke_tool_step(
+            tool=GET_PREDICTIONS_TOOL_ID,
+            args={
+                "prediction_id": Input("prediction_id"),
+            },
+            step_name="get_prediction_status",
+        )
+        .final_output(output_schema=PredictionStatus)
+        .build()
+    )
+
+
 def poll_prediction_until_complete(
     portia, prediction_id, max_attempts=300, delay_seconds=2
 ):
     """Poll a Replicate prediction until it's complete"""
     import time
 
-    for attempt in range(max_attempts):
-        print(f"Polling attempt {attempt + 1}/{max_attempts}...")
+    started_at = time.time()
 
-        # Create polling plan
-        polling_plan = (
-            PlanBuilderV2("Poll Replicate prediction")
-            .invoke_tool_step(
-                tool="portia:mcp:custom:mcp.replicate.com:get_predictions",
-                args={
-                    "prediction_id": prediction_id,
-                },
-                step_name="get_prediction_status",
-            )
-            .final_output(output_schema=PredictionStatus)
-            .build()
+    def record(attempts, status):
+        instrumentation.record_prediction(
+            prediction_id, attempts, time.time() - started_at, status
         )
 
-        # Run polling plan
+    for attempt in range(max_attempts):
+        # Stop early instead of burning attempts against an upstream known to be down
+        if circuit_breakers.get(GET_PREDICTIONS_TOOL_ID).is_open():
+            print("❌ Replicate get_predictions is unavailable (circuit open), giving up")
+            record(attempt, "circuit_open")
+            return None
+
+        print(f"Polling attempt {attempt + 1}/{max_attempts}...")
+
         polling_run = portia.run_plan(
-            polling_plan,
-            plan_run_inputs={},
+            get_polling_plan(),
+            plan_run_inputs={"prediction_id": prediction_id},
         )
 
         result = polling_run.outputs.final_output.value
@@ -439,9 +480,11 @@ def poll_prediction_until_complete(
 
         if status == "succeeded" and output:
             print("✅ Prediction completed successfully!")
+            record(attempt + 1, status)
             return output
         elif status in ["failed", "canceled"]:
             print(f"❌ Prediction failed with status: {status}")
+            record(attempt + 1, status)
             return None
         elif status in ["starting", "processing"]:
             print(f"⏳ Still processing... (status: {status})")
@@ -451,6 +494,7 @@ def poll_prediction_until_complete(
             time.sleep(delay_seconds)
 
     print(f"❌ Timed out after {max_attempts} attempts")
+    record(max_attempts, "timeout")
     return None
 
 
@@ -613,6 +657,83 @@ class PredictionStatus(BaseModel):
     output: list = None
 
 
+# Inputs of the Replicate models called with invoke_tool_step. The builders below
+# validate them before the call, so a bad argument fails the step instead of
+# becoming a failed (and billed) prediction.
+
+
+class AvatarInput(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    user_image: AnyHttpUrl
+    magic_prompt: bool = False
+    avatar_preset: str = "Home Office Avatar"
+    debug_mode: bool = False
+
+
+class UGCVideoInput(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    avatar_image: AnyHttpUrl
+    product_image: AnyHttpUrl
+    product_description: str = Field(min_length=1)
+    dialogs: str = Field(min_length=1)
+    debug_mode: bool = False
+
+
+class ProductAdInput(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+
+    prompt: str = Field(min_length=1)
+    lighting: str = "auto"
+    audio_mode: str = "off"
+    image_style: str = "studio"
+    camera_movement: str = "auto"
+    reference_image: Optional[AnyHttpUrl] = None
+
+
+def output_field(value, field: str) -> str:
+    """`field` of a step output that may be a model, a dict or JSON text"""
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            return value
+    if isinstance(value, dict):
+        return str(value.get(field) or "")
+    return str(value or "")
+
+
+def avatar_input(user_image: str) -> dict:
+    return AvatarInput(user_image=user_image).model_dump(mode="json")
+
+
+def ugc_video_input(character_url: str, product_url: str, product_description, dialog) -> dict:
+    return UGCVideoInput(
+        avatar_image=character_url,
+        product_image=product_url,
+        product_description=output_field(product_description, "description"),
+        dialogs=output_field(dialog, "dialog"),
+    ).model_dump(mode="json")
+
+
+def product_ad_input(ad_prompt: str, product_url: Optional[str] = None, lighting: str = "auto") -> dict:
+    # Text-only ads leave out reference_image entirely
+    return ProductAdInput(
+        prompt=ad_prompt, lighting=lighting, reference_image=product_url or None
+    ).model_dump(mode="json", exclude_none=True)
+
+
+def prediction_from_output(raw) -> PredictionPolling:
+    """{id, status} of a create_predictions response filtered with PREDICTION_JQ_FILTER"""
+    fields = parse_ugc_prediction(raw)
+    if not fields.get("id"):
+        raise ValueError(f"create_predictions returned no prediction id: {raw}")
+    return PredictionPolling(id=fields["id"], status=fields.get("status") or "starting")
+
+
 def extract_id_and_status_vinayak_way(raw):
     print("Vinayak", raw)
     print("Vinayak", type(raw))
@@ -628,156 +749,96 @@ def extract_id_and_status_vinayak_way(raw):
     return textObject
 
 
-# Build the plan using PlanBuilderV2
-plan = (
-    PlanBuilderV2("UGC Generator - Character and Product Setup with Replicate")
-    .input(
-        name="character_choice",
-        description="User choice: 1 for custom character, 2 for prebuild characters",
+def describe_product_directly(product_url: str, system_prompt: str) -> ProductDescription:
+    """One structured GPT-4o call with the product image (TEXT_GENERATION_PROVIDER=openai)"""
+    return generate_structured(
+        ProductDescription,
+        system_prompt,
+        "Write Prompt for this product",
+        image_urls=[product_url],
     )
-    .input(
-        name="custom_character_url",
-        description="Custom character URL (required if character_choice is 1)",
-        default_value="",
-    )
-    .input(
-        name="prebuild_character_choice",
-        description="Prebuild character choice number 1-9 (required if character_choice is 2)",
-        default_value=0,
-    )
-    .input(name="product_url", description="Product image URL")
-    .input(
-        name="system_prompt",
-        description="LLM system prompt",
-        default_value=PRODUCT_DESCRIPTION_SYSTEM_PROMPT,
-    )
-    .input(
-        name="dialog_choice",
-        description="Dialog choice: 1 for custom dialog, 2 for auto generate",
-    )
-    .input(
-        name="custom_dialog",
-        description="Custom dialog (required if dialog_choice is 1)",
-        default_value="",
-    )
-    .input(
-        name="dialog_system_prompt",
-        description="Dialog generation system prompt",
-        default_value=DIALOG_GENERATION_SYSTEM_PROMPT,
-    )
-    .function_step(
-        function=get_character_url,
-        args={
-            "choice": Input("character_choice"),
-            "custom_url": Input("custom_character_url"),
-            "prebuild_choice": Input("prebuild_character_choice"),
-        },
-        step_name="get_character_url",
-    )
-    .if_(
-        condition=lambda choice: choice == "1",
-        args={"choice": Input("character_choice")},
-    )
-    .single_tool_agent_step(
-        tool="portia:mcp:custom:mcp.replicate.com:create_predictions",
-        task="""
-        You MUST call the UGC Avatar Replicate model with EXACT arguments and return ONLY the jq-filtered output.
-
-        Required call:
-        - version: 706321a35bebe81c99cb83a6b6db6b1cc0b7281f8da9be48a438de5e0aea3183
-        - input.user_image: the provided character URL
-        - input.magic_prompt: false
-        - input.avatar_preset: "Home Office Avatar"
-        - input.debug_mode: false
-        - Prefer: wait
-        - jq_filter: ".output"
-
-        Do not produce any analysis or text. The step output must be ONLY the jq-filtered result from the tool.
-        """,
-        inputs=[StepOutput("get_character_url")],
-        step_name="avatar_output_raw",
-    )
-    .function_step(
-        function=pick_first_url,
-        args={"value": StepOutput("avatar_output_raw")},
-        step_name="character_url_generated",
-    )
-    .else_()
-    .function_step(
-        function=lambda url: url,
-        args={"url": StepOutput("get_character_url")},
-        step_name="character_url_prebuilt",
-    )
-    .endif()
-    .function_step(
-        function=lambda gen, pre, choice: gen if choice == "1" else pre,
-        args={
-            "gen": StepOutput("character_url_generated"),
-            "pre": StepOutput("character_url_prebuilt"),
-            "choice": Input("character_choice"),
-        },
-        step_name="character_url_final",
-    )
-    .function_step(
-        function=validate_url,
-        args={"url": Input("product_url")},
-        step_name="validate_product_url",
-    )
-    .single_tool_agent_step(
+
+
+def product_description_step(builder):
+    """Add generate_product_description, written directly by OpenAI or through Replicate"""
+    if TEXT_GENERATION_PROVIDER == "openai":
+        return builder.function_step(
+            function=describe_product_directly,
+            args={"product_url": Input("product_url"), "system_prompt": Input("system_prompt")},
+            step_name="generate_product_description",
+            output_schema=ProductDescription,
+        )
+
+    return builder.single_tool_agent_step(
         tool="portia:mcp:custom:mcp.replicate.com:create_predictions",
         task="""
-        CRITICAL: You MUST include ALL required parameters in your tool call.
-
-        Call the tool with this EXACT structure:
-        {
-          "version": "openai/gpt-4o",
-          "input": {
-            "prompt": "Write Prompt for this product",
-            "system_prompt": [use the system_prompt input],
-            "image_input": [[use the product_url input]]
-          },
-          "jq_filter": ".output",
-          "Prefer": "wait"
-        }
-
-        DO NOT OMIT THE "version" FIELD. It is required and must be "openai/gpt-4o".
-        THE Image input must be a list with the product url as the first element.
-        
-        IMPORTANT: Extract the product description text from the array output and return it in this format:
-        {
-          "description": "product description text here"
-        }
-        """,
+    CRITICAL: You MUST include ALL required parameters in your tool call.
+
+    Call the tool with this EXACT structure:
+    {
+      "version": "openai/gpt-4o",
+      "input": {
+        "prompt": "Write Prompt for this product",
+        "system_prompt": [use the system_prompt input],
+        "image_input": [[use the product_url input]]
+      },
+      "jq_filter": ".output",
+      "Prefer": "wait"
+    }
+
+    DO NOT OMIT THE "version" FIELD. It is required and must be "openai/gpt-4o".
+    THE Image input must be a list with the product url as the first element.
+    
+    IMPORTANT: Extract the product description text from the array output and return it in this format:
+    {
+      "description": "product description text here"
+    }
+    """,
         inputs=[Input("product_url"), Input("system_prompt")],
         step_name="generate_product_description",
         output_schema=ProductDescription,
     )
-    .if_(
-        condition=lambda choice: choice == "2",
-        args={"choice": Input("dialog_choice")},
-    )
-    .single_tool_agent_step(
+
+
+def auto_dialog_step(builder):
+    """Add generate_auto_dialog, written directly by OpenAI or through Replicate"""
+    if TEXT_GENERATION_PROVIDER == "openai":
+        return builder.llm_step(
+            task="""
+    Write the dialog for a UGC video about the product described in the
+    generate_product_description output, following the instructions in the
+    dialog_system_prompt input exactly. Return only the dialog text.
+    """,
+            inputs=[
+                StepOutput("generate_product_description"),
+                Input("dialog_system_prompt"),
+            ],
+            step_name="generate_auto_dialog",
+            output_schema=DialogOutput,
+        )
+
+    return builder.single_tool_agent_step(
         tool="portia:mcp:custom:mcp.replicate.com:create_predictions",
         task="""
-        - Call GPT-4o with this structure:
-        {
-          "version": "openai/gpt-4o",
-          "input": {
-            "prompt": [use the generate_product_description.description output],
-            "system_prompt": [use the dialog_system_prompt input]
-          },
-          "jq_filter": ".output",
-          "Prefer": "wait"
-        }
-        - Extract the dialog text from the array output
-
-        IMPORTANT: Return the final dialog text in this format:
-        {
-          "dialog": [generated dialog text here]
-        }
-        DO NOT OMIT THE "version" FIELD when calling GPT-4o. It is required and must be "openai/gpt-4o".
-        - RETURN IN THIS FORMAT ONLY
-        """,
+    - Call GPT-4o with this structure:
+    {
+      "version": "openai/gpt-4o",
+      "input": {
+        "prompt": [use the generate_product_description.description output],
+        "system_prompt": [use the dialog_system_prompt input]
+      },
+      "jq_filter": ".output",
+      "Prefer": "wait"
+    }
+    - Extract the dialog text from the array output
+
+    IMPORTANT: Return the final dialog text in this format:
+    {
+      "dialog": [generated dialog text here]
+    }
+    DO NOT OMIT THE "version" FIELD when calling GPT-4o. It is required and must be "openai/gpt-4o".
+    - RETURN IN THIS FORMAT ONLY
+    """,
         inputs=[
             StepOutput("generate_product_description"),
             Input("dialog_system_prompt"),
@@ -785,16 +846,119 @@ plan = (
         step_name="generate_auto_dialog",
         output_schema=DialogOutput,
     )
-    .else_()
-    .function_step(
-        function=lambda custom_dialog: {"dialog": custom_dialog},
-        args={"custom_dialog": Input("custom_dialog")},
-        step_name="use_custom_dialog",
-        output_schema=DialogOutput,
+
+
+def create_ugc_plan():
+    """Build the UGC plan using PlanBuilderV2"""
+    builder = (
+        PlanBuilderV2("UGC Generator - Character and Product Setup with Replicate")
+        .input(
+            name="character_choice",
+            description="User choice: 1 for custom character, 2 for prebuild characters",
+        )
+        .input(
+            name="custom_character_url",
+            description="Custom character URL (required if character_choice is 1)",
+            default_value="",
+        )
+        .input(
+            name="prebuild_character_choice",
+            description="Prebuild character choice number 1-9 (required if character_choice is 2)",
+            default_value=0,
+        )
+        .input(name="product_url", description="Product image URL")
+        .input(
+            name="system_prompt",
+            description="LLM system prompt",
+            default_value=PRODUCT_DESCRIPTION_SYSTEM_PROMPT,
+        )
+        .input(
+            name="dialog_choice",
+            description="Dialog choice: 1 for custom dialog, 2 for auto generate",
+        )
+        .input(
+            name="custom_dialog",
+            description="Custom dialog (required if dialog_choice is 1)",
+            default_value="",
+        )
+        .input(
+            name="dialog_system_prompt",
+            description="Dialog generation system prompt",
+            default_value=DIALOG_GENERATION_SYSTEM_PROMPT,
+        )
+        .function_step(
+            function=get_character_url,
+            args={
+                "choice": Input("character_choice"),
+                "custom_url": Input("custom_character_url"),
+                "prebuild_choice": Input("prebuild_character_choice"),
+            },
+            step_name="get_character_url",
+        )
+        .if_(
+            condition=lambda choice: choice == "1",
+            args={"choice": Input("character_choice")},
+        )
+        .function_step(
+            function=avatar_input,
+            args={"user_image": StepOutput("get_character_url")},
+            step_name="avatar_input",
+        )
+        .invoke_tool_step(
+            tool=CREATE_PREDICTIONS_TOOL_ID,
+            args={
+                "version": AVATAR_MODEL_VERSION,
+                "input": StepOutput("avatar_input"),
+                "Prefer": "wait",
+                # metrics.predict_time is what the cost ledger charges
+                "jq_filter": "{output: .output, metrics: .metrics}",
+            },
+            step_name="avatar_output_raw",
+        )
+        .function_step(
+            function=pick_first_url,
+            args={"value": StepOutput("avatar_output_raw")},
+            step_name="character_url_generated",
+        )
+        .else_()
+        .function_step(
+            function=lambda url: url,
+            args={"url": StepOutput("get_character_url")},
+            step_name="character_url_prebuilt",
+        )
+        .endif()
+        .function_step(
+            function=lambda gen, pre, choice: gen if choice == "1" else pre,
+            args={
+                "gen": StepOutput("character_url_generated"),
+                "pre": StepOutput("character_url_prebuilt"),
+                "choice": Input("character_choice"),
+            },
+            step_name="character_url_final",
+        )
+        .function_step(
+            function=validate_url,
+            args={"url": Input("product_url")},
+            step_name="validate_product_url",
+        )
+    )
+    builder = product_description_step(builder).if_(
+        condition=lambda choice: choice == "2",
+        args={"choice": Input("dialog_choice")},
     )
-    .endif()
-    .llm_step(
-        task="""Based on the choice provided, return the appropriate dialog:
+    builder = auto_dialog_step(builder)
+    return register_plan(
+        builder
+        .else_()
+        .function_step(
+            function=lambda custom_dialog: {"dialog": custom_dialog},
+            args={"custom_dialog": Input("custom_dialog")},
+            step_name="use_custom_dialog",
+            output_schema=DialogOutput,
+        )
+        .endif()
+        .llm_step(
+            task="""Based on the choice provided, return the appropriate dialog:
 
 Choice: {{dialog_choice}}
 Custom dialog (if choice is not "2"): {{custom_dialog}}
@@ -803,57 +967,41 @@ If choice is "2", return: "Check out this Bed Head TIGI shampoo! Its formula lea
 If choice is not "2", return the custom dialog provided.
 
 Return only the dialog text as a string.""",
-        inputs=[
-            Input("dialog_choice"),
-            Input("custom_dialog"),
-        ],
-        step_name="generate_final_dialog",
-        output_schema=DialogOutput,
-    )
-    .single_tool_agent_step(
-        tool="portia:mcp:custom:mcp.replicate.com:create_predictions",
-        task="""
-        CRITICAL: You MUST include ALL required parameters in your tool call with the EXACT mapping specified below.
-        
-        IMPORTANT: Do NOT mix up product_description and dialogs parameters. They are different:
-        - product_description: Should contain the formatted product description (what the product IS and how it LOOKS)
-        - dialogs: Should contain the dialog text (what the person SAYS in the video)
-
-        Call the tool with this EXACT structure and parameter mapping:
-        {
-          "version": "07a0f547a5c73f587de8251543f9f07e7b38fc4b3af7512bfaeebba428216270",
-          "input": {
-            "avatar_image": [use the character_url_final output - this is the character/avatar image URL],
-            "product_image": [use the product_url input - this is the product image URL],
-            "product_description": [use the generate_product_description.description output - this describes what the product is and looks like],
-            "dialogs": [use the generate_final_dialog output - this is what the person says in the video],
-            "debug_mode": false
-            
-          },
-          "jq_filter": "{id: .id, status: .status}",
-          "Prefer": "wait=5"
-        }
-                
-        DO NOT OMIT THE "version" FIELD. It is required.
-        DOUBLE CHECK: product_description gets the product description, dialogs gets the dialog text.
-        ONLY RETURN "id" and "status" in the output JSON.
-        EXAMPLE OUTPUT:
-        {
-            "id": "example-id-123456",
-            "status": "starting"
-        }
-        """,
-        inputs=[
-            StepOutput("character_url_final"),
-            Input("product_url"),
-            StepOutput("generate_product_description"),
-            StepOutput("generate_final_dialog"),
-        ],
-        step_name="generate_ugc",
-        output_schema=PredictionPolling,
-    )
-    .llm_step(
-        task="""
+            inputs=[
+                Input("dialog_choice"),
+                Input("custom_dialog"),
+            ],
+            step_name="generate_final_dialog",
+            output_schema=DialogOutput,
+        )
+        .function_step(
+            function=ugc_video_input,
+            args={
+                "character_url": StepOutput("character_url_final"),
+                "product_url": Input("product_url"),
+                "product_description": StepOutput("generate_product_description"),
+                "dialog": StepOutput("generate_final_dialog"),
+            },
+            step_name="ugc_video_input",
+        )
+        .invoke_tool_step(
+            tool=CREATE_PREDICTIONS_TOOL_ID,
+            args={
+                "version": UGC_VIDEO_MODEL_VERSION,
+                "input": StepOutput("ugc_video_input"),
+                "jq_filter": PREDICTION_JQ_FILTER,
+                "Prefer": "wait=5",
+            },
+            step_name="create_ugc_prediction",
+        )
+        .function_step(
+            function=prediction_from_output,
+            args={"raw": StepOutput("create_ugc_prediction")},
+            step_name="generate_ugc",
+            output_schema=PredictionPolling,
+        )
+        .llm_step(
+            task="""
         Your task is to extract the id and status field from this {generate_ugc} and combine it with other data.
         
         Steps:
@@ -868,21 +1016,34 @@ Return only the dialog text as a string.""",
         CRITICAL: Do NOT use example IDs or placeholder text. Use only the real data from the inputs.
         Return ONLY the structured object with these 6 fields as JSON.
         """,
-        inputs=[
-            StepOutput("generate_ugc"),
-            StepOutput("generate_product_description"),
-            StepOutput("generate_final_dialog"),
-            StepOutput("character_url_final"),
-            Input("product_url"),
-        ],
-        step_name="pack_final_output_llm",
-        output_schema=UGC_Prediction,
-    )
-    .final_output(
-        output_schema=UGC_Prediction,
+            inputs=[
+                StepOutput("generate_ugc"),
+                StepOutput("generate_product_description"),
+                StepOutput("generate_final_dialog"),
+                StepOutput("character_url_final"),
+                Input("product_url"),
+            ],
+            step_name="pack_final_output_llm",
+            output_schema=UGC_Prediction,
+        )
+        .final_output(
+            output_schema=UGC_Prediction,
+        )
+        .build()
     )
-    .build()
-)
+
+
+@functools.lru_cache(maxsize=None)
+def get_ugc_plan():
+    """The UGC plan, built on first use instead of at import"""
+    return create_ugc_plan()
+
+
+def __getattr__(name):
+    # `from main import plan` keeps working without building the plan at import
+    if name == "plan":
+        return get_ugc_plan()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def main():
@@ -984,7 +1145,8 @@ def generate_ugc_ad():
 
     # Run the plan
     print("\n🚀 Running Portia plan with Replicate...")
-    plan_run = portia.run_plan(plan, plan_run_inputs=plan_inputs)
+    portia = get_portia()
+    plan_run = portia.run_plan(get_ugc_plan(), plan_run_inputs=plan_inputs)
 
     # Display results
     print("\n🎉 Plan execution complete!")
@@ -1015,7 +1177,7 @@ def generate_ugc_ad():
 
         # Poll for completion
         print("\n⏳ Polling for UGC generation completion...")
-        final_ugc_result = poll_prediction_until_complete(portia, prediction_id)
+        final_ugc_result = poll_prediction_until_complete(get_ephemeral_portia(), prediction_id)
 
         if final_ugc_result:
             print("\n✅ UGC Generation Complete!")
@@ -1041,6 +1203,44 @@ def generate_ugc_ad():
     return final_output
 
 
+def create_product_ad_plan(lighting: str = "auto"):
+    """Create the product ad plan (single Replicate video prediction)"""
+    return register_plan(
+        PlanBuilderV2("Product Ad Generator")
+        .input(name="product_url", description="Product image URL (optional)")
+        .input(name="ad_prompt", description="Ad prompt from user")
+        .function_step(
+            function=lambda ad_prompt, product_url: product_ad_input(ad_prompt, product_url, lighting),
+            args={"ad_prompt": Input("ad_prompt"), "product_url": Input("product_url")},
+            step_name="product_ad_input",
+        )
+        .invoke_tool_step(
+            tool=CREATE_PREDICTIONS_TOOL_ID,
+            args={
+                "version": PRODUCT_AD_MODEL_VERSION,
+                "input": StepOutput("product_ad_input"),
+                "jq_filter": PREDICTION_JQ_FILTER,
+                "Prefer": "wait=1",
+            },
+            step_name="create_product_ad_prediction",
+        )
+        .function_step(
+            function=prediction_from_output,
+            args={"raw": StepOutput("create_product_ad_prediction")},
+            step_name="generate_product_ad",
+            output_schema=PredictionPolling,
+        )
+        .final_output()
+        .build()
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_product_ad_plan(lighting: str = "auto"):
+    """The product ad plan for `lighting`, built on first use"""
+    return create_product_ad_plan(lighting)
+
+
 def generate_product_ad():
     print("\n📸 Product Ad Generation Selected!")
 
@@ -1071,40 +1271,7 @@ def generate_product_ad():
     print("\n🚀 Generating Product Ad...")
 
     # Create product ad generation plan
-    product_ad_plan = (
-        PlanBuilderV2("Product Ad Generator")
-        .input(name="product_url", description="Product image URL")
-        .input(name="ad_prompt", description="Ad prompt from user")
-        .single_tool_agent_step(
-            tool="portia:mcp:custom:mcp.replicate.com:create_predictions",
-            task="""
-            Call the Replicate tool with this EXACT structure:
-            {
-              "version": "7428dcc4cdb6d758301c2ae57ca01279e9b6899c5cb01f18f4d577c412b14390",
-              "input": {
-                "prompt": [use the ad_prompt input],
-                "lighting": "auto",
-                "audio_mode": "off",
-                "image_style": "studio",
-                "camera_movement": "auto",
-                "reference_image": [use the product_url input]
-              },
-              "jq_filter": "{id: .id, status: .status}",
-              "Prefer": "wait=1"
-            }
-            
-            DO NOT OMIT THE "version" FIELD. It is required.
-            Return ONLY the id and status from the response.
-            """,
-            inputs=[Input("product_url"), Input("ad_prompt")],
-            step_name="generate_product_ad",
-            output_schema=UGC_Prediction,
-        )
-        .final_output(
-            output_schema=UGC_Prediction,
-        )
-        .build()
-    )
+    product_ad_plan = get_product_ad_plan()
 
     # Run the product ad plan
     plan_inputs = {
@@ -1112,6 +1279,7 @@ def generate_product_ad():
         "ad_prompt": ad_prompt,
     }
 
+    portia = get_portia()
     plan_run = portia.run_plan(product_ad_plan, plan_run_inputs=plan_inputs)
 
     # Display results
@@ -1133,7 +1301,7 @@ def generate_product_ad():
 
         # Poll for completion
         print("\n⏳ Polling for Product Ad generation completion...")
-        final_product_ad_result = poll_prediction_until_complete(portia, prediction_id)
+        final_product_ad_result = poll_prediction_until_complete(get_ephemeral_portia(), prediction_id)
 
         if final_product_ad_result:
             print("\n✅ Product Ad Generation Complete!")
@@ -1,11 +1,15 @@
-from portia import PlanBuilderV2
+from portia import PlanBuilderV2, PlanRunState
 from portia.builder.reference import StepOutput, Input
 from pydantic import BaseModel, Field
 from utils.config import get_portia_with_custom_tools
+from utils.plan_steps import register_plan
+from utils.text_generation import TEXT_GENERATION_PROVIDER
+import functools
 import json
 from datetime import datetime
 from typing import Optional, Dict, Any
 
+ADD_ROW_TO_SHEET_TOOL_ID = "portia:mcp:custom:us2.make.com:s2825571_on_demand_add_row_to_sheet"
 
 # Pydantic models for the social media scheduler
 class ChannelDetection(BaseModel):
@@ -76,6 +80,82 @@ OUTPUT FORMAT:
 """
 
 
+# Condensed system prompt of the simple scheduler plan
+SIMPLE_CAPTION_GENERATION_PROMPT = (
+    "You are a social media content creator. Generate short, engaging captions based on the video content. "
+    "Requirements: Instagram caption: 1-2 sentences, engaging, can include 1-2 relevant hashtags. "
+    "Twitter post: 1 sentence, punchy, under 280 characters (only if channel requires it). "
+    "Keep it simple, authentic, and product-focused."
+)
+
+
+def replicate_captions_task(system_prompt: str) -> str:
+    """GPT-4o through Replicate: an agent writes the create_predictions call (default provider)"""
+    return f"""
+        Call the Replicate GPT-4o tool with this EXACT structure:
+        {{
+          "version": "openai/gpt-4o",
+          "input": {{
+            "prompt": "Generate social media captions based on this video content:
+            Product Description: [use the product_description input]
+            Video Dialog: [use the dialog input]
+            Target Channel: [use the detect_channels.channel output]
+            Create appropriate captions for the specified channel(s). The video shows someone talking about the product described above.",
+            "system_prompt": "{system_prompt}"
+          }},
+          "jq_filter": ".output",
+          "Prefer": "wait"
+        }}
+        
+        DO NOT OMIT THE "version" FIELD. It is required and must be "openai/gpt-4o".
+        
+        IMPORTANT: Extract the caption text from the array output and return it in this format:
+        {{
+          "instagram_caption": [generated Instagram caption],
+          "twitter_post": [generated Twitter post if applicable, otherwise null],
+          "channel": [use the detect_channels.channel output]
+        }}
+        """
+
+
+def direct_captions_task(system_prompt: str) -> str:
+    """One structured call to the configured OpenAI model (TEXT_GENERATION_PROVIDER=openai)"""
+    return (
+        system_prompt
+        + """
+Generate social media captions based on this video content, using the
+product_description input, the dialog input and the target channel in the
+detect_channels output. Create appropriate captions for the specified channel(s);
+the video shows someone talking about the product described.
+Set channel to the detect_channels channel, and twitter_post to null unless the
+channel is "both" or "twitter".
+"""
+    )
+
+
+def captions_step(builder, system_prompt: str):
+    """Add generate_captions, written directly by OpenAI or by GPT-4o through Replicate
+
+    Both providers get the same `system_prompt`, so switching provider changes
+    only how the captions are generated, not what is asked for.
+    """
+    inputs = [Input("product_description"), Input("dialog"), StepOutput("detect_channels")]
+    if TEXT_GENERATION_PROVIDER == "openai":
+        return builder.llm_step(
+            task=direct_captions_task(system_prompt),
+            inputs=inputs,
+            output_schema=CaptionGeneration,
+            step_name="generate_captions",
+        )
+    return builder.single_tool_agent_step(
+        tool="portia:mcp:custom:mcp.replicate.com:create_predictions",
+        task=replicate_captions_task(system_prompt),
+        inputs=inputs,
+        output_schema=CaptionGeneration,
+        step_name="generate_captions",
+    )
+
+
 def convert_natural_time_to_iso(natural_time_input: str) -> str:
     """Convert natural language time to UTC ISO format (from IST)"""
     from datetime import datetime, timedelta, timezone
@@ -137,20 +217,22 @@ def convert_natural_time_to_iso(natural_time_input: str) -> str:
 
 
 # Build the simplified social media scheduler plan (no clarifications)
-social_scheduler_plan = (
-    PlanBuilderV2("Social Media Content Scheduler")
-    .input(
-        name="user_prompt",
-        description="User's scheduling prompt (e.g., 'Post this video to Instagram tomorrow at 3pm')",
-    )
-    .input(name="media_url", description="Generated video URL from UGC creation")
-    .input(
-        name="product_description",
-        description="Product description from UGC generation",
-    )
-    .input(name="dialog", description="Dialog text from UGC generation")
-    .llm_step(
-        task="""
+def create_social_scheduler_plan():
+    """Build the social media scheduler plan"""
+    builder = (
+        PlanBuilderV2("Social Media Content Scheduler")
+        .input(
+            name="user_prompt",
+            description="User's scheduling prompt (e.g., 'Post this video to Instagram tomorrow at 3pm')",
+        )
+        .input(name="media_url", description="Generated video URL from UGC creation")
+        .input(
+            name="product_description",
+            description="Product description from UGC generation",
+        )
+        .input(name="dialog", description="Dialog text from UGC generation")
+        .llm_step(
+            task="""
         You are a social media platform detector. Analyze the user's prompt to determine where they want to post.
         
         RULES:
@@ -164,47 +246,15 @@ social_scheduler_plan = (
         
         Return your analysis in the specified format.
         """,
-        inputs=[Input("user_prompt")],
-        output_schema=ChannelDetection,
-        step_name="detect_channels",
-    )
-    .single_tool_agent_step(
-        tool="portia:mcp:custom:mcp.replicate.com:create_predictions",
-        task=f"""
-        Call the Replicate GPT-4o tool with this EXACT structure:
-        {{
-          "version": "openai/gpt-4o",
-          "input": {{
-            "prompt": "Generate social media captions based on this video content:
-            Product Description: [use the product_description input]
-            Video Dialog: [use the dialog input]
-            Target Channel: [use the detect_channels.channel output]
-            Create appropriate captions for the specified channel(s). The video shows someone talking about the product described above.",
-            "system_prompt": "{CAPTION_GENERATION_PROMPT}"
-          }},
-          "jq_filter": ".output",
-          "Prefer": "wait"
-        }}
-        
-        DO NOT OMIT THE "version" FIELD. It is required and must be "openai/gpt-4o".
-        
-        IMPORTANT: Extract the caption text from the array output and return it in this format:
-        {{
-          "instagram_caption": [generated Instagram caption],
-          "twitter_post": [generated Twitter post if applicable, otherwise null],
-          "channel": [use the detect_channels.channel output]
-        }}
-        """,
-        inputs=[
-            Input("product_description"),
-            Input("dialog"),
-            StepOutput("detect_channels"),
-        ],
-        output_schema=CaptionGeneration,
-        step_name="generate_captions",
+            inputs=[Input("user_prompt")],
+            output_schema=ChannelDetection,
+            step_name="detect_channels",
+        )
     )
-    .llm_step(
-        task="""
+    return register_plan(
+        captions_step(builder, CAPTION_GENERATION_PROMPT)
+        .llm_step(
+            task="""
         Extract the scheduling time from the user's prompt. Look for time indicators like:
         - "now" or "immediately" 
         - "tomorrow" with optional time
@@ -218,18 +268,30 @@ social_scheduler_plan = (
         
         Provide a brief reasoning for why this time was chosen.
         """,
-        inputs=[Input("user_prompt")],
-        output_schema=TimeExtraction,
-        step_name="extract_time",
+            inputs=[Input("user_prompt")],
+            output_schema=TimeExtraction,
+            step_name="extract_time",
+        )
+        .final_output()
+        .build()
     )
-    .final_output()
-    .build()
-)
+
+
+@functools.lru_cache(maxsize=None)
+def get_social_scheduler_plan():
+    """The social media scheduler plan, built on first use instead of at import"""
+    return create_social_scheduler_plan()
+
+
+def __getattr__(name):
+    if name == "social_scheduler_plan":
+        return get_social_scheduler_plan()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def create_simple_social_scheduler_plan():
     """Create a simplified social scheduler plan that handles everything in one go"""
-    return (
+    builder = (
         PlanBuilderV2("Simple Social Media Scheduler")
         .input(name="user_prompt", description="User's scheduling prompt")
         .input(name="media_url", description="Video URL")
@@ -254,41 +316,9 @@ def create_simple_social_scheduler_plan():
             output_schema=ChannelDetection,
             step_name="detect_channels",
         )
-        .single_tool_agent_step(
-            tool="portia:mcp:custom:mcp.replicate.com:create_predictions",
-            task="""
-            Call the Replicate GPT-4o tool with this EXACT structure:
-            {
-              "version": "openai/gpt-4o",
-              "input": {
-                "prompt": "Generate social media captions based on this video content:
-                Product Description: [use the product_description input]
-                Video Dialog: [use the dialog input]
-                Target Channel: [use the detect_channels.channel output]
-                Create appropriate captions for the specified channel(s). The video shows someone talking about the product described above.",
-                "system_prompt": "You are a social media content creator. Generate short, engaging captions based on the video content. Requirements: Instagram caption: 1-2 sentences, engaging, can include 1-2 relevant hashtags. Twitter post: 1 sentence, punchy, under 280 characters (only if channel requires it). Keep it simple, authentic, and product-focused."
-              },
-              "jq_filter": ".output",
-              "Prefer": "wait"
-            }
-            
-            DO NOT OMIT THE "version" FIELD. It is required and must be "openai/gpt-4o".
-            
-            IMPORTANT: Extract the caption text from the array output and return it in this format:
-            {
-              "instagram_caption": [generated Instagram caption],
-              "twitter_post": [generated Twitter post if applicable, otherwise null],
-              "channel": [use the detect_channels.channel output]
-            }
-            """,
-            inputs=[
-                Input("product_description"),
-                Input("dialog"),
-                StepOutput("detect_channels"),
-            ],
-            output_schema=CaptionGeneration,
-            step_name="generate_captions",
-        )
+    )
+    return register_plan(
+        captions_step(builder, SIMPLE_CAPTION_GENERATION_PROMPT)
         .llm_step(
             task="""
             Extract the scheduling time from the user's prompt. Look for time indicators like:
@@ -323,7 +353,7 @@ def create_sheets_integration_plan(final_data: SchedulingData):
         .input(name="twitter_post", description="Twitter post text")
         .input(name="channel", description="Target channel")
         .single_tool_agent_step(
-            tool="portia:mcp:custom:us2.make.com:s2825571_on_demand_add_row_to_sheet",
+            tool=ADD_ROW_TO_SHEET_TOOL_ID,
             task=f"""
             CRITICAL: You MUST use the Make.com tool to add a row to the Google Sheet.
             
@@ -354,7 +384,32 @@ def create_sheets_integration_plan(final_data: SchedulingData):
         .build()
     )
 
-    return sheets_plan
+    return register_plan(sheets_plan)
+
+
+def publish_scheduled_post(portia, post: Dict[str, Any]):
+    """Publish a queued post through the Make.com sheet tool (used by the local dispatcher)"""
+    final_data = SchedulingData(
+        media_url=post["media_url"],
+        instagram_caption=post["instagram_caption"],
+        date_time=post["date_time"],
+        twitter_post=post.get("twitter_post") or "",
+        channel=post["channel"],
+    )
+    sheets_plan = create_sheets_integration_plan(final_data)
+    sheets_run = portia.run_plan(
+        sheets_plan,
+        plan_run_inputs={
+            "media_url": final_data.media_url,
+            "instagram_caption": final_data.instagram_caption,
+            "date_time": final_data.date_time,
+            "twitter_post": final_data.twitter_post,
+            "channel": final_data.channel,
+        },
+    )
+    if sheets_run.state != PlanRunState.COMPLETE:
+        raise RuntimeError(f"Sheets plan finished with state: {sheets_run.state}")
+    return sheets_run
 
 
 def main():
@@ -0,0 +1,50 @@
+import pytest
+
+from utils.dedupe import DuplicateIndex, request_fingerprint
+
+BODY = {
+    "user_prompt": "Post this to Instagram tomorrow at 3pm",
+    "media_url": "https://replicate.delivery/abc123/video.mp4",
+    "product_description": "A white shampoo bottle with a black cap",
+    "dialog": "This shampoo leaves my hair feeling fresh.",
+    "use_local_queue": False,
+}
+
+
+def test_identical_requests_on_one_route_coalesce():
+    index = DuplicateIndex()
+    first = index.begin_request(request_fingerprint("/execute-social-scheduler", BODY))
+    second = index.begin_request(request_fingerprint("/execute-social-scheduler", dict(BODY)))
+    assert first.is_owner
+    assert not second.is_owner
+
+
+def test_identical_bodies_on_different_routes_do_not_coalesce():
+    index = DuplicateIndex()
+    simple = index.begin_request(request_fingerprint("/execute-social-scheduler-simple", BODY))
+    full = index.begin_request(request_fingerprint("/execute-social-scheduler", BODY))
+    assert simple.is_owner
+    assert full.is_owner
+
+
+def test_scheduler_routes_send_distinct_fingerprints(monkeypatch):
+    api_server = pytest.importorskip("api_server")
+    from fastapi.testclient import TestClient
+
+    seen = []
+
+    class Stop(Exception):
+        pass
+
+    def begin_request(fingerprint):
+        seen.append(fingerprint)
+        raise Stop()
+
+    monkeypatch.setattr(api_server, "shed_if_unavailable", lambda tool_ids: None)
+    monkeypatch.setattr(api_server.duplicate_index, "begin_request", begin_request)
+    client = TestClient(api_server.app, raise_server_exceptions=False)
+    for route in ("/execute-social-scheduler-simple", "/execute-social-scheduler"):
+        client.post(route, json=BODY)
+
+    assert len(seen) == 2
+    assert seen[0] != seen[1]
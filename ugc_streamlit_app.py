@@ -5,14 +5,18 @@ import time
 import threading
 import queue
 from typing import Dict, Any
-import cloudinary
-import cloudinary.uploader
 import os
 import re
+from collections import deque
 from io import BytesIO
 import toml
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+from PIL import Image, ImageOps
+from utils.http_pool import get_session
+from utils.stream_jobs import PRODUCT_AD, UGC, JobTracker, fold_ugc_event, parse_sse_line, step_progress
 
-# Load configuration from TOML file
+# Load configuration from TOML file (read once per process, not on every rerun)
+@st.cache_data(show_spinner=False)
 def load_config():
     config_path = os.path.join(os.path.dirname(__file__), 'config.toml')
     try:
@@ -20,13 +24,7 @@ def load_config():
             return toml.load(f)
     except FileNotFoundError:
         # Fallback to environment variables if config.toml doesn't exist
-        return {
-            'cloudinary': {
-                'cloud_name': os.getenv('CLOUDINARY_CLOUD_NAME', ''),
-                'api_key': os.getenv('CLOUDINARY_API_KEY', ''),
-                'api_secret': os.getenv('CLOUDINARY_API_SECRET', '')
-            },
-        }
+        return {'api': {'base_url': os.getenv('API_BASE_URL', "http://134.209.146.64")}}
 
 config = load_config()
 
@@ -41,15 +39,19 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Configure Cloudinary with TOML configuration
-cloudinary.config(
-    cloud_name=config['cloudinary']['cloud_name'],
-    api_key=config['cloudinary']['api_key'],
-    api_secret=config['cloudinary']['api_secret'],
-)
-
 # API Configuration
 API_BASE_URL = config.get('api', {}).get('base_url', "http://134.209.146.64")
+# Keep-alive session shared across reruns and sessions
+http_session = st.cache_resource(show_spinner=False)(get_session)()
+
+# Streaming UI: redraws per second while events arrive, and events kept in the log
+UI_REDRAWS_PER_SECOND = float(os.getenv("UI_REDRAWS_PER_SECOND", "4"))
+STREAMING_EVENTS_MAX = int(os.getenv("STREAMING_EVENTS_MAX", "200"))
+# Seconds between dashboard refreshes while background jobs are running
+JOBS_REFRESH_SECONDS = float(os.getenv("JOBS_REFRESH_SECONDS", "2"))
+# How long a health probe result is reused, and the size of character gallery thumbnails
+HEALTH_CHECK_TTL_SECONDS = float(os.getenv("HEALTH_CHECK_TTL_SECONDS", "30"))
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "300"))
 
 # Predefined character URLs
 PREDEFINED_CHARACTERS = [
@@ -265,6 +267,17 @@ st.markdown(
 )
 
 
+def new_event_log() -> deque:
+    """Ring buffer for the live events log; old events drop off once it is full"""
+    return deque(maxlen=STREAMING_EVENTS_MAX)
+
+
+def latest_events(count: int) -> list:
+    """The last `count` events in the log, oldest first"""
+    events = st.session_state.streaming_events
+    return list(events)[-count:]
+
+
 # Initialize session state
 def init_session_state():
     if "flow_data" not in st.session_state:
@@ -278,7 +291,9 @@ def init_session_state():
     if "execution_status" not in st.session_state:
         st.session_state.execution_status = "idle"  # idle, running, completed, error
     if "streaming_events" not in st.session_state:
-        st.session_state.streaming_events = []
+        st.session_state.streaming_events = new_event_log()
+    if "job_tracker" not in st.session_state:
+        st.session_state.job_tracker = JobTracker(API_BASE_URL, http_session)
     if "final_video_url" not in st.session_state:
         st.session_state.final_video_url = None
     if "prediction_id" not in st.session_state:
@@ -318,43 +333,35 @@ def validate_url(url):
     return url_pattern.match(url) is not None
 
 
-def upload_to_cloudinary(uploaded_file):
-    """Upload file to Cloudinary and return URL"""
+def upload_product_image(uploaded_file):
+    """Stream the file to the API server's /upload endpoint and return the stored image URL"""
     try:
-        # Check if Cloudinary is configured
-        cloudinary_config = config.get('cloudinary', {})
-        if not all(
-            [
-                cloudinary_config.get('cloud_name'),
-                cloudinary_config.get('api_key'),
-                cloudinary_config.get('api_secret'),
-            ]
-        ):
-            st.error(
-                "❌ Cloudinary credentials not configured. Please check your .env file."
-            )
-            return None
-
-        # Convert uploaded file to bytes
-        bytes_data = uploaded_file.read()
-
-        # Upload to Cloudinary
+        uploaded_file.seek(0)
+        encoder = MultipartEncoder(
+            fields={"file": (uploaded_file.name, uploaded_file, uploaded_file.type or "application/octet-stream")}
+        )
         with st.spinner("Uploading image..."):
-            upload_result = cloudinary.uploader.upload(
-                bytes_data,
-                resource_type="image",
-                unique_filename=True,
-                overwrite=True,
+            response = http_session.post(
+                f"{API_BASE_URL}/upload",
+                data=encoder,
+                headers={"Content-Type": encoder.content_type},
+                timeout=300,
             )
+        if not response.ok:
+            try:
+                detail = response.json().get("detail", response.text)
+            except ValueError:
+                detail = response.text
+            st.error(f"❌ Error uploading image: {detail}")
+            return None
 
-        # Get the secure URL
-        image_url = upload_result.get("secure_url")
-
+        result = response.json()
+        image_url = result.get("url")
         if image_url:
-            st.success(f"✅ Image uploaded successfully!")
+            st.success("✅ Image already uploaded, reusing it" if result.get("reused") else "✅ Image uploaded successfully!")
             return image_url
         else:
-            st.error("❌ Failed to get image URL from Cloudinary")
+            st.error("❌ Failed to get image URL from the upload")
             return None
 
     except Exception as e:
@@ -369,7 +376,7 @@ def reset_flow():
     st.session_state.ad_type_choice = None
     st.session_state.flow_completed = False
     st.session_state.execution_status = "idle"
-    st.session_state.streaming_events = []
+    st.session_state.streaming_events = new_event_log()
     st.session_state.final_video_url = None
     st.session_state.prediction_id = None
     st.session_state.progress = 0.0
@@ -384,23 +391,59 @@ def reset_flow():
         del st.session_state.selected_character_index
 
 
+def build_api_payload() -> Dict[str, Any]:
+    """API payload for the ad configured in the current flow"""
+    flow_data = st.session_state.flow_data
+    if st.session_state.ad_type_choice != "1":  # Product Ad
+        return {"product_url": flow_data["product_url"], "ad_prompt": flow_data["ad_prompt"]}
+
+    api_payload = {
+        "character_choice": flow_data["character_choice"],
+        "product_url": flow_data["product_url"],
+        "dialog_choice": flow_data["dialog_choice"],
+    }
+    # Add conditional fields
+    if flow_data["character_choice"] == "1":
+        api_payload["custom_character_url"] = flow_data["custom_character_url"]
+    else:
+        api_payload["prebuild_character_choice"] = flow_data["prebuild_character_choice"]
+    if flow_data["dialog_choice"] == "1":
+        api_payload["custom_dialog"] = flow_data["custom_dialog"]
+    return api_payload
+
+
+@st.cache_data(ttl=HEALTH_CHECK_TTL_SECONDS, show_spinner=False)
 def check_api_health():
-    """Check if the API server is running"""
+    """Check if the API server is running (cached; call check_api_health.clear() to re-probe)"""
     try:
-        response = requests.get(f"{API_BASE_URL}/health", timeout=2)
+        response = http_session.get(f"{API_BASE_URL}/health", timeout=2)
         return response.status_code == 200
     except:
         return False
 
 
-def parse_sse_line(line: str) -> Dict[str, Any]:
-    """Parse a single SSE line"""
-    if line.startswith("data: "):
-        try:
-            return json.loads(line[6:])  # Remove "data: " prefix
-        except json.JSONDecodeError:
-            return {"type": "error", "message": f"Invalid JSON: {line}"}
-    return None
+@st.cache_data(ttl=HEALTH_CHECK_TTL_SECONDS, show_spinner=False)
+def check_upload_status():
+    """Media backend of the API server and whether it accepts uploads (None if unreachable)"""
+    try:
+        response = http_session.get(f"{API_BASE_URL}/upload/status", timeout=2)
+        response.raise_for_status()
+        return response.json()
+    except Exception:
+        return None
+
+
+@st.cache_data(persist="disk", show_spinner=False)
+def character_thumbnail(url: str) -> bytes:
+    """Downscaled JPEG of a prebuilt character image, fetched once and kept on disk"""
+    response = http_session.get(url, timeout=10)
+    response.raise_for_status()
+    image = ImageOps.exif_transpose(Image.open(BytesIO(response.content)))
+    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    buffer = BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
 
 def parse_sse_chunk(chunk: str) -> list:
     """Parse SSE chunk that might contain multiple events"""
@@ -419,11 +462,40 @@ def parse_sse_chunk(chunk: str) -> list:
     return events
 
 
+def read_sse_events(response, events: queue.Queue) -> None:
+    """Reader thread: put parsed SSE events on `events`, then None (or the exception that ended the stream)"""
+    try:
+        for line in response.iter_lines():
+            if line:
+                event = parse_sse_line(line.decode("utf-8"))
+                if event:
+                    events.put(event)
+    except Exception as e:
+        events.put(e)
+        return
+    events.put(None)
+
+
+def drain_events(events: queue.Queue, interval: float) -> list:
+    """Everything put on `events` during the next `interval` seconds (empty if nothing arrived)"""
+    deadline = time.monotonic() + interval
+    batch = []
+    while True:
+        remaining = deadline - time.monotonic()
+        try:
+            item = events.get(timeout=remaining) if remaining > 0 else events.get_nowait()
+        except queue.Empty:
+            return batch
+        batch.append(item)
+        if item is None or isinstance(item, Exception):
+            return batch
+
+
 def stream_ugc_execution_realtime(payload: Dict[str, Any], status_placeholder, progress_placeholder, events_placeholder):
     """Stream UGC execution with real-time UI updates using placeholders"""
     try:
         # Make streaming request
-        response = requests.post(
+        response = http_session.post(
             f"{API_BASE_URL}/execute-ugc-realtime",
             json=payload,
             stream=True,
@@ -432,91 +504,25 @@ def stream_ugc_execution_realtime(payload: Dict[str, Any], status_placeholder, p
 
         response.raise_for_status()
 
-        step_counter = 0
-        total_steps = 12  # Approximate based on UGC generator plan
-
-        for line in response.iter_lines():
-            if line:
-                line_str = line.decode("utf-8")
-                event = parse_sse_line(line_str)
-
-                if event:
-                    # Add to events list
-                    event_with_time = {**event, "timestamp": time.strftime("%H:%M:%S")}
-                    st.session_state.streaming_events.append(event_with_time)
-
-                    # Update progress based on event type
-                    if event["type"] == "started":
-                        st.session_state.current_step_name = "Initializing..."
-                        st.session_state.progress = 0.05
-
-                    elif event["type"] == "step_started":
-                        step_name = event.get("step_name", "Unknown step")
-                        st.session_state.current_step_name = f"Starting: {step_name}"
-
-                    elif event["type"] == "step_completed":
-                        step_counter += 1
-                        step_name = event.get("step_name", "Unknown step")
-                        output = event.get("output", "")
-                        
-                        # Extract product description and dialog for social sharing
-                        if "product_description" in step_name.lower() and output:
-                            st.session_state.generated_product_description = output
-                        elif "dialog" in step_name.lower() and output:
-                            st.session_state.generated_dialog = output
-                        
-                        st.session_state.current_step_name = f"Completed: {step_name}"
-                        st.session_state.progress = min(
-                            step_counter / total_steps * 0.8, 0.8
-                        )  # Max 80% until video completion
-
-                    elif event["type"] == "plan_completed":
-                        st.session_state.current_step_name = (
-                            "Plan completed - generating video..."
-                        )
-                        st.session_state.progress = 0.85
-                        if event.get("prediction_id"):
-                            st.session_state.prediction_id = event["prediction_id"]
-
-                    elif event["type"] == "video_polling_started":
-                        st.session_state.current_step_name = (
-                            "Polling for video completion..."
-                        )
-                        st.session_state.progress = 0.9
-
-                    elif event["type"] == "video_completed":
-                        video_url = event.get("video_url")
-                        if video_url:
-                            st.session_state.final_video_url = video_url
-                        st.session_state.current_step_name = (
-                            "✅ Video generation completed!"
-                        )
-                        st.session_state.progress = 1.0
-                        st.session_state.execution_status = "completed"
-                        
-                        # Enable social sharing option
-                        st.session_state.show_social_sharing = True
-                        
-                        # Update UI immediately
-                        update_realtime_display(status_placeholder, progress_placeholder, events_placeholder)
-                        break
-
-                    elif event["type"] == "video_failed":
-                        st.session_state.current_step_name = f"❌ Video generation failed: {event.get('message', 'Unknown error')}"
-                        st.session_state.execution_status = "error"
-                        update_realtime_display(status_placeholder, progress_placeholder, events_placeholder)
-                        break
-
-                    elif event["type"] == "error":
-                        st.session_state.current_step_name = (
-                            f"❌ Error: {event.get('message', 'Unknown error')}"
-                        )
-                        st.session_state.execution_status = "error"
-                        update_realtime_display(status_placeholder, progress_placeholder, events_placeholder)
-                        break
-
-                    # Update display for each event
-                    update_realtime_display(status_placeholder, progress_placeholder, events_placeholder)
+        events: queue.Queue = queue.Queue()
+        threading.Thread(target=read_sse_events, args=(response, events), daemon=True).start()
+
+        # Coalesce events and redraw at most UI_REDRAWS_PER_SECOND times per second
+        finished = False
+        while not finished:
+            batch = drain_events(events, 1.0 / UI_REDRAWS_PER_SECOND)
+            for event in batch:
+                if event is None:
+                    finished = True
+                    break
+                if isinstance(event, Exception):
+                    raise event
+                if fold_ugc_event(st.session_state, event):
+                    finished = True
+                    response.close()
+                    break
+            if batch:
+                update_realtime_display(status_placeholder, progress_placeholder, events_placeholder)
 
         # Mark as completed if no error occurred and not already set
         if st.session_state.execution_status == "running":
@@ -563,7 +569,7 @@ def update_realtime_display(status_placeholder, progress_placeholder, events_pla
         with events_placeholder.container():
             st.markdown("### 🔍 Live Events Log")
             # Show last 5 events
-            recent_events = st.session_state.streaming_events[-5:]
+            recent_events = latest_events(5)
             for event in reversed(recent_events):
                 event_type = event.get("type", "unknown")
                 event_message = event.get("message", str(event))
@@ -587,7 +593,7 @@ def stream_product_ad_execution(payload: Dict[str, Any], status_placeholder, pro
     """Stream Product Ad execution with real-time UI updates"""
     try:
         # Make request to Product Ad API
-        response = requests.post(
+        response = http_session.post(
             f"{API_BASE_URL}/execute-product-ad",
             json=payload,
             timeout=1200,  # 10 minute timeout
@@ -647,6 +653,45 @@ def stream_product_ad_execution(payload: Dict[str, Any], status_placeholder, pro
         update_realtime_display(status_placeholder, progress_placeholder, events_placeholder)
 
 
+def render_jobs_dashboard():
+    """Background jobs of this session, read from the job tracker's snapshot"""
+    tracker = st.session_state.job_tracker
+    jobs = tracker.snapshot()
+    st.markdown("### 📊 Background Jobs")
+    st.caption(f"{tracker.active()} running or queued · {len(jobs)} total")
+
+    status_emoji = {"queued": "🕒", "running": "🔄", "completed": "✅", "error": "❌", "cancelled": "⏹️"}
+    for job in reversed(jobs):
+        with st.container(border=True):
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                st.write(f"{status_emoji.get(job['execution_status'], '❓')} **{job['label']}** `{job['id']}`")
+                st.progress(job["progress"])
+                st.caption(job["current_step_name"])
+            with col2:
+                if job["execution_status"] in ("queued", "running"):
+                    # A running product ad is one blocking request the server finishes regardless
+                    aborts = job["kind"] != PRODUCT_AD or job["execution_status"] == "queued"
+                    if st.button(
+                        "⏹️ Cancel",
+                        key=f"cancel_job_{job['id']}",
+                        help=None if aborts else "Stops following this job; a running product ad request cannot be aborted",
+                    ):
+                        tracker.cancel(job["id"])
+                        st.rerun()
+            if job["final_video_url"]:
+                st.video(job["final_video_url"])
+            if job["streaming_events"]:
+                with st.expander("Events", expanded=False):
+                    for event in reversed(job["streaming_events"][-5:]):
+                        st.write(f"[{event.get('timestamp', '')}] {event.get('type', 'unknown')}: {event.get('message', '')}")
+
+    if any(job["execution_status"] not in ("queued", "running") for job in jobs):
+        if st.button("🧹 Clear Finished Jobs"):
+            tracker.clear_finished()
+            st.rerun()
+
+
 def stream_ugc_execution(payload: Dict[str, Any]):
     """Legacy function - kept for compatibility"""
     # This is the old function that used threading - now we use the real-time version
@@ -672,6 +717,8 @@ if not st.session_state.api_status_checked:
     )
     st.info("Run: `python api_server.py` to start the server")
     if st.button("🔄 Retry Connection"):
+        check_api_health.clear()
+        check_upload_status.clear()
         st.session_state.api_status_checked = check_api_health()
         st.rerun()
     st.stop()
@@ -836,10 +883,10 @@ elif st.session_state.current_step == "character_selection":
                 # st.markdown(f'<div class="{card_class}">', unsafe_allow_html=True)
                 
                 try:
+                    st.image(character_thumbnail(url), width=150)
+                except Exception:
+                    # Thumbnail unavailable: let the browser load the original
                     st.image(url, width=150)
-                except:
-                    st.markdown("**Character Preview**")
-                    st.markdown("*Image loading...*")
                 
                 st.markdown(f"**Character {i+1}**")
                 
@@ -916,7 +963,7 @@ elif st.session_state.current_step == "product_image":
             st.image(uploaded_file, caption="Product Image Preview", width=300)
 
             if st.button("Upload Image", type="primary"):
-                product_url = upload_to_cloudinary(uploaded_file)
+                product_url = upload_product_image(uploaded_file)
                 if product_url:
                     st.session_state.flow_data["product_image_source"] = "upload"
                     st.session_state.flow_data["product_url"] = product_url
@@ -1130,38 +1177,22 @@ elif st.session_state.current_step == "execution":
         )
 
         button_text = "🚀 Start UGC Generation" if st.session_state.ad_type_choice == "1" else "🚀 Start Product Ad Generation"
-        if st.button(button_text, type="primary", use_container_width=True):
-            # Prepare API payload based on ad type
-            if st.session_state.ad_type_choice == "1":  # UGC Ad
-                api_payload = {
-                    "character_choice": st.session_state.flow_data["character_choice"],
-                    "product_url": st.session_state.flow_data["product_url"],
-                    "dialog_choice": st.session_state.flow_data["dialog_choice"],
-                }
-
-                # Add conditional fields
-                if st.session_state.flow_data["character_choice"] == "1":
-                    api_payload["custom_character_url"] = st.session_state.flow_data[
-                        "custom_character_url"
-                    ]
-                else:
-                    api_payload["prebuild_character_choice"] = st.session_state.flow_data[
-                        "prebuild_character_choice"
-                    ]
-
-                if st.session_state.flow_data["dialog_choice"] == "1":
-                    api_payload["custom_dialog"] = st.session_state.flow_data[
-                        "custom_dialog"
-                    ]
-            else:  # Product Ad
-                api_payload = {
-                    "product_url": st.session_state.flow_data["product_url"],
-                    "ad_prompt": st.session_state.flow_data["ad_prompt"],
-                }
+        col1, col2 = st.columns(2)
+        with col1:
+            start_clicked = st.button(button_text, type="primary", use_container_width=True)
+        with col2:
+            if st.button("📥 Run in Background", use_container_width=True,
+                         help="Queue this ad and start another one; follow it in the jobs dashboard"):
+                ad_type = UGC if st.session_state.ad_type_choice == "1" else PRODUCT_AD
+                label = f"{'UGC Ad' if ad_type == UGC else 'Product Ad'} · {st.session_state.flow_data.get('product_url', '')[-40:]}"
+                st.session_state.job_tracker.submit(ad_type, label, build_api_payload())
+                reset_flow()
+                st.rerun()
 
+        if start_clicked:
             # Set execution status and clear previous events
             st.session_state.execution_status = "running"
-            st.session_state.streaming_events = []
+            st.session_state.streaming_events = new_event_log()
             st.session_state.final_video_url = None
             st.session_state.progress = 0.0
             st.session_state.current_step_name = "Starting..."
@@ -1197,36 +1228,11 @@ elif st.session_state.current_step == "execution":
             st.session_state.streaming_started = True
             
             # Prepare API payload from stored data based on ad type
+            api_payload = build_api_payload()
             if st.session_state.ad_type_choice == "1":  # UGC Ad
-                api_payload = {
-                    "character_choice": st.session_state.flow_data["character_choice"],
-                    "product_url": st.session_state.flow_data["product_url"],
-                    "dialog_choice": st.session_state.flow_data["dialog_choice"],
-                }
-
-                # Add conditional fields
-                if st.session_state.flow_data["character_choice"] == "1":
-                    api_payload["custom_character_url"] = st.session_state.flow_data[
-                        "custom_character_url"
-                    ]
-                else:
-                    api_payload["prebuild_character_choice"] = st.session_state.flow_data[
-                        "prebuild_character_choice"
-                    ]
-
-                if st.session_state.flow_data["dialog_choice"] == "1":
-                    api_payload["custom_dialog"] = st.session_state.flow_data[
-                        "custom_dialog"
-                    ]
-
                 # Start real-time UGC streaming (this will block until completion)
                 stream_ugc_execution_realtime(api_payload, status_placeholder, progress_placeholder, events_placeholder)
             else:  # Product Ad
-                api_payload = {
-                    "product_url": st.session_state.flow_data["product_url"],
-                    "ad_prompt": st.session_state.flow_data["ad_prompt"],
-                }
-                
                 # Start Product Ad execution
                 stream_product_ad_execution(api_payload, status_placeholder, progress_placeholder, events_placeholder)
             
@@ -1240,7 +1246,7 @@ elif st.session_state.current_step == "execution":
             with events_placeholder.container():
                 if st.session_state.streaming_events:
                     st.markdown("### 🔍 Live Events Log")
-                    recent_events = st.session_state.streaming_events[-5:]
+                    recent_events = latest_events(5)
                     for event in reversed(recent_events):
                         event_type = event.get("type", "unknown")
                         event_message = event.get("message", str(event))
@@ -1373,9 +1379,7 @@ elif st.session_state.current_step == "execution":
 
         if st.session_state.streaming_events:
             with st.expander("📊 Error Events Log", expanded=True):
-                for event in st.session_state.streaming_events[
-                    -5:
-                ]:  # Show last 5 events
+                for event in latest_events(5):  # Show last 5 events
                     event_type = event.get("type", "unknown")
                     event_time = event.get("timestamp", "")
                     event_message = event.get("message", str(event))
@@ -1389,7 +1393,7 @@ elif st.session_state.current_step == "execution":
         with col1:
             if st.button("🔄 Try Again", type="primary"):
                 st.session_state.execution_status = "idle"
-                st.session_state.streaming_events = []
+                st.session_state.streaming_events = new_event_log()
                 st.session_state.progress = 0.0
                 st.session_state.current_step_name = "Ready to start"
                 st.rerun()
@@ -1498,7 +1502,7 @@ elif st.session_state.current_step == "social_sharing":
             
             try:
                 # Make API request to social scheduler
-                response = requests.post(
+                response = http_session.post(
                     f"{API_BASE_URL}/execute-social-scheduler-realtime",
                     json=social_data,
                     stream=True,
@@ -1540,19 +1544,16 @@ elif st.session_state.current_step == "social_sharing":
                                     progress = 0.1
                                 
                                 elif event_type == "step_started":
-                                    step_name = event.get("step_name", "")
-                                    if "social media platform detector" in step_name.lower():
+                                    step_id = event.get("step_id", "")
+                                    progress = step_progress(event, 0.8)
+                                    if step_id == "detect_channels":
                                         status_msg = "⏳ Detecting target platform..."
-                                        progress = 0.2
-                                    elif "replicate gpt-4o" in step_name.lower():
+                                    elif step_id == "generate_captions":
                                         status_msg = "⏳ Generating social media captions..."
-                                        progress = 0.4
-                                    elif "extract" in step_name.lower() and "time" in step_name.lower():
+                                    elif step_id == "extract_time":
                                         status_msg = "⏳ Extracting scheduling time..."
-                                        progress = 0.6
                                     else:
                                         status_msg = f"⏳ {event.get('message', 'Processing step...')}"
-                                        progress = min(progress + 0.15, 0.8)
                                     
                                     with status_placeholder.container():
                                         st.info(status_msg)
@@ -1560,52 +1561,28 @@ elif st.session_state.current_step == "social_sharing":
                                         st.progress(progress)
                                 
                                 elif event_type == "step_completed":
-                                    step_name = event.get("step_name", "")
-                                    output = event.get("output", "")
-                                    
-                                    if "social media platform detector" in step_name.lower():
-                                        platform = output.split('=')[1].split()[0] if '=' in output else 'Unknown'
-                                        status_msg = f"✅ Platform detected: {platform}"
-                                        progress = 0.3
-                                    elif "replicate gpt-4o" in step_name.lower():
+                                    step_id = event.get("step_id", "")
+                                    output = event.get("output")
+                                    if not isinstance(output, dict):
+                                        output = {}
+                                    progress = step_progress(event, 0.9)
+
+                                    if step_id == "detect_channels":
+                                        status_msg = f"✅ Platform detected: {output.get('channel', 'Unknown')}"
+                                    elif step_id == "generate_captions":
                                         status_msg = "✅ Social media captions generated!"
-                                        progress = 0.7
-                                        
-                                        # Try to parse the output to show generated content
-                                        # The output might be a JSON string or object
-                                        try:
-                                            if isinstance(output, str):
-                                                # Try to find JSON-like content in the output
-                                                import re
-                                                json_match = re.search(r'\{.*\}', output)
-                                                if json_match:
-                                                    captions_data = json.loads(json_match.group())
-                                                else:
-                                                    captions_data = {"generated": output[:200]}
-                                            else:
-                                                captions_data = output
-                                            
-                                            with content_placeholder.container():
-                                                st.write("### 🎨 Generated Content Preview")
-                                                if captions_data.get("instagram_caption"):
-                                                    st.info(f"📱 Instagram: {captions_data['instagram_caption']}")
-                                                if captions_data.get("twitter_post"):
-                                                    st.info(f"🐦 Twitter: {captions_data['twitter_post']}")
-                                                if captions_data.get("channel"):
-                                                    st.info(f"📺 Channel: {captions_data['channel']}")
-                                                
-                                        except (json.JSONDecodeError, AttributeError):
-                                            # If we can't parse, just show a generic message
-                                            with content_placeholder.container():
-                                                st.write("### 🎨 Content Generated")
-                                                st.info("Social media captions have been created!")
-                                    
-                                    elif "extract" in step_name.lower() and "time" in step_name.lower():
+                                        with content_placeholder.container():
+                                            st.write("### 🎨 Generated Content Preview")
+                                            if output.get("instagram_caption"):
+                                                st.info(f"📱 Instagram: {output['instagram_caption']}")
+                                            if output.get("twitter_post"):
+                                                st.info(f"🐦 Twitter: {output['twitter_post']}")
+                                            if output.get("channel"):
+                                                st.info(f"📺 Channel: {output['channel']}")
+                                    elif step_id == "extract_time":
                                         status_msg = "✅ Scheduling time extracted"
-                                        progress = 0.8
                                     else:
                                         status_msg = f"✅ {event.get('message', 'Step completed')}"
-                                        progress = min(progress + 0.15, 0.9)
                                     
                                     with status_placeholder.container():
                                         st.success(status_msg)
@@ -1707,6 +1684,12 @@ elif st.session_state.current_step == "social_sharing":
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+# Background jobs dashboard, refreshed in place while any job is still running
+if st.session_state.job_tracker.snapshot():
+    st.markdown("---")
+    refresh = JOBS_REFRESH_SECONDS if st.session_state.job_tracker.active() else None
+    st.fragment(run_every=refresh)(render_jobs_dashboard)()
+
 # Enhanced Sidebar with status and controls
 with st.sidebar:
     st.markdown(
@@ -1740,6 +1723,8 @@ with st.sidebar:
             unsafe_allow_html=True
         )
         if st.button("🔄 Check API", key="sidebar_api_check"):
+            check_api_health.clear()
+            check_upload_status.clear()
             st.session_state.api_status_checked = check_api_health()
             st.rerun()
 
@@ -1772,15 +1757,17 @@ with st.sidebar:
     st.write("---")
 
    
-    cloudinary_config = config.get('cloudinary', {})
-    cloudinary_status = '✅' if all([cloudinary_config.get('cloud_name'), cloudinary_config.get('api_key'), cloudinary_config.get('api_secret')]) else '❌'
-    # ✅ Cloudinary Configuration
+    upload_status = check_upload_status()
+    uploads_ready = bool(upload_status and upload_status.get("ready"))
+    upload_icon = '✅' if uploads_ready else '❌'
+    upload_label = f"Uploads ({upload_status['backend']})" if upload_status else "Uploads (server unreachable)"
+    # ✅ Server upload readiness
     st.markdown(
         f'''
-        <div style="background: linear-gradient(135deg, {'#10b981 0%, #059669 100%' if cloudinary_status == '✅' else '#f59e0b 0%, #d97706 100%'}); 
+        <div style="background: linear-gradient(135deg, {'#10b981 0%, #059669 100%' if uploads_ready else '#f59e0b 0%, #d97706 100%'}); 
                     padding: 0.75rem; border-radius: 6px; margin: 0.5rem 0; box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);">
-            <p style="margin: 0; color: {'#f0fdf4' if cloudinary_status == '✅' else '#fefbf0'}; font-size: 0.9rem; font-weight: 500; text-shadow: 0 1px 2px rgba(0, 0, 0, 0.2);">
-                {cloudinary_status} Cloudinary Configuration
+            <p style="margin: 0; color: {'#f0fdf4' if uploads_ready else '#fefbf0'}; font-size: 0.9rem; font-weight: 500; text-shadow: 0 1px 2px rgba(0, 0, 0, 0.2);">
+                {upload_icon} {upload_label}
             </p>
         </div>
         ''',
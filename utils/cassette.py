@@ -0,0 +1,299 @@
+"""
+Record-and-replay cassettes for MCP tool calls and LLM calls.
+
+PORTIA_CASSETTE_MODE=record writes every tool call (via a tool interceptor) and
+every LLM call (via CassetteGenerativeModel / CassetteChatModel) made during
+`portia.run_plan` to a gzip JSON-lines file at PORTIA_CASSETTE_PATH.
+PORTIA_CASSETTE_MODE=replay serves the recorded responses without touching the
+network, sleeping for the recorded duration times PORTIA_CASSETTE_TIME_SCALE
+(1 = original timing, 0 = as fast as possible).
+
+Calls are keyed by tool id / call kind plus a hash of the arguments with ids and
+timestamps normalized away. When a key is not found, replay falls back to the
+next unused recording for the same tool or call kind, in recorded order.
+"""
+
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple, Type
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from portia import InMemoryToolRegistry, Tool, ToolRunContext
+from portia.model import GenerativeModel, LLMProvider, Message
+from pydantic import BaseModel, ConfigDict
+
+from .tool_wrappers import wrap_tool
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODE = os.getenv("PORTIA_CASSETTE_MODE", "").lower()
+CASSETTE_PATH = os.getenv("PORTIA_CASSETTE_PATH", "cassettes/portia.jsonl.gz")
+CASSETTE_TIME_SCALE = float(os.getenv("PORTIA_CASSETTE_TIME_SCALE", "1.0"))
+
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE)
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:?\d{2})?")
+
+
+class CassetteMissError(Exception):
+    """Raised in replay mode when nothing was recorded for a call"""
+
+
+def normalize(value: Any) -> str:
+    """Canonical JSON of a call's arguments with run-specific ids and times removed"""
+    text = json.dumps(value, sort_keys=True, default=str)
+    text = _UUID.sub("<uuid>", text)
+    return _TIMESTAMP.sub("<time>", text)
+
+
+def call_key(kind: str, name: str, value: Any) -> str:
+    digest = hashlib.sha256(normalize(value).encode("utf-8")).hexdigest()[:24]
+    return f"{kind}:{name}:{digest}"
+
+
+def _to_jsonable(value: Any) -> Any:
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    return json.loads(json.dumps(value, default=str))
+
+
+class Cassette:
+    """A gzip JSON-lines recording of tool and LLM calls"""
+
+    def __init__(self, path: str, mode: str, time_scale: float = 1.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.time_scale = time_scale
+        self._lock = threading.Lock()
+        self._file = None
+        self._by_key: Dict[str, Deque[dict]] = {}
+        self._by_name: Dict[Tuple[str, str], Deque[dict]] = {}
+        self.tools: Dict[str, dict] = {}
+        self.stats = {"recorded": 0, "replayed": 0, "fallbacks": 0, "misses": 0}
+        if self.replaying:
+            self._load()
+
+    @classmethod
+    def from_env(cls) -> Optional["Cassette"]:
+        if not CASSETTE_MODE:
+            return None
+        return cls(CASSETTE_PATH, CASSETTE_MODE, CASSETTE_TIME_SCALE)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    # Recording
+
+    def _write(self, entry: dict) -> None:
+        line = json.dumps(entry, separators=(",", ":"), default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                self._file = gzip.open(self.path, "at", encoding="utf-8")
+                atexit.register(self.close)
+            self._file.write(line)
+            self._file.flush()
+            self.stats["recorded"] += 1
+
+    def record_tool_meta(self, tool: Tool) -> None:
+        self._write(
+            {
+                "kind": "tool_meta",
+                "name": tool.id,
+                "tool_name": tool.name,
+                "description": tool.description,
+                "output_schema": list(tool.output_schema),
+            }
+        )
+
+    def record(self, kind: str, name: str, request: Any, response: Any, elapsed: float, error: Optional[str] = None) -> None:
+        self._write(
+            {
+                "kind": kind,
+                "name": name,
+                "key": call_key(kind, name, request),
+                "response": response,
+                "elapsed": round(elapsed, 4),
+                "error": error,
+            }
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # Replay
+
+    def _load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["kind"] == "tool_meta":
+                    self.tools[entry["name"]] = entry
+                    continue
+                self._by_key.setdefault(entry["key"], deque()).append(entry)
+                self._by_name.setdefault((entry["kind"], entry["name"]), deque()).append(entry)
+        logger.info(f"Loaded cassette {self.path} with {sum(len(q) for q in self._by_key.values())} calls")
+
+    def replay(self, kind: str, name: str, request: Any) -> Any:
+        """Return the recorded response for a call, after sleeping for its scaled duration"""
+        key = call_key(kind, name, request)
+        with self._lock:
+            entries = self._by_key.get(key)
+            if entries:
+                entry = entries.popleft()
+                self._by_name[(kind, name)].remove(entry)
+            else:
+                fallback = self._by_name.get((kind, name))
+                if not fallback:
+                    self.stats["misses"] += 1
+                    raise CassetteMissError(f"No recorded {kind} call for {name}")
+                entry = fallback.popleft()
+                self._by_key[entry["key"]].remove(entry)
+                self.stats["fallbacks"] += 1
+            self.stats["replayed"] += 1
+        if self.time_scale > 0 and entry["elapsed"]:
+            time.sleep(entry["elapsed"] * self.time_scale)
+        if entry.get("error"):
+            raise RuntimeError(entry["error"])
+        return entry["response"]
+
+    # Tool integration
+
+    def tool_interceptor(self, tool: Tool, ctx: ToolRunContext, args: Dict[str, Any], call_next) -> Any:
+        if self.replaying:
+            return self.replay("tool", tool.id, args)
+        started_at = time.perf_counter()
+        try:
+            result = call_next(args)
+        except Exception as e:
+            self.record("tool", tool.id, args, None, time.perf_counter() - started_at, error=str(e))
+            raise
+        self.record("tool", tool.id, args, _to_jsonable(result), time.perf_counter() - started_at)
+        return result
+
+    def replay_registry(self) -> InMemoryToolRegistry:
+        """Tools rebuilt from the cassette's metadata, answering from the recording"""
+        tools = [
+            ReplayTool(
+                id=meta["name"],
+                name=meta["tool_name"],
+                description=meta["description"],
+                output_schema=tuple(meta["output_schema"]),
+            )
+            for meta in self.tools.values()
+        ]
+        return InMemoryToolRegistry.from_local_tools([wrap_tool(tool, [self.tool_interceptor]) for tool in tools])
+
+
+class _AnyArgs(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+
+class ReplayTool(Tool[Any]):
+    """Placeholder for a recorded tool; the cassette interceptor answers before run() is reached"""
+
+    args_schema: Type[BaseModel] = _AnyArgs
+
+    def run(self, ctx: ToolRunContext, **kwargs: Any) -> Any:
+        raise CassetteMissError(f"{self.id} is not available in replay mode")
+
+
+def _messages_request(messages: List[Message]) -> List[dict]:
+    return [message.model_dump(mode="json") for message in messages]
+
+
+class CassetteChatModel(BaseChatModel):
+    """LangChain chat model that records or replays the wrapped model's generations"""
+
+    inner: Optional[Any] = None
+    cassette: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "portia-cassette"
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        request = {"messages": messages_to_dict(messages), "kwargs": kwargs}
+        if self.cassette.replaying:
+            return self._result(self.cassette.replay("chat", "generate", request))
+        started_at = time.perf_counter()
+        result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        response = {
+            "messages": messages_to_dict([generation.message for generation in result.generations]),
+            "llm_output": _to_jsonable(result.llm_output or {}),
+        }
+        self.cassette.record("chat", "generate", request, response, time.perf_counter() - started_at)
+        return result
+
+    @staticmethod
+    def _result(response: dict) -> ChatResult:
+        return ChatResult(
+            generations=[ChatGeneration(message=m) for m in messages_from_dict(response["messages"])],
+            llm_output=response.get("llm_output"),
+        )
+
+
+class CassetteGenerativeModel(GenerativeModel):
+    """Portia GenerativeModel that records or replays another model's responses"""
+
+    provider: LLMProvider = LLMProvider.OPENAI
+
+    def __init__(self, cassette: Cassette, inner: Optional[GenerativeModel] = None):
+        super().__init__(model_name=getattr(inner, "model_name", None) or "cassette")
+        self.cassette = cassette
+        self.inner = inner
+
+    def _call(self, name: str, request: Any, call):
+        if self.cassette.replaying:
+            return self.cassette.replay("llm", name, request)
+        started_at = time.perf_counter()
+        result = call()
+        self.cassette.record("llm", name, request, _to_jsonable(result), time.perf_counter() - started_at)
+        return result
+
+    def get_response(self, messages: List[Message]) -> Message:
+        result = self._call(
+            "get_response", _messages_request(messages), lambda: self.inner.get_response(messages)
+        )
+        return Message.model_validate(result) if isinstance(result, dict) else result
+
+    def get_structured_response(self, messages: List[Message], schema: Type[BaseModel]) -> BaseModel:
+        request = {"messages": _messages_request(messages), "schema": schema.__name__}
+        result = self._call(
+            f"structured:{schema.__name__}",
+            request,
+            lambda: self.inner.get_structured_response(messages, schema),
+        )
+        return schema.model_validate(result) if isinstance(result, dict) else result
+
+    async def aget_response(self, messages: List[Message]) -> Message:
+        return await asyncio.to_thread(self.get_response, messages)
+
+    async def aget_structured_response(self, messages: List[Message], schema: Type[BaseModel]) -> BaseModel:
+        return await asyncio.to_thread(self.get_structured_response, messages, schema)
+
+    def to_langchain(self) -> BaseChatModel:
+        inner = None if self.cassette.replaying else self.inner.to_langchain()
+        return CassetteChatModel(inner=inner, cassette=self.cassette)
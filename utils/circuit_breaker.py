@@ -0,0 +1,195 @@
+"""
+Circuit breakers per upstream tool id.
+
+Each MCP tool (create_predictions, get_predictions, the Make.com sheet webhook)
+gets a breaker that tracks call outcomes over a rolling window. When at least
+CIRCUIT_MIN_CALLS calls were made and the failure rate reaches
+CIRCUIT_FAILURE_RATE, the breaker opens: calls fail immediately with
+CircuitOpenError (a ToolHardError, so the plan stops instead of retrying) and
+the API sheds new requests with 503. After CIRCUIT_OPEN_SECONDS one probe call
+is let through; its outcome closes the breaker or opens it again.
+
+A failure is a tool exception, an HTTP 429/5xx response or a transport error
+response (an `error` without a prediction status). A prediction that ends as
+"failed" carries the model's error message in `error` too, but that is the
+model's answer, not an unhealthy upstream, so it counts as a success.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from portia.errors import ToolHardError
+
+from .rate_limits import TERMINAL_STATUSES, response_fields
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Numeric values for the /metrics gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(ToolHardError):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+    def __init__(self, tool_id: str, retry_after: float):
+        self.tool_id = tool_id
+        self.retry_after = retry_after
+        super().__init__(f"{tool_id} is unavailable (circuit open), retry in {retry_after:.0f}s")
+
+
+class CircuitBreaker:
+    """Rolling-window failure-rate breaker for one upstream"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = CIRCUIT_FAILURE_RATE,
+        min_calls: int = CIRCUIT_MIN_CALLS,
+        window_seconds: float = CIRCUIT_WINDOW_SECONDS,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.stats = {"rejected": 0, "opened": 0}
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+            self._outcomes.popleft()
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe is allowed (0 when calls are allowed)"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(self._opened_at + self.open_seconds - time.monotonic(), 0.0)
+
+    def is_open(self) -> bool:
+        return self.retry_after() > 0
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go through now"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now >= self._opened_at + self.open_seconds:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return
+            if self.state == CLOSED:
+                return
+            self.stats["rejected"] += 1
+            retry_after = max(self._opened_at + self.open_seconds - now, 1.0)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                self._outcomes.clear()
+                if ok:
+                    self.state = CLOSED
+                    logger.info(f"Circuit for {self.name} closed")
+                else:
+                    self._open(now)
+                return
+            self._outcomes.append((now, ok))
+            self._trim(now)
+            failures = sum(1 for _, outcome in self._outcomes if not outcome)
+            if (
+                self.state == CLOSED
+                and len(self._outcomes) >= self.min_calls
+                and failures / len(self._outcomes) >= self.failure_rate
+            ):
+                self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self.stats["opened"] += 1
+        logger.warning(f"Circuit for {self.name} opened for {self.open_seconds:.0f}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.monotonic())
+            failures = sum(1 for _, outcome in self._outcomes if not outcome)
+            return {
+                "state": self.state,
+                "calls": len(self._outcomes),
+                "failures": failures,
+                **self.stats,
+            }
+
+
+def is_error_response(result: Any) -> bool:
+    """Whether a tool result is an upstream error rather than an answer"""
+    fields = response_fields(result)
+    status = fields.get("status")
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if status in TERMINAL_STATUSES:
+        return False
+    return bool(fields.get("error"))
+
+
+class CircuitBreakers:
+    """One breaker per tool id, created on first use"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, tool_id: str) -> CircuitBreaker:
+        with self._lock:
+            if tool_id not in self._breakers:
+                self._breakers[tool_id] = CircuitBreaker(tool_id)
+            return self._breakers[tool_id]
+
+    def unavailable(self, *tool_ids: str) -> Optional[Tuple[str, float]]:
+        """(tool_id, retry_after) for the first listed upstream whose circuit is open"""
+        for tool_id in tool_ids:
+            retry_after = self.get(tool_id).retry_after()
+            if retry_after > 0:
+                return tool_id, retry_after
+        return None
+
+    def tool_interceptor(self, tool, ctx, args: Dict[str, Any], call_next) -> Any:
+        breaker = self.get(tool.id)
+        breaker.before_call()
+        try:
+            result = call_next(args)
+        except Exception:
+            breaker.record(False)
+            raise
+        breaker.record(not is_error_response(result))
+        return result
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {tool_id: breaker.snapshot() for tool_id, breaker in breakers.items()}
+
+
+circuit_breakers = CircuitBreakers()
@@ -1,4 +1,6 @@
+import logging
 import os
+import threading
 from dotenv import load_dotenv
 from portia import (
     Config,
@@ -9,34 +11,154 @@ from portia import (
     LogLevel,
 )
 from portia.execution_hooks import ExecutionHooks
+from portia.model import OpenAIGenerativeModel
+from pydantic import SecretStr
 from .streaming_hooks import create_streaming_hooks
+from .instrumentation import instrument_hooks
+from .hook_routing import routed_hooks
+from .cassette import Cassette, CassetteGenerativeModel
+from .tool_wrappers import wrap_registry
+from .run_replication import RunReplicator
+from .http_pool import get_http_client
+from .rate_limits import rate_limiter
+from .circuit_breaker import circuit_breakers
+from .hedging import CANCEL_PREDICTIONS_TOOL_ID, GET_PREDICTIONS_TOOL_ID, hedger
 from portia import InMemoryToolRegistry
 
 # from utils.hooks import pass
 
+logger = logging.getLogger(__name__)
+
 
 load_dotenv()
 # ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY") \
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ACCOUNT_ID = os.getenv("MAKE_DOT_COM_ACCOUNT_ID")
 
-openai_config = Config.from_default(
-    llm_provider=LLMProvider.OPENAI,
-    default_model="openai/gpt-4o",
-    openai_api_key=OPENAI_API_KEY,
-    storage_class=StorageClass.CLOUD,
-    log_level=LogLevel.DEBUG,
-)
+# PORTIA_OFFLINE=1 swaps the MCP tools and the LLM for local stubs (benchmarks, no network)
+OFFLINE_MODE = os.getenv("PORTIA_OFFLINE", "").lower() in ("1", "true", "yes")
+
+STORAGE_CLASSES = {
+    "memory": StorageClass.MEMORY,
+    "disk": StorageClass.DISK,
+    "cloud": StorageClass.CLOUD,
+}
+
+
+def _storage_class(env_name, default):
+    value = os.getenv(env_name, default).lower()
+    if value not in STORAGE_CLASSES:
+        raise ValueError(f"{env_name} must be one of {', '.join(STORAGE_CLASSES)}, got {value!r}")
+    return STORAGE_CLASSES[value]
+
+
+# Plan and run storage for the main flows, and for ephemeral plans such as prediction
+# polling (hundreds of runs per video that nobody looks at again). Disk storage is
+# kept under PORTIA_STORAGE_DIR.
+STORAGE_CLASS = _storage_class("PORTIA_STORAGE", "cloud")
+EPHEMERAL_STORAGE_CLASS = _storage_class("PORTIA_EPHEMERAL_STORAGE", "memory")
+STORAGE_DIR = os.getenv("PORTIA_STORAGE_DIR", ".portia_runs")
+# With local main storage, copy finished main-flow runs to Portia cloud in the background
+REPLICATE_RUNS_TO_CLOUD = os.getenv("PORTIA_REPLICATE_RUNS_TO_CLOUD", "").lower() in ("1", "true", "yes")
+
+# Everything below is built on first use, not at import: the tool registry fetches
+# MCP tool metadata over the network, and api_server/main/CLI imports must stay cheap.
+
+
+def _memoized(build):
+    """Build once on first call; concurrent first callers wait for the same result"""
+    lock = threading.Lock()
+    result = []
+
+    def get():
+        if not result:
+            with lock:
+                if not result:
+                    result.append(build())
+        return result[0]
+
+    get.is_built = lambda: bool(result)
+    get.__doc__ = build.__doc__
+    return get
+
+
+def _config_with_model(model, storage_class, log_level):
+    """Config that uses `model` (a stub or cassette GenerativeModel) for every LLM role"""
+    return Config.from_default(
+        llm_provider=LLMProvider.OPENAI,
+        default_model=model,
+        planning_model=model,
+        execution_model=model,
+        introspection_model=model,
+        summarizer_model=model,
+        openai_api_key=OPENAI_API_KEY or "offline",
+        storage_class=storage_class,
+        storage_dir=STORAGE_DIR,
+        log_level=log_level,
+    )
+
+
+def _pooled_openai_model(model_name):
+    """OpenAI model on the shared keep-alive connection pool and OpenAI rate limit"""
+    return OpenAIGenerativeModel(
+        model_name=model_name,
+        api_key=SecretStr(OPENAI_API_KEY),
+        http_client=get_http_client(),
+        rate_limiter=rate_limiter.bucket("openai"),
+    )
+
+
+@_memoized
+def get_cassette():
+    """PORTIA_CASSETTE_MODE=record|replay records or serves every tool and LLM call (see cassette.py)"""
+    return Cassette.from_env()
+
+
+@_memoized
+def get_config():
+    """Portia config (stub, cassette or OpenAI models)"""
+    cassette = get_cassette()
+    if OFFLINE_MODE:
+        os.environ.setdefault("ANONYMIZED_TELEMETRY", "false")
+        from .stub_backends import StubGenerativeModel
 
+        config = _config_with_model(StubGenerativeModel(), StorageClass.MEMORY, LogLevel.WARNING)
+    else:
+        config = Config.from_default(
+            llm_provider=LLMProvider.OPENAI,
+            default_model=_pooled_openai_model("gpt-4o") if OPENAI_API_KEY else "openai/gpt-4o",
+            openai_api_key=OPENAI_API_KEY,
+            storage_class=STORAGE_CLASS,
+            storage_dir=STORAGE_DIR,
+            log_level=LogLevel.DEBUG,
+        )
 
-# Custom tools will be imported and registered separately to avoid circular imports
+    if cassette:
+        inner_model = None if cassette.replaying else config.get_default_model()
+        config = _config_with_model(
+            CassetteGenerativeModel(cassette, inner_model),
+            StorageClass.MEMORY if cassette.replaying or OFFLINE_MODE else STORAGE_CLASS,
+            LogLevel.WARNING if cassette.replaying else LogLevel.DEBUG,
+        )
+    return config
 
-# Create the base tool registry with MCP tools
-mcp_tool_registry = (
-    PortiaToolRegistry(config=openai_config)
-    .with_tool_description(
-        "portia:mcp:custom:mcp.replicate.com:get_predictions",
-        """
+
+@_memoized
+def get_tool_registry():
+    """Tool registry with the MCP tools (fetched from Portia on first use)"""
+    cassette = get_cassette()
+    if OFFLINE_MODE:
+        from .stub_backends import create_stub_tool_registry
+
+        registry = create_stub_tool_registry()
+    elif cassette and cassette.replaying:
+        registry = cassette.replay_registry()
+    else:
+        registry = (
+            PortiaToolRegistry(config=get_config())
+            .with_tool_description(
+                "portia:mcp:custom:mcp.replicate.com:get_predictions",
+                """
         Use this tool to fetch a Replicate prediction by its id.
         Always include:
           - id = the prediction id string you are checking
@@ -46,10 +168,10 @@ mcp_tool_registry = (
           - output: list of image URL strings if present, otherwise null
         MAKE ONLY ONE CALL.
         """,
-    )
-    .with_tool_description(
-        "portia:mcp:custom:us2.make.com:s2825571_on_demand_add_row_to_sheet",
-        f"""
+            )
+            .with_tool_description(
+                "portia:mcp:custom:us2.make.com:s2825571_on_demand_add_row_to_sheet",
+                f"""
 Use this tool to add a row to a Google Sheet for tracking UGC content generation.
 
 Input payload fields:
@@ -77,21 +199,86 @@ Example payload:
   "channel": "both"
 }}
 """,
+            )
+        )
+
+    if not (cassette and cassette.replaying):
+        # Outermost interceptors, so recorded cassettes hold the upstream timings only;
+        # an open circuit fails before queueing for a rate-limit token, and each hedged
+        # attempt queues on its own
+        registry = wrap_registry(
+            registry,
+            [circuit_breakers.tool_interceptor, hedger.tool_interceptor, rate_limiter.tool_interceptor],
+        )
+        if hedger.enabled:
+            try:
+                hedger.get_tool = registry.get_tool(GET_PREDICTIONS_TOOL_ID)
+                hedger.cancel_tool = registry.get_tool(CANCEL_PREDICTIONS_TOOL_ID)
+            except Exception:
+                logger.warning("No get/cancel_predictions tool, create_predictions calls will not be hedged")
+
+    if cassette and not cassette.replaying:
+        for tool in registry.get_tools():
+            cassette.record_tool_meta(tool)
+        registry = wrap_registry(registry, [cassette.tool_interceptor])
+    return registry
+
+
+@_memoized
+def get_run_replicator():
+    """Background copier of finished runs to cloud storage, or None when not replicating"""
+    config = get_config()
+    if not REPLICATE_RUNS_TO_CLOUD or config.storage_class == StorageClass.CLOUD:
+        return None
+    return RunReplicator(config)
+
+
+@_memoized
+def get_portia():
+    """The shared Portia instance; bind per-run hooks with hook_routing.run_hooks()"""
+    hooks = ExecutionHooks()
+    replicator = get_run_replicator()
+    if replicator is not None:
+        if "after_plan_run" in type(hooks).model_fields:
+            hooks = ExecutionHooks(after_plan_run=replicator.after_plan_run)
+        else:
+            logger.warning("This Portia version has no after_plan_run hook, runs will not be replicated")
+    return Portia(
+        config=get_config(),
+        execution_hooks=instrument_hooks(routed_hooks(hooks)),
+        tools=get_tool_registry()
     )
-)
 
-def get_portia_with_custom_tools():
-    """Get Portia instance with MCP tools (custom tools removed)"""
-    # No custom tools needed anymore - just return Portia with MCP tools
+
+@_memoized
+def get_ephemeral_portia():
+    """Portia instance for throwaway plans (prediction polling), on PORTIA_EPHEMERAL_STORAGE"""
+    config = get_config()
+    if config.storage_class != EPHEMERAL_STORAGE_CLASS:
+        config = config.model_copy(update={"storage_class": EPHEMERAL_STORAGE_CLASS})
     return Portia(
-        config=openai_config,
-        execution_hooks=ExecutionHooks(),
-        tools=mcp_tool_registry
+        config=config,
+        execution_hooks=instrument_hooks(routed_hooks(ExecutionHooks())),
+        tools=get_tool_registry()
     )
 
-# Create the default Portia instance (without custom tools for now)
-portia = Portia(
-    config=openai_config,
-    execution_hooks=ExecutionHooks(),
-    tools=mcp_tool_registry
-)
+
+def get_portia_with_custom_tools():
+    """Get Portia instance with MCP tools (custom tools removed)"""
+    # Same configuration as the default instance, so share it instead of building one per call
+    return get_portia()
+
+
+# Backwards-compatible module attributes, built on first access
+_LAZY_ATTRIBUTES = {
+    "openai_config": get_config,
+    "mcp_tool_registry": get_tool_registry,
+    "cassette": get_cassette,
+    "portia": get_portia,
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,322 @@
+"""
+Per-job cost ledger for OpenAI and Replicate usage.
+
+API requests open a job (route + customer) and bind it to the current context;
+plan threads started with `with_job_context()` inherit it. Instrumentation
+listeners then turn step token counts and Replicate usage into estimated cost
+entries, stored in SQLite next to the job.
+
+Each Replicate prediction is charged once: synchronous creates when their step
+finishes, polled predictions when polling ends. Run time is Replicate's own
+metrics.predict_time, not client wall time, so queueing and poll sleeps are
+never billed. Replicate's proxies of OpenAI models (openai/gpt-4o) bill per
+token and are priced at the OpenAI rates.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEDGER_PATH = os.getenv("COST_LEDGER_DB", "cost_ledger.db")
+
+# USD per 1M tokens: (input, output)
+OPENAI_PRICES_PER_MILLION = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+}
+DEFAULT_OPENAI_MODEL = "gpt-4o"
+
+# USD per second of Replicate run time, keyed by model version
+REPLICATE_PRICES_PER_SECOND: Dict[str, float] = json.loads(
+    os.getenv("REPLICATE_PRICES_PER_SECOND", "{}")
+)
+DEFAULT_REPLICATE_PRICE_PER_SECOND = float(
+    os.getenv("REPLICATE_DEFAULT_PRICE_PER_SECOND", "0.0014")
+)
+
+GROUP_BY_COLUMNS = {
+    "route": "j.route",
+    "customer": "j.customer_id",
+    "step": "e.step_name",
+    "model": "e.model",
+}
+
+
+@dataclass
+class CostJob:
+    job_id: str
+    route: str
+    customer_id: Optional[str]
+    # Last Replicate model version this job called, for predictions polled without one
+    last_replicate_model: Optional[str] = None
+
+
+_current_job: contextvars.ContextVar[Optional[CostJob]] = contextvars.ContextVar(
+    "cost_ledger_job", default=None
+)
+
+
+def current_job() -> Optional[CostJob]:
+    return _current_job.get()
+
+
+def bind_job(job: Optional[CostJob]) -> contextvars.Token:
+    return _current_job.set(job)
+
+
+def unbind_job(token: contextvars.Token) -> None:
+    _current_job.reset(token)
+
+
+def with_job_context(fn: Callable) -> Callable:
+    """Wrap a thread target so it runs with the caller's job (threads don't inherit contextvars)"""
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return ctx.run(fn, *args, **kwargs)
+
+    return run
+
+
+def openai_cost(model: Optional[str], input_tokens: int, output_tokens: int) -> float:
+    name = (model or DEFAULT_OPENAI_MODEL).split("/")[-1]
+    # Dated snapshots ("gpt-4o-2024-08-06") price like their base model
+    prices = OPENAI_PRICES_PER_MILLION.get(name)
+    if prices is None:
+        base = max(
+            (known for known in OPENAI_PRICES_PER_MILLION if name.startswith(known)),
+            key=len,
+            default=DEFAULT_OPENAI_MODEL,
+        )
+        prices = OPENAI_PRICES_PER_MILLION[base]
+    return (input_tokens * prices[0] + output_tokens * prices[1]) / 1_000_000
+
+
+def replicate_cost(model: Optional[str], seconds: float) -> float:
+    price = REPLICATE_PRICES_PER_SECOND.get(model or "", DEFAULT_REPLICATE_PRICE_PER_SECOND)
+    return seconds * price
+
+
+def is_token_priced(model: Optional[str]) -> bool:
+    """Replicate models billed per token rather than per second of run time"""
+    return (model or "").startswith("openai/")
+
+
+class CostLedger:
+    """SQLite-backed jobs and cost entries"""
+
+    def __init__(self, db_path: str = DEFAULT_LEDGER_PATH):
+        self.db_path = os.path.abspath(db_path)
+        # Created on first use, so importing the module never creates a database file
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._init_db()
+                    self._initialized = True
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self) -> None:
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cost_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    route TEXT NOT NULL,
+                    customer_id TEXT,
+                    created_at TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cost_entries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL REFERENCES cost_jobs(job_id),
+                    plan_run_id TEXT,
+                    plan_name TEXT,
+                    step_name TEXT,
+                    provider TEXT NOT NULL,
+                    model TEXT,
+                    input_tokens INTEGER NOT NULL DEFAULT 0,
+                    output_tokens INTEGER NOT NULL DEFAULT 0,
+                    run_seconds REAL NOT NULL DEFAULT 0,
+                    cost_usd REAL NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cost_entries_job ON cost_entries(job_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cost_jobs_route ON cost_jobs(route)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cost_jobs_customer ON cost_jobs(customer_id)")
+
+    def start_job(self, route: str, customer_id: Optional[str] = None) -> CostJob:
+        job = CostJob(job_id=str(uuid.uuid4()), route=route, customer_id=customer_id)
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO cost_jobs (job_id, route, customer_id, created_at) VALUES (?, ?, ?, ?)",
+                (job.job_id, route, customer_id, datetime.now(timezone.utc).isoformat()),
+            )
+        return job
+
+    def add_entry(
+        self,
+        job: CostJob,
+        provider: str,
+        model: Optional[str],
+        cost_usd: float,
+        plan_run_id: Optional[str] = None,
+        plan_name: Optional[str] = None,
+        step_name: Optional[str] = None,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        run_seconds: float = 0.0,
+    ) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO cost_entries
+                    (job_id, plan_run_id, plan_name, step_name, provider, model,
+                     input_tokens, output_tokens, run_seconds, cost_usd, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    job.job_id,
+                    plan_run_id,
+                    plan_name,
+                    step_name,
+                    provider,
+                    model,
+                    input_tokens,
+                    output_tokens,
+                    run_seconds,
+                    cost_usd,
+                    datetime.now(timezone.utc).isoformat(),
+                ),
+            )
+
+    # Instrumentation listeners
+
+    def record_step(self, record: Any) -> None:
+        """Charge a finished step's LLM tokens and synchronous Replicate time to the current job"""
+        job = current_job()
+        if job is None:
+            return
+        common = {
+            "plan_run_id": record.plan_run_id,
+            "plan_name": record.plan_name,
+            "step_name": record.step_name,
+        }
+        if record.input_tokens or record.output_tokens:
+            self.add_entry(
+                job,
+                provider="openai",
+                model=record.llm_model or DEFAULT_OPENAI_MODEL,
+                cost_usd=openai_cost(record.llm_model, record.input_tokens, record.output_tokens),
+                input_tokens=record.input_tokens,
+                output_tokens=record.output_tokens,
+                **common,
+            )
+        if record.replicate_models:
+            job.last_replicate_model = record.replicate_models[-1]
+        for usage in record.replicate_predictions:
+            self._charge_prediction(job, usage, **common)
+
+    def record_prediction(self, summary: Dict[str, Any]) -> None:
+        """Charge a polled prediction to the current job once polling ends"""
+        job = current_job()
+        if job is None:
+            return
+        self._charge_prediction(job, summary, step_name="replicate_prediction")
+
+    def _charge_prediction(self, job: CostJob, usage: Dict[str, Any], **common: Any) -> None:
+        model = usage.get("model") or job.last_replicate_model
+        predict_seconds = usage.get("predict_seconds")
+        if is_token_priced(model):
+            self.add_entry(
+                job,
+                provider="replicate",
+                model=model,
+                cost_usd=openai_cost(model, usage.get("input_tokens", 0), usage.get("output_tokens", 0)),
+                input_tokens=usage.get("input_tokens", 0),
+                output_tokens=usage.get("output_tokens", 0),
+                run_seconds=predict_seconds or 0.0,
+                **common,
+            )
+            return
+        if predict_seconds is None:
+            logger.warning(f"Replicate prediction {usage.get('prediction_id')} reported no predict_time, not charged")
+            return
+        self.add_entry(
+            job,
+            provider="replicate",
+            model=model,
+            cost_usd=replicate_cost(model, predict_seconds),
+            run_seconds=predict_seconds,
+            **common,
+        )
+
+    # Reporting
+
+    def job_costs(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            job = conn.execute("SELECT * FROM cost_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if not job:
+                return None
+            entries = conn.execute(
+                "SELECT * FROM cost_entries WHERE job_id = ? ORDER BY id", (job_id,)
+            ).fetchall()
+        entries = [dict(entry) for entry in entries]
+        return {
+            **dict(job),
+            "total_cost_usd": sum(entry["cost_usd"] for entry in entries),
+            "entries": entries,
+        }
+
+    def aggregate(
+        self, group_by: str = "route", since: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Total cost, jobs and usage grouped by route, customer, step or model"""
+        column = GROUP_BY_COLUMNS[group_by]
+        query = f"""
+            SELECT {column} AS key,
+                   COUNT(DISTINCT j.job_id) AS jobs,
+                   COALESCE(SUM(e.cost_usd), 0) AS total_cost_usd,
+                   COALESCE(SUM(e.input_tokens), 0) AS input_tokens,
+                   COALESCE(SUM(e.output_tokens), 0) AS output_tokens,
+                   COALESCE(SUM(e.run_seconds), 0) AS run_seconds
+            FROM cost_jobs j LEFT JOIN cost_entries e ON e.job_id = j.job_id
+        """
+        params: Tuple = ()
+        if since:
+            query += " WHERE j.created_at >= ?"
+            params = (since,)
+        query += " GROUP BY key ORDER BY total_cost_usd DESC"
+        with self._connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        results = []
+        for row in rows:
+            result = dict(row)
+            result["cost_per_job_usd"] = result["total_cost_usd"] / result["jobs"] if result["jobs"] else 0.0
+            results.append(result)
+        return results
+
+
+cost_ledger = CostLedger()
@@ -0,0 +1,230 @@
+"""
+Duplicate detection for social scheduler requests and scheduled posts.
+
+Two layers:
+- Request fingerprints: identical scheduler requests that arrive while the first
+  one is still running (client retries during timeouts) are coalesced onto the
+  first request's result instead of starting another LLM + Make.com run.
+- Post index: keyed by (media_url, channel, date_time bucket) with a
+  near-duplicate caption check, consulted before anything is written to the sheet.
+"""
+
+import asyncio
+import concurrent.futures
+import difflib
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .post_queue import channels_for, parse_iso_utc
+
+# How long a completed request result is replayed to retries
+REQUEST_RESULT_TTL_SECONDS = int(os.getenv("DEDUPE_REQUEST_TTL_SECONDS", "900"))
+# Posts for the same media/channel inside one bucket are duplicates
+POST_BUCKET_SECONDS = int(os.getenv("DEDUPE_POST_BUCKET_SECONDS", "3600"))
+# How long scheduled posts stay in the index
+POST_TTL_SECONDS = int(os.getenv("DEDUPE_POST_TTL_SECONDS", str(7 * 24 * 3600)))
+# Caption similarity (0-1) at which two captions count as the same post
+CAPTION_SIMILARITY_THRESHOLD = float(os.getenv("DEDUPE_CAPTION_SIMILARITY", "0.9"))
+
+
+class DuplicatePostError(Exception):
+    """Raised when a post duplicates one that is already scheduled"""
+
+    def __init__(self, message: str, existing: Dict[str, Any]):
+        super().__init__(message)
+        self.existing = existing
+
+
+def request_fingerprint(route: str, fields: Dict[str, Any]) -> str:
+    """Stable hash of a request body; routes never share results, their responses differ"""
+    normalized = json.dumps({"route": route, "fields": fields}, sort_keys=True, default=str)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def normalize_caption(caption: Optional[str]) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    if not caption:
+        return ""
+    text = re.sub(r"[^\w#@\s]", "", caption.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def caption_similarity(a: Optional[str], b: Optional[str]) -> float:
+    a_norm, b_norm = normalize_caption(a), normalize_caption(b)
+    if not a_norm or not b_norm:
+        return 0.0
+    if a_norm == b_norm:
+        return 1.0
+    return difflib.SequenceMatcher(None, a_norm, b_norm).ratio()
+
+
+class RequestLease:
+    """Handle returned by DuplicateIndex.begin_request"""
+
+    def __init__(self, index: "DuplicateIndex", fingerprint: str, future, is_owner: bool):
+        self.index = index
+        self.fingerprint = fingerprint
+        self.future: concurrent.futures.Future = future
+        self.is_owner = is_owner
+
+    async def wait(self, timeout: Optional[float] = None) -> Any:
+        """Wait for the owning request's result (followers only)"""
+        return await asyncio.wait_for(asyncio.wrap_future(self.future), timeout)
+
+    def complete(self, result: Any) -> None:
+        if self.is_owner and not self.future.done():
+            self.future.set_result(result)
+
+    def fail(self, error: BaseException) -> None:
+        """Mark the request failed; failures are not replayed so a retry runs again"""
+        if self.is_owner and not self.future.done():
+            self.future.set_exception(error)
+            self.index.forget_request(self.fingerprint, self.future)
+
+
+class DuplicateIndex:
+    """Request coalescing plus the (media_url, channel, bucket) post index"""
+
+    def __init__(
+        self,
+        request_ttl: float = REQUEST_RESULT_TTL_SECONDS,
+        bucket_seconds: int = POST_BUCKET_SECONDS,
+        post_ttl: float = POST_TTL_SECONDS,
+        similarity_threshold: float = CAPTION_SIMILARITY_THRESHOLD,
+    ):
+        self.request_ttl = request_ttl
+        self.bucket_seconds = bucket_seconds
+        self.post_ttl = post_ttl
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        # fingerprint -> (started_at, future)
+        self._requests: "OrderedDict[str, Tuple[float, concurrent.futures.Future]]" = OrderedDict()
+        # (media_url, platform, bucket) -> post
+        self._posts: "OrderedDict[Tuple[str, str, int], Dict[str, Any]]" = OrderedDict()
+        # (platform, bucket) -> keys in _posts, for the caption check
+        self._by_bucket: Dict[Tuple[str, int], List[Tuple[str, str, int]]] = {}
+        self.stats = {"coalesced": 0, "rejected": 0, "misses": 0}
+
+    # Request coalescing
+
+    def begin_request(self, fingerprint: str) -> RequestLease:
+        """Claim a request fingerprint, or join the identical request already running"""
+        now = time.time()
+        with self._lock:
+            self._prune_requests(now)
+            entry = self._requests.get(fingerprint)
+            if entry:
+                self.stats["coalesced"] += 1
+                return RequestLease(self, fingerprint, entry[1], is_owner=False)
+            future: concurrent.futures.Future = concurrent.futures.Future()
+            self._requests[fingerprint] = (now, future)
+            self.stats["misses"] += 1
+            return RequestLease(self, fingerprint, future, is_owner=True)
+
+    def forget_request(self, fingerprint: str, future) -> None:
+        with self._lock:
+            entry = self._requests.get(fingerprint)
+            if entry and entry[1] is future:
+                del self._requests[fingerprint]
+
+    def _prune_requests(self, now: float) -> None:
+        while self._requests:
+            fingerprint, (started_at, future) = next(iter(self._requests.items()))
+            if now - started_at < self.request_ttl or not future.done():
+                break
+            del self._requests[fingerprint]
+
+    # Post index
+
+    def _bucket(self, date_time: str) -> int:
+        return int(parse_iso_utc(date_time) // self.bucket_seconds)
+
+    def find_duplicate_post(self, data: Any) -> Optional[Dict[str, Any]]:
+        """Return the already scheduled post that `data` duplicates, if any"""
+        post = data.model_dump() if hasattr(data, "model_dump") else dict(data)
+        with self._lock:
+            return self._find_duplicate_locked(post)
+
+    def record_post(self, data: Any) -> None:
+        post = data.model_dump() if hasattr(data, "model_dump") else dict(data)
+        with self._lock:
+            self._record_locked(post)
+
+    def check_and_record_post(self, data: Any) -> None:
+        """Raise DuplicatePostError for a duplicate, otherwise record the post"""
+        post = data.model_dump() if hasattr(data, "model_dump") else dict(data)
+        with self._lock:
+            existing = self._find_duplicate_locked(post)
+            if existing:
+                self.stats["rejected"] += 1
+                raise DuplicatePostError(
+                    f"Duplicate post: {existing['media_url']} is already scheduled "
+                    f"to {existing['channel']} at {existing['date_time']}",
+                    existing,
+                )
+            self._record_locked(post)
+
+    def forget_post(self, data: Any) -> None:
+        """Drop a recorded post, e.g. when publishing it failed and a retry should run"""
+        post = data.model_dump() if hasattr(data, "model_dump") else dict(data)
+        bucket = self._bucket(post["date_time"])
+        with self._lock:
+            for platform in channels_for(post["channel"]):
+                key = (post["media_url"], platform, bucket)
+                if self._posts.pop(key, None) is not None:
+                    bucket_keys = self._by_bucket.get((platform, bucket), [])
+                    if key in bucket_keys:
+                        bucket_keys.remove(key)
+
+    def _find_duplicate_locked(self, post: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        bucket = self._bucket(post["date_time"])
+        self._prune_posts(time.time())
+        for platform in channels_for(post["channel"]):
+            existing = self._posts.get((post["media_url"], platform, bucket))
+            if existing:
+                return existing
+
+            caption = post.get("twitter_post") if platform == "twitter" else post["instagram_caption"]
+            # Neighbouring buckets catch posts just across a bucket boundary
+            for neighbour in (bucket - 1, bucket, bucket + 1):
+                for key in self._by_bucket.get((platform, neighbour), []):
+                    other = self._posts.get(key)
+                    if not other:
+                        continue
+                    other_caption = (
+                        other.get("twitter_post") if platform == "twitter" else other["instagram_caption"]
+                    )
+                    if caption_similarity(caption, other_caption) >= self.similarity_threshold:
+                        return other
+        return None
+
+    def _record_locked(self, post: Dict[str, Any]) -> None:
+        bucket = self._bucket(post["date_time"])
+        entry = {**post, "recorded_at": time.time()}
+        for platform in channels_for(post["channel"]):
+            key = (post["media_url"], platform, bucket)
+            if key not in self._posts:
+                self._by_bucket.setdefault((platform, bucket), []).append(key)
+            self._posts[key] = entry
+            self._posts.move_to_end(key)
+
+    def _prune_posts(self, now: float) -> None:
+        while self._posts:
+            key, post = next(iter(self._posts.items()))
+            if now - post["recorded_at"] < self.post_ttl:
+                break
+            del self._posts[key]
+            bucket_keys = self._by_bucket.get((key[1], key[2]))
+            if bucket_keys and key in bucket_keys:
+                bucket_keys.remove(key)
+                if not bucket_keys:
+                    del self._by_bucket[(key[1], key[2])]
+
+
+duplicate_index = DuplicateIndex()
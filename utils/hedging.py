@@ -0,0 +1,267 @@
+"""
+Hedged create_predictions calls for short synchronous model calls.
+
+The GPT-4o steps (product description, dialog, captions) call Replicate's
+create_predictions with "Prefer: wait" and block until the answer is ready.
+Now and then one of them sits in Replicate's queue far longer than usual. With
+hedging enabled such a call is made as "Prefer: wait=<budget>" with a jq filter
+that keeps the prediction id. If the prediction has not finished by then, an
+identical second prediction is created and both are polled; whichever succeeds
+first is used and the other is cancelled by its id while it is still running,
+so a hedge costs at most the few seconds the loser ran. The caller gets the
+winner's output shaped by its own ".field" jq filter, as if it had waited.
+
+Hedging needs the get_predictions and cancel_predictions tools (set from the
+registry in utils/config.py); without them calls are not hedged.
+
+The budget for a step is HEDGE_BUDGETS_MS[step_name] when configured, otherwise
+the p95 of that step's recent call durations (once HEDGE_MIN_SAMPLES calls were
+seen). Only calls for a model in HEDGE_VERSIONS are hedged, so video generation
+never runs twice.
+
+Tuning (environment):
+    HEDGE_ENABLED        1 to enable (default off)
+    HEDGE_VERSIONS       comma separated model versions (default openai/gpt-4o)
+    HEDGE_BUDGETS_MS     JSON {"step_name": ms}; 0 disables hedging for a step
+    HEDGE_PERCENTILE     latency percentile used as the default budget (95)
+    HEDGE_MIN_SAMPLES    samples needed before a step is hedged by percentile (20)
+    HEDGE_POLL_SECONDS   poll interval of predictions in a hedged race (default 0.5)
+"""
+
+import concurrent.futures
+import contextvars
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from .instrumentation import instrumentation, percentile
+from .rate_limits import TERMINAL_STATUSES, rate_limiter, response_fields
+
+logger = logging.getLogger(__name__)
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "").lower() in ("1", "true", "yes")
+HEDGE_VERSIONS = {v.strip() for v in os.getenv("HEDGE_VERSIONS", "openai/gpt-4o").split(",") if v.strip()}
+HEDGE_BUDGETS_MS: Dict[str, float] = json.loads(os.getenv("HEDGE_BUDGETS_MS", "{}"))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", "32"))
+HEDGE_POLL_SECONDS = float(os.getenv("HEDGE_POLL_SECONDS", "0.5"))
+
+CANCEL_PREDICTIONS_TOOL_ID = "portia:mcp:custom:mcp.replicate.com:cancel_predictions"
+GET_PREDICTIONS_TOOL_ID = "portia:mcp:custom:mcp.replicate.com:get_predictions"
+
+# Hedged creates and polls keep the id, so a losing prediction can be cancelled
+PREDICTION_FIELDS_FILTER = "{id: .id, status: .status, output: .output, error: .error}"
+# Replicate accepts "Prefer: wait=N" for 1 <= N <= 60
+MAX_PREFER_WAIT_SECONDS = 60
+
+MAX_SAMPLES = 200
+
+_FIELD_FILTER = re.compile(r"^\.(\w+)$")
+
+
+class _Attempt:
+    """One prediction in a hedged race"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prediction_id: Optional[str] = None
+        self.lost = False
+
+
+class Hedger:
+    """Tool interceptor that hedges slow synchronous create_predictions calls"""
+
+    def __init__(
+        self,
+        enabled: bool = HEDGE_ENABLED,
+        versions=None,
+        budgets_ms: Optional[Dict[str, float]] = None,
+        pct: float = HEDGE_PERCENTILE,
+        min_samples: int = HEDGE_MIN_SAMPLES,
+    ):
+        self.enabled = enabled
+        self.versions = HEDGE_VERSIONS if versions is None else set(versions)
+        self.budgets_ms = HEDGE_BUDGETS_MS if budgets_ms is None else budgets_ms
+        self.pct = pct
+        self.min_samples = min_samples
+        # Tools used to poll and cancel hedged predictions (set from the registry when available)
+        self.get_tool = None
+        self.cancel_tool = None
+        self._samples: Dict[str, Deque[float]] = {}
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "hedged": 0, "hedge_won": 0, "cancelled": 0}
+
+    def _pool(self) -> concurrent.futures.ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge"
+                )
+            return self._executor
+
+    def _submit(self, fn: Callable[[], Any]) -> concurrent.futures.Future:
+        # Keep the job/step context (cost ledger, token usage) in the worker thread
+        return self._pool().submit(contextvars.copy_context().run, fn)
+
+    def budget(self, step_name: str) -> Optional[float]:
+        """Seconds to wait before hedging a call from `step_name`, or None to never hedge it"""
+        if step_name in self.budgets_ms:
+            budget_ms = self.budgets_ms[step_name]
+            return budget_ms / 1000 if budget_ms > 0 else None
+        with self._lock:
+            samples = sorted(self._samples.get(step_name, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return percentile(samples, self.pct)
+
+    def _record(self, step_name: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(step_name, deque(maxlen=MAX_SAMPLES)).append(seconds)
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _should_hedge(self, tool, args: Dict[str, Any]) -> bool:
+        if not self.enabled or not tool.id.endswith(":create_predictions"):
+            return False
+        if self.get_tool is None or self.cancel_tool is None:
+            return False
+        prefer = str(args.get("Prefer") or "")
+        jq_filter = str(args.get("jq_filter") or ".output")
+        return (
+            prefer.startswith("wait")
+            and str(args.get("version") or "") in self.versions
+            and _FIELD_FILTER.match(jq_filter.strip()) is not None
+        )
+
+    def _create(self, call_next, args: Dict[str, Any], wait_seconds: int, attempt: _Attempt) -> Dict[str, Any]:
+        """Create a prediction that returns after `wait_seconds` at most, keeping its id"""
+        fields = response_fields(
+            call_next({**args, "Prefer": f"wait={wait_seconds}", "jq_filter": PREDICTION_FIELDS_FILTER})
+        )
+        prediction_id = fields.get("id")
+        if not prediction_id:
+            raise RuntimeError(f"create_predictions returned no prediction id: {fields}")
+        with attempt.lock:
+            attempt.prediction_id = str(prediction_id)
+        return fields
+
+    def _wait(self, ctx, attempt: _Attempt, fields: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Poll until the prediction succeeds; None once it lost the race"""
+        while fields.get("status") not in TERMINAL_STATUSES:
+            with attempt.lock:
+                if attempt.lost:
+                    return None
+            time.sleep(HEDGE_POLL_SECONDS)
+            fields = response_fields(
+                self.get_tool.run(ctx, prediction_id=attempt.prediction_id, jq_filter=PREDICTION_FIELDS_FILTER)
+            )
+        if fields.get("status") != "succeeded":
+            raise RuntimeError(f"Prediction {attempt.prediction_id} {fields.get('status')}: {fields.get('error')}")
+        return fields
+
+    def _race(self, ctx, call_next, args: Dict[str, Any], wait_seconds: int, attempt: _Attempt):
+        fields = self._create(call_next, args, wait_seconds, attempt)
+        with attempt.lock:
+            lost = attempt.lost
+        if lost:
+            # The other prediction won while this one was being created
+            self._cancel(ctx, attempt.prediction_id)
+            return None
+        return self._wait(ctx, attempt, fields)
+
+    def _abandon(self, ctx, attempt: _Attempt) -> None:
+        """Mark the losing attempt; cancel it now if it was created already"""
+        with attempt.lock:
+            attempt.lost = True
+            prediction_id = attempt.prediction_id
+        if prediction_id:
+            self._cancel(ctx, prediction_id)
+
+    def _cancel(self, ctx, prediction_id: str) -> None:
+        try:
+            self.cancel_tool.run(ctx, prediction_id=prediction_id)
+            self._count("cancelled")
+        except Exception as e:
+            logger.warning(f"Failed to cancel hedged prediction {prediction_id}: {e}")
+        rate_limiter.prediction_finished(prediction_id)
+
+    @staticmethod
+    def _shape(fields: Dict[str, Any], args: Dict[str, Any]) -> str:
+        """The prediction as the caller's own ".field" jq filter would have returned it"""
+        field = _FIELD_FILTER.match(str(args.get("jq_filter") or ".output").strip()).group(1)
+        return json.dumps(fields.get(field))
+
+    def tool_interceptor(self, tool, ctx, args: Dict[str, Any], call_next) -> Any:
+        if not self._should_hedge(tool, args):
+            return call_next(args)
+
+        record = instrumentation.active_step(getattr(ctx, "plan_run", None))
+        step_name = record.step_name if record else str(args.get("version"))
+        budget = self.budget(step_name)
+        self._count("calls")
+        started_at = time.perf_counter()
+
+        if budget is None:
+            result = call_next(args)
+            self._record(step_name, time.perf_counter() - started_at)
+            return result
+
+        # Replicate holds the create open until the prediction finishes or the budget runs out
+        wait_seconds = min(max(math.ceil(budget), 1), MAX_PREFER_WAIT_SECONDS)
+        primary = _Attempt()
+        fields = self._create(call_next, args, wait_seconds, primary)
+        if fields.get("status") in TERMINAL_STATUSES:
+            self._record(step_name, time.perf_counter() - started_at)
+            return self._shape(fields, args)
+
+        self._count("hedged")
+        logger.info(f"Hedging {step_name}: prediction {primary.prediction_id} not done after {wait_seconds}s")
+        hedge = _Attempt()
+        primary_future = self._submit(lambda: self._wait(ctx, primary, fields))
+        # Record the primary's own duration even when a hedge wins, so the budget tracks
+        # the real latency distribution rather than the hedged one
+        primary_future.add_done_callback(lambda _: self._record(step_name, time.perf_counter() - started_at))
+        hedge_future = self._submit(lambda: self._race(ctx, call_next, dict(args), wait_seconds, hedge))
+        attempts = {primary_future: primary, hedge_future: hedge}
+
+        pending = set(attempts)
+        winner = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            succeeded = [future for future in done if future.exception() is None and future.result()]
+            if succeeded:
+                winner = succeeded[0]
+                break
+        # Both attempts failed: surface the original call's error
+        if winner is None:
+            primary_future.result()
+            raise RuntimeError(f"Hedged prediction {primary.prediction_id} did not succeed")
+
+        if winner is hedge_future:
+            self._count("hedge_won")
+        loser = primary_future if winner is hedge_future else hedge_future
+        self._abandon(ctx, attempts[loser])
+        return self._shape(winner.result(), args)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            step_names = list(self._samples)
+        budgets = {name: self.budget(name) for name in step_names}
+        return {**self.counts(), "enabled": self.enabled, "budgets_seconds": budgets}
+
+
+hedger = Hedger()
@@ -0,0 +1,70 @@
+"""
+Per-run execution hooks on a shared Portia instance.
+
+A Portia instance takes its ExecutionHooks at construction, so endpoints that
+stream step events either built a Portia per request or swapped
+`portia.execution_hooks` around a run, which races when two requests share the
+instance. `routed_hooks()` returns hooks that also forward every callback to the
+hooks bound for the current run:
+
+    with run_hooks(ExecutionHooks(before_step_execution=on_step)):
+        portia.run_plan(plan, plan_run_inputs=...)
+
+The binding lives in a ContextVar, so it follows the run's thread (and any
+context copied from it) and never leaks into concurrent runs.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from portia.execution_hooks import ExecutionHooks
+
+HOOK_NAMES = (
+    "before_plan_run",
+    "before_step_execution",
+    "after_step_execution",
+    "before_tool_call",
+    "after_tool_call",
+    "after_plan_run",
+)
+
+_run_hooks: ContextVar[Optional[ExecutionHooks]] = ContextVar("portia_run_hooks", default=None)
+
+
+def current_run_hooks() -> Optional[ExecutionHooks]:
+    return _run_hooks.get()
+
+
+@contextmanager
+def run_hooks(hooks: Optional[ExecutionHooks]) -> Iterator[None]:
+    """Route the shared instance's hook callbacks to `hooks` for runs started in this block"""
+    token = _run_hooks.set(hooks)
+    try:
+        yield
+    finally:
+        _run_hooks.reset(token)
+
+
+def _route(name: str, base_hook):
+    def hook(*args):
+        result = base_hook(*args) if base_hook else None
+        bound = _run_hooks.get()
+        run_hook = getattr(bound, name, None) if bound is not None else None
+        if run_hook is not None:
+            run_result = run_hook(*args)
+            # The first hook to return an outcome or clarification wins
+            if result is None:
+                result = run_result
+        return result
+
+    return hook
+
+
+def routed_hooks(hooks: Optional[ExecutionHooks] = None) -> ExecutionHooks:
+    """Return a copy of `hooks` whose callbacks also call the hooks bound with run_hooks()"""
+    hooks = hooks or ExecutionHooks()
+    fields = type(hooks).model_fields
+    return hooks.model_copy(
+        update={name: _route(name, getattr(hooks, name)) for name in HOOK_NAMES if name in fields}
+    )
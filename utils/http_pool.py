@@ -0,0 +1,91 @@
+"""
+Process-wide pooled HTTP clients with keep-alive.
+
+`get_session()` is a shared requests.Session (the Streamlit client) and
+`get_http_client()` a shared httpx.Client (the OpenAI models), so repeated
+calls to the same host reuse TLS connections instead of handshaking per call.
+
+Tuning (environment):
+    HTTP_POOL_CONNECTIONS   hosts kept in the requests pool (default 10)
+    HTTP_POOL_MAXSIZE       connections per host (default 20)
+    HTTP_MAX_CONNECTIONS    total httpx connections (default 100)
+    HTTP_KEEPALIVE_EXPIRY   seconds an idle httpx connection stays open (default 30)
+    HTTP_HOST_LIMITS        JSON {"host": max_connections}; calls beyond the limit
+                            wait for a free connection instead of opening more
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_HOST_LIMITS: Dict[str, int] = json.loads(os.getenv("HTTP_HOST_LIMITS", "{}"))
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_client: Optional[httpx.Client] = None
+
+
+def get_session() -> requests.Session:
+    """Shared requests session with pooled keep-alive connections"""
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            # Longer prefixes win, so per-host adapters override the default one
+            for host, limit in HTTP_HOST_LIMITS.items():
+                host_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=limit, pool_block=True)
+                session.mount(f"https://{host}", host_adapter)
+                session.mount(f"http://{host}", host_adapter)
+            _session = session
+        return _session
+
+
+def get_http_client() -> httpx.Client:
+    """Shared httpx client with pooled keep-alive connections"""
+    global _client
+    with _lock:
+        if _client is None:
+            limits = httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            )
+            mounts = {
+                f"all://{host}": httpx.HTTPTransport(
+                    limits=httpx.Limits(
+                        max_connections=limit,
+                        max_keepalive_connections=limit,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+                    )
+                )
+                for host, limit in HTTP_HOST_LIMITS.items()
+            }
+            _client = httpx.Client(limits=limits, mounts=mounts, timeout=httpx.Timeout(600, connect=10))
+        return _client
+
+
+def close_all() -> None:
+    """Close the shared clients (the next get_* call opens new ones)"""
+    global _session, _client
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+        if _client is not None:
+            _client.close()
+            _client = None
@@ -0,0 +1,384 @@
+"""
+Per-step latency and token instrumentation for plan runs.
+
+Wired in through ExecutionHooks: `instrument_hooks()` wraps an existing hooks
+object so every step records its wall time, tool id, time spent inside tool
+calls (Replicate predictions, Make.com), and LLM token usage. Samples are kept
+per step name so percentiles can be read from the API.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+from portia.execution_hooks import ExecutionHooks
+
+from .plan_steps import describe_step, plan_display_name
+from .rate_limits import TERMINAL_STATUSES, response_fields, tool_provider
+
+logger = logging.getLogger(__name__)
+
+MAX_SAMPLES_PER_STEP = 1000
+MAX_RECENT_RECORDS = 2000
+PERCENTILES = (50, 90, 95, 99)
+# Rough characters per token, for Replicate text models whose responses carry no token counts
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class StepRecord:
+    """Timing and usage for a single executed step"""
+
+    plan_name: str
+    plan_run_id: str
+    step_index: int
+    step_name: str
+    tool_id: Optional[str]
+    started_at: float
+    wall_seconds: float = 0.0
+    tool_seconds: float = 0.0
+    tool_calls: int = 0
+    replicate_seconds: float = 0.0
+    replicate_models: List[str] = field(default_factory=list)
+    # Usage of Replicate predictions that finished inside this step's create call
+    replicate_predictions: List[Dict[str, Any]] = field(default_factory=list)
+    input_tokens: int = 0
+    output_tokens: int = 0
+    llm_calls: int = 0
+    llm_model: Optional[str] = None
+    error: Optional[str] = None
+
+
+class _TokenUsageCollector(BaseCallbackHandler):
+    """LangChain callback that adds LLM token usage to the active step record"""
+
+    def __init__(self, record: StepRecord):
+        self.record = record
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        try:
+            input_tokens = output_tokens = 0
+            llm_output = getattr(response, "llm_output", None) or {}
+            if llm_output.get("model_name"):
+                self.record.llm_model = llm_output["model_name"]
+            usage = llm_output.get("token_usage") or {}
+            if usage:
+                input_tokens = usage.get("prompt_tokens", 0) or 0
+                output_tokens = usage.get("completion_tokens", 0) or 0
+            else:
+                for generations in getattr(response, "generations", []) or []:
+                    for generation in generations:
+                        message = getattr(generation, "message", None)
+                        metadata = getattr(message, "usage_metadata", None) or {}
+                        input_tokens += metadata.get("input_tokens", 0) or 0
+                        output_tokens += metadata.get("output_tokens", 0) or 0
+            self.record.input_tokens += input_tokens
+            self.record.output_tokens += output_tokens
+            self.record.llm_calls += 1
+        except Exception:
+            pass
+
+
+# LangChain attaches the collector in this context var to every LLM call made
+# while a step is running in the current thread.
+_active_collector: ContextVar[Optional[_TokenUsageCollector]] = ContextVar(
+    "portia_step_token_usage", default=None
+)
+register_configure_hook(_active_collector, inheritable=True)
+
+
+def _text_length(value: Any) -> int:
+    if value is None:
+        return 0
+    return len(value if isinstance(value, str) else json.dumps(value, default=str))
+
+
+def prediction_usage(
+    fields: Dict[str, Any], model: Optional[str], args: Optional[Dict[str, Any]] = None, output: Any = None
+) -> Dict[str, Any]:
+    """Billable usage of a finished prediction from Replicate's own metrics
+
+    predict_seconds is Replicate's metrics.predict_time (None when the response
+    was filtered down without it). Token counts fall back to an estimate from
+    the input and output text, so text models can still be priced per token.
+    """
+    metrics = fields.get("metrics") or {}
+    input_tokens = metrics.get("input_token_count")
+    output_tokens = metrics.get("output_token_count")
+    estimated = input_tokens is None or output_tokens is None
+    if input_tokens is None:
+        input_tokens = _text_length((args or {}).get("input") or fields.get("input")) // CHARS_PER_TOKEN
+    if output_tokens is None:
+        output_tokens = _text_length(fields.get("output", output)) // CHARS_PER_TOKEN
+    return {
+        "prediction_id": fields.get("id"),
+        "model": model or fields.get("version") or fields.get("model"),
+        "predict_seconds": metrics.get("predict_time"),
+        "input_tokens": int(input_tokens),
+        "output_tokens": int(output_tokens),
+        "tokens_estimated": estimated,
+    }
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class RunInstrumentation:
+    """Collects StepRecords and per-step-name latency samples"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active: Dict[tuple, StepRecord] = {}
+        self._tool_started: Dict[tuple, float] = {}
+        self._samples: Dict[str, Deque[StepRecord]] = {}
+        self._recent: Deque[StepRecord] = deque(maxlen=MAX_RECENT_RECORDS)
+        self._predictions: Deque[Dict[str, Any]] = deque(maxlen=MAX_RECENT_RECORDS)
+        # prediction id -> usage from the terminal get_predictions response, until the poller records it
+        self._finished_usage: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._listeners: List[Callable[[StepRecord], None]] = []
+        self._prediction_listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._run_listeners: List[Callable[[str, str, bool], None]] = []
+
+    def add_listener(self, listener: Callable[[StepRecord], None]) -> None:
+        """Call `listener` with every finished StepRecord"""
+        self._listeners.append(listener)
+
+    def add_prediction_listener(self, listener: Callable[[Dict[str, Any]], None]) -> None:
+        """Call `listener` with every polled prediction summary"""
+        self._prediction_listeners.append(listener)
+
+    def add_run_listener(self, listener: Callable[[str, str, bool], None]) -> None:
+        """Call `listener(plan_run_id, plan_name, finished)` as runs progress and finish"""
+        self._run_listeners.append(listener)
+
+    def _notify_run(self, plan_run_id: str, plan_name: str, finished: bool) -> None:
+        for listener in self._run_listeners:
+            try:
+                listener(plan_run_id, plan_name, finished)
+            except Exception as e:
+                logger.debug(f"Run listener failed: {e}")
+
+    def finish_run(self, plan: Any, plan_run: Any) -> None:
+        self._notify_run(str(getattr(plan_run, "id", "")), plan_display_name(plan), True)
+
+    @staticmethod
+    def _key(plan_run: Any) -> tuple:
+        return (str(getattr(plan_run, "id", "")), getattr(plan_run, "current_step_index", 0))
+
+    def before_step(self, plan: Any, plan_run: Any, step: Any) -> None:
+        index, step_name, _ = describe_step(plan, plan_run, step)
+        record = StepRecord(
+            plan_name=plan_display_name(plan),
+            plan_run_id=str(getattr(plan_run, "id", "")),
+            step_index=index,
+            step_name=step_name,
+            tool_id=getattr(step, "tool_id", None),
+            started_at=time.time(),
+        )
+        with self._lock:
+            self._active[self._key(plan_run)] = record
+        _active_collector.set(_TokenUsageCollector(record))
+        self._notify_run(record.plan_run_id, record.plan_name, False)
+
+    def active_step(self, plan_run: Any) -> Optional[StepRecord]:
+        """The record of the step `plan_run` is currently executing"""
+        with self._lock:
+            return self._active.get(self._key(plan_run))
+
+    def after_step(self, plan: Any, plan_run: Any, step: Any, output: Any = None) -> Optional[StepRecord]:
+        with self._lock:
+            record = self._active.pop(self._key(plan_run), None)
+        if record is None:
+            return None
+        _active_collector.set(None)
+        record.wall_seconds = time.time() - record.started_at
+        self._finish(record)
+        return record
+
+    def before_tool_call(self, tool: Any, args: Dict[str, Any], plan_run: Any, step: Any) -> None:
+        with self._lock:
+            self._tool_started[self._key(plan_run)] = time.time()
+
+    def after_tool_call(self, tool: Any, output: Any, plan_run: Any, step: Any, args: Optional[Dict[str, Any]] = None) -> None:
+        key = self._key(plan_run)
+        with self._lock:
+            started = self._tool_started.pop(key, None)
+            record = self._active.get(key)
+        if started is None or record is None:
+            return
+        elapsed = time.time() - started
+        record.tool_seconds += elapsed
+        record.tool_calls += 1
+        tool_id = getattr(tool, "id", None) or record.tool_id or ""
+        provider, name = tool_provider(tool_id)
+        if provider != "replicate":
+            return
+        fields = response_fields(output)
+        if name == "get_predictions":
+            # Polls are billed once, from the final response, when the poller records the prediction
+            prediction_id = (args or {}).get("prediction_id") or fields.get("id")
+            if prediction_id and fields.get("status") in TERMINAL_STATUSES:
+                self._finish_usage(str(prediction_id), prediction_usage(fields, None))
+            return
+        if name != "create_predictions":
+            return
+        record.replicate_seconds += elapsed
+        version = (args or {}).get("version")
+        if version:
+            record.replicate_models.append(str(version))
+        # A create that returns while the prediction runs is billed when it is polled to the end
+        if fields.get("id") and fields.get("status") not in TERMINAL_STATUSES:
+            return
+        record.replicate_predictions.append(
+            prediction_usage(fields, version and str(version), args, getattr(output, "value", output))
+        )
+
+    def _finish_usage(self, prediction_id: str, usage: Dict[str, Any]) -> None:
+        with self._lock:
+            self._finished_usage[prediction_id] = usage
+            while len(self._finished_usage) > MAX_RECENT_RECORDS:
+                self._finished_usage.popitem(last=False)
+
+    def record_prediction(
+        self, prediction_id: str, polls: int, seconds: float, status: Optional[str], model: Optional[str] = None
+    ) -> None:
+        """Record how long a polled Replicate prediction took to finish, with its billable usage"""
+        with self._lock:
+            usage = self._finished_usage.pop(prediction_id, None) or {}
+        summary = {
+            "prediction_id": prediction_id,
+            "polls": polls,
+            "seconds": seconds,
+            "status": status,
+            "model": model or usage.get("model"),
+            "predict_seconds": usage.get("predict_seconds"),
+            "input_tokens": usage.get("input_tokens", 0),
+            "output_tokens": usage.get("output_tokens", 0),
+            "tokens_estimated": usage.get("tokens_estimated", True),
+            "finished_at": time.time(),
+        }
+        with self._lock:
+            self._predictions.append(summary)
+        for listener in self._prediction_listeners:
+            try:
+                listener(summary)
+            except Exception as e:
+                logger.debug(f"Prediction listener failed: {e}")
+
+    def _finish(self, record: StepRecord) -> None:
+        with self._lock:
+            samples = self._samples.setdefault(record.step_name, deque(maxlen=MAX_SAMPLES_PER_STEP))
+            samples.append(record)
+            self._recent.append(record)
+        for listener in self._listeners:
+            try:
+                listener(record)
+            except Exception as e:
+                logger.debug(f"Step listener failed: {e}")
+
+    def step_percentiles(self) -> Dict[str, Dict[str, Any]]:
+        """Latency percentiles and mean usage per step name"""
+        with self._lock:
+            snapshot = {name: list(samples) for name, samples in self._samples.items()}
+        summary = {}
+        for name, records in snapshot.items():
+            wall = sorted(r.wall_seconds for r in records)
+            tool = sorted(r.tool_seconds for r in records)
+            count = len(records)
+            summary[name] = {
+                "count": count,
+                "tool_ids": sorted({r.tool_id for r in records if r.tool_id}),
+                "wall_seconds": {f"p{p}": percentile(wall, p) for p in PERCENTILES},
+                "tool_seconds": {f"p{p}": percentile(tool, p) for p in PERCENTILES},
+                "mean_wall_seconds": sum(wall) / count,
+                "mean_replicate_seconds": sum(r.replicate_seconds for r in records) / count,
+                "mean_input_tokens": sum(r.input_tokens for r in records) / count,
+                "mean_output_tokens": sum(r.output_tokens for r in records) / count,
+            }
+        return dict(sorted(summary.items(), key=lambda item: -item[1]["mean_wall_seconds"]))
+
+    def recent_records(self, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            records = list(self._recent)[-limit:]
+        return [asdict(record) for record in records]
+
+    def recent_predictions(self, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._predictions)[-limit:]
+
+
+instrumentation = RunInstrumentation()
+
+
+def instrument_hooks(hooks: Optional[ExecutionHooks] = None) -> ExecutionHooks:
+    """Return a copy of `hooks` whose step and tool callbacks also feed the instrumentation"""
+    hooks = hooks or ExecutionHooks()
+    before_step = hooks.before_step_execution
+    after_step = hooks.after_step_execution
+    before_tool = hooks.before_tool_call
+    after_tool = hooks.after_tool_call
+    # Tool args are only passed to the before hook; keep them for the after hook
+    tool_args: Dict[tuple, Dict[str, Any]] = {}
+
+    def before_step_execution(plan, plan_run, step):
+        try:
+            instrumentation.before_step(plan, plan_run, step)
+        except Exception as e:
+            logger.debug(f"Instrumentation before_step failed: {e}")
+        return before_step(plan, plan_run, step) if before_step else None
+
+    def after_step_execution(plan, plan_run, step, output):
+        try:
+            instrumentation.after_step(plan, plan_run, step, output)
+        except Exception as e:
+            logger.debug(f"Instrumentation after_step failed: {e}")
+        return after_step(plan, plan_run, step, output) if after_step else None
+
+    def before_tool_call(tool, args, plan_run, step):
+        try:
+            tool_args[RunInstrumentation._key(plan_run)] = args if isinstance(args, dict) else {}
+            instrumentation.before_tool_call(tool, args, plan_run, step)
+        except Exception as e:
+            logger.debug(f"Instrumentation before_tool_call failed: {e}")
+        return before_tool(tool, args, plan_run, step) if before_tool else None
+
+    def after_tool_call(tool, output, plan_run, step):
+        try:
+            args = tool_args.pop(RunInstrumentation._key(plan_run), None)
+            instrumentation.after_tool_call(tool, output, plan_run, step, args)
+        except Exception as e:
+            logger.debug(f"Instrumentation after_tool_call failed: {e}")
+        return after_tool(tool, output, plan_run, step) if after_tool else None
+
+    update = {
+        "before_step_execution": before_step_execution,
+        "after_step_execution": after_step_execution,
+        "before_tool_call": before_tool_call,
+        "after_tool_call": after_tool_call,
+    }
+
+    if "after_plan_run" in type(hooks).model_fields:
+        after_run = hooks.after_plan_run
+
+        def after_plan_run(plan, plan_run, output):
+            try:
+                instrumentation.finish_run(plan, plan_run)
+            except Exception as e:
+                logger.debug(f"Instrumentation after_plan_run failed: {e}")
+            return after_run(plan, plan_run, output) if after_run else None
+
+        update["after_plan_run"] = after_plan_run
+
+    return hooks.model_copy(update=update)
@@ -0,0 +1,230 @@
+"""
+Background mirroring of finished videos into the local media store.
+
+Replicate output URLs (replicate.delivery) expire after a while and are slow to
+preview repeatedly, yet they end up in the UI, in Google Sheets and in
+scheduled posts. With MEDIA_MIRROR_ENABLED set, every finished video URL is
+handed to the MediaMirror, which returns a stable mirror URL at once
+(MEDIA_BASE_URL/media/mirror/<id>) and downloads the video once, in the
+background, into the content-addressed local store. Until the download is done
+the mirror URL redirects to the upstream URL, so it can be used immediately.
+
+The mirror table (source URL -> stored file) is kept in SQLite, and downloads
+still pending at shutdown are resumed on the next start. A worker claims a
+mirror (pending -> downloading) before fetching it, so a video queued twice is
+still downloaded once.
+
+Tuning (environment):
+    MEDIA_MIRROR_ENABLED  1 to mirror finished videos (default off; MEDIA_BASE_URL
+                          must then be reachable by Sheets/social platform readers)
+    MEDIA_MIRROR_DB       SQLite file of the mirror table (default media_mirror.db)
+    MEDIA_MIRROR_WORKERS  concurrent downloads (default 2)
+    MEDIA_MIRROR_RETRIES  download attempts per video (default 3)
+"""
+
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from .http_pool import get_session
+from .media_store import MEDIA_BASE_URL, LocalMediaStore, local_media
+
+logger = logging.getLogger(__name__)
+
+MEDIA_MIRROR_ENABLED = os.getenv("MEDIA_MIRROR_ENABLED", "").lower() in ("1", "true", "yes")
+DEFAULT_MIRROR_PATH = os.getenv("MEDIA_MIRROR_DB", "media_mirror.db")
+MEDIA_MIRROR_WORKERS = int(os.getenv("MEDIA_MIRROR_WORKERS", "2"))
+MEDIA_MIRROR_RETRIES = int(os.getenv("MEDIA_MIRROR_RETRIES", "3"))
+
+DEFAULT_MAX_PENDING = 1000
+# Connect/read timeouts of a download
+DOWNLOAD_TIMEOUT = (10, 300)
+
+PENDING = "pending"
+DOWNLOADING = "downloading"
+STORED = "stored"
+FAILED = "failed"
+
+
+def mirror_id(source_url: str) -> str:
+    return hashlib.sha256(source_url.encode("utf-8")).hexdigest()[:32]
+
+
+class MediaMirror:
+    """Downloads finished outputs once into the local store and maps them to mirror URLs"""
+
+    def __init__(
+        self,
+        store: LocalMediaStore = local_media,
+        base_url: str = MEDIA_BASE_URL,
+        db_path: str = DEFAULT_MIRROR_PATH,
+        enabled: bool = MEDIA_MIRROR_ENABLED,
+        workers: int = MEDIA_MIRROR_WORKERS,
+        retries: int = MEDIA_MIRROR_RETRIES,
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ):
+        self.store = store
+        self.base_url = base_url
+        self.db_path = os.path.abspath(db_path)
+        self.enabled = enabled
+        self.workers = workers
+        self.retries = retries
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=max_pending)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        # Workers and request threads update the counters concurrently
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, int] = {"stored": 0, "failed": 0, "dropped": 0, "bytes": 0}
+        if enabled:
+            self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self) -> None:
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS mirrors (
+                    mirror_id TEXT PRIMARY KEY,
+                    source_url TEXT NOT NULL,
+                    media_name TEXT,
+                    status TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+                """
+            )
+
+    def _set_status(self, mid: str, status: str, media_name: Optional[str] = None) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE mirrors SET status = ?, media_name = ?, updated_at = ? WHERE mirror_id = ?",
+                (status, media_name, datetime.now(timezone.utc).isoformat(), mid),
+            )
+
+    def mirror(self, source_url: Optional[str]) -> Optional[str]:
+        """Mirror URL to use instead of `source_url` (unchanged when mirroring does not apply)"""
+        if not self.enabled or not source_url or not source_url.startswith(("http://", "https://")):
+            return source_url
+        if source_url.startswith(self.base_url):
+            return source_url
+        mid = mirror_id(source_url)
+        self.start()
+        with self._connect() as conn:
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO mirrors VALUES (?, ?, NULL, ?, ?)",
+                (mid, source_url, PENDING, datetime.now(timezone.utc).isoformat()),
+            ).rowcount
+        if inserted:
+            self._submit(mid)
+        return f"{self.base_url}/media/mirror/{mid}"
+
+    def lookup(self, mid: str) -> Optional[Tuple[str, Optional[str]]]:
+        """(source_url, media_name or None while not stored) for a mirror id"""
+        if not self.enabled:
+            return None
+        with self._connect() as conn:
+            row = conn.execute("SELECT source_url, media_name FROM mirrors WHERE mirror_id = ?", (mid,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _submit(self, mid: str) -> None:
+        try:
+            self._queue.put_nowait(mid)
+        except queue.Full:
+            self._count("dropped")
+            logger.warning(f"Mirror queue full, not mirroring {mid} (it will be retried on restart)")
+
+    def _count(self, stat: str, amount: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[stat] += amount
+
+    def counts(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        """Start the download workers and requeue downloads left pending by a previous run"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            # Under the lock, so no mirror() of this process can queue an id before the reset
+            with self._connect() as conn:
+                # Downloads interrupted by the previous run start over
+                conn.execute("UPDATE mirrors SET status = ? WHERE status = ?", (PENDING, DOWNLOADING))
+                leftover = [row[0] for row in conn.execute("SELECT mirror_id FROM mirrors WHERE status = ?", (PENDING,))]
+            self._threads = [
+                threading.Thread(target=self._mirror_loop, name=f"media-mirror-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+        for mid in leftover:
+            self._submit(mid)
+
+    def stop(self, timeout: float = 5) -> None:
+        """Stop the workers; downloads not finished are resumed by the next start"""
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                break
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+
+    def _download(self, source_url: str) -> str:
+        with get_session().get(source_url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            content_type = response.headers.get("content-type", "").split(";")[0].strip() or None
+            return self.store.write(response.raw, content_type)
+
+    def _claim(self, mid: str) -> Optional[str]:
+        """Mark a pending mirror as downloading and return its source URL; None if another worker has it"""
+        with self._connect() as conn:
+            claimed = conn.execute(
+                "UPDATE mirrors SET status = ?, updated_at = ? WHERE mirror_id = ? AND status = ?",
+                (DOWNLOADING, datetime.now(timezone.utc).isoformat(), mid, PENDING),
+            ).rowcount
+            if not claimed:
+                return None
+            return conn.execute("SELECT source_url FROM mirrors WHERE mirror_id = ?", (mid,)).fetchone()[0]
+
+    def _mirror_loop(self) -> None:
+        while True:
+            mid = self._queue.get()
+            if mid is None:
+                return
+            source_url = self._claim(mid)
+            if source_url is None:
+                continue
+            for attempt in range(1, self.retries + 1):
+                try:
+                    media_name = self._download(source_url)
+                except Exception as e:
+                    logger.warning(f"Mirroring {source_url} failed (attempt {attempt}/{self.retries}): {e}")
+                    if attempt < self.retries:
+                        time.sleep(2 ** attempt)
+                    continue
+                self._set_status(mid, STORED, media_name)
+                self._count("stored")
+                self._count("bytes", os.path.getsize(self.store.path(media_name)))
+                logger.info(f"Mirrored {source_url} as {media_name}")
+                break
+            else:
+                self._set_status(mid, FAILED)
+                self._count("failed")
+
+
+media_mirror = MediaMirror()
@@ -0,0 +1,186 @@
+"""
+Media storage backends for product images and finished videos.
+
+MEDIA_BACKEND picks where uploads go:
+
+    cloudinary  Cloudinary (default), named by content hash
+    local       files on local disk under MEDIA_DIR, stored content-addressed as
+                <sha256><ext> and served by the API at /media/<sha256><ext>
+
+The local store needs no third-party round trip, so on-prem installs and
+benchmark rigs can run offline. Its URLs are built from MEDIA_BASE_URL, which
+must be reachable by whatever fetches them (the Replicate models read product
+images by URL). Files never change once written, so the API serves them with
+the hash as a strong ETag, immutable caching, Range requests and zero-copy
+sends where the ASGI server supports them.
+
+Tuning (environment):
+    MEDIA_BACKEND   cloudinary or local (default cloudinary)
+    MEDIA_DIR       directory of the local store (default .media)
+    MEDIA_BASE_URL  public base URL of this API server (default http://localhost:8000)
+    CONFIG_TOML     config file whose [cloudinary] section is used when the variables
+                    below are unset (default config.toml in the app directory)
+    CLOUDINARY_URL or CLOUDINARY_CLOUD_NAME / CLOUDINARY_API_KEY / CLOUDINARY_API_SECRET
+"""
+
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+from typing import BinaryIO, Dict, Optional
+
+import cloudinary
+import cloudinary.uploader
+import toml
+
+logger = logging.getLogger(__name__)
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEDIA_BACKEND = os.getenv("MEDIA_BACKEND", "cloudinary").lower()
+MEDIA_DIR = os.getenv("MEDIA_DIR", ".media")
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "http://localhost:8000").rstrip("/")
+CONFIG_TOML = os.getenv("CONFIG_TOML", os.path.join(APP_DIR, "config.toml"))
+UPLOAD_CHUNK_BYTES = max(int(os.getenv("UPLOAD_CHUNK_BYTES", str(6 * 1024 * 1024))), 5 * 1024 * 1024)
+
+COPY_CHUNK_BYTES = 1024 * 1024
+
+_MEDIA_NAME = re.compile(r"^[0-9a-f]{64}(\.[a-z0-9]{1,8})?$")
+
+
+class MediaNotConfiguredError(RuntimeError):
+    """Raised when the selected media backend has no credentials"""
+
+
+def config_toml_credentials() -> Dict[str, str]:
+    """The [cloudinary] section of config.toml, or {} when there is none"""
+    try:
+        with open(CONFIG_TOML) as f:
+            section = toml.load(f).get("cloudinary") or {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Could not read {CONFIG_TOML}: {e}")
+        return {}
+    return {key: str(section.get(key) or "") for key in ("cloud_name", "api_key", "api_secret")}
+
+
+def extension_for(content_type: Optional[str]) -> str:
+    if not content_type:
+        return ""
+    # mimetypes prefers odd extensions for a few common types
+    return {"image/jpeg": ".jpg", "video/mp4": ".mp4"}.get(content_type) or mimetypes.guess_extension(content_type) or ""
+
+
+class CloudinaryMediaStore:
+    """Uploads to Cloudinary; originals too large for one request go up in chunks"""
+
+    name = "cloudinary"
+
+    def _configure(self) -> None:
+        """Use CLOUDINARY_URL if set, else the separate CLOUDINARY_* variables, else config.toml"""
+        if cloudinary.config().cloud_name:
+            return
+        cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME")
+        api_key = os.getenv("CLOUDINARY_API_KEY")
+        api_secret = os.getenv("CLOUDINARY_API_SECRET")
+        if not (cloud_name and api_key and api_secret):
+            # Installs that kept the credentials where the Streamlit app used to read them
+            credentials = config_toml_credentials()
+            cloud_name = cloud_name or credentials.get("cloud_name")
+            api_key = api_key or credentials.get("api_key")
+            api_secret = api_secret or credentials.get("api_secret")
+        if not (cloud_name and api_key and api_secret):
+            raise MediaNotConfiguredError("Cloudinary credentials are not configured")
+        cloudinary.config(cloud_name=cloud_name, api_key=api_key, api_secret=api_secret)
+
+    def ready(self) -> bool:
+        """True when uploads can be stored (the credentials are configured)"""
+        try:
+            self._configure()
+        except MediaNotConfiguredError:
+            return False
+        return True
+
+    def put(self, source: BinaryIO, content_type: Optional[str], name: str) -> str:
+        """Store `source` as `name` and return its URL"""
+        self._configure()
+        resource_type = "video" if (content_type or "").startswith("video/") else "image"
+        # Named by content so repeats dedupe on Cloudinary too
+        result = cloudinary.uploader.upload_large(
+            source,
+            chunk_size=UPLOAD_CHUNK_BYTES,
+            resource_type=resource_type,
+            public_id=name,
+            unique_filename=False,
+            overwrite=False,
+        )
+        url = result.get("secure_url")
+        if not url:
+            raise RuntimeError("Cloudinary response has no secure_url")
+        return url
+
+
+class LocalMediaStore:
+    """Content-addressed files on local disk, served by the API at /media/<name>"""
+
+    name = "local"
+
+    def __init__(self, root: str = MEDIA_DIR, base_url: str = MEDIA_BASE_URL):
+        # The directory is created by the first write, not at import
+        self.root = os.path.abspath(root)
+        self.base_url = base_url
+
+    def _file_path(self, media_name: str) -> str:
+        # Fan out by hash prefix so no directory grows too large
+        return os.path.join(self.root, media_name[:2], media_name)
+
+    def url(self, media_name: str) -> str:
+        return f"{self.base_url}/media/{media_name}"
+
+    def ready(self) -> bool:
+        return True
+
+    def write(self, source: BinaryIO, content_type: Optional[str]) -> str:
+        """Copy `source` into the store in chunks and return its media name (<sha256><ext>)"""
+        digest = hashlib.sha256()
+        os.makedirs(self.root, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.root, delete=False) as tmp:
+            try:
+                for chunk in iter(lambda: source.read(COPY_CHUNK_BYTES), b""):
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            except BaseException:
+                os.unlink(tmp.name)
+                raise
+        media_name = digest.hexdigest() + extension_for(content_type)
+        path = self._file_path(media_name)
+        if os.path.exists(path):
+            os.unlink(tmp.name)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp.name, path)
+        return media_name
+
+    def put(self, source: BinaryIO, content_type: Optional[str], name: str) -> str:
+        """Store `source` under its own content hash and return its URL (`name` is not needed)"""
+        return self.url(self.write(source, content_type))
+
+    def path(self, media_name: str) -> Optional[str]:
+        """Path of a stored file, or None for unknown or malformed names"""
+        if not _MEDIA_NAME.match(media_name):
+            return None
+        path = self._file_path(media_name)
+        return path if os.path.isfile(path) else None
+
+
+MEDIA_BACKENDS = {"cloudinary": CloudinaryMediaStore, "local": LocalMediaStore}
+
+if MEDIA_BACKEND not in MEDIA_BACKENDS:
+    logger.warning(f"Unknown MEDIA_BACKEND={MEDIA_BACKEND!r}, using cloudinary")
+
+# The local store always exists so /media can serve files whatever the upload backend is
+local_media = LocalMediaStore()
+media_store = local_media if MEDIA_BACKEND == "local" else CloudinaryMediaStore()
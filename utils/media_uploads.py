@@ -0,0 +1,164 @@
+"""
+Product image uploads: downscaling and a content-hash index of past uploads.
+
+Images are keyed by the SHA-256 of the bytes the user uploaded (plus the resize
+settings), so uploading the same product shot again reuses the stored
+secure_url instead of uploading it again. Before the first upload, images
+larger than UPLOAD_MAX_SIDE are downscaled and recompressed with Pillow:
+GPT-4o rescales images to a 768px short side anyway and the video models render
+at most 1080p, so the extra pixels only cost upload time and image tokens.
+
+The API server's /upload endpoint runs this on the spooled request body:
+hashing and resizing read the file in chunks (JPEGs are decoded at reduced
+scale), and the result is streamed to the media backend (media_store.py), so
+memory stays flat whatever the file size.
+
+Tuning (environment):
+    UPLOAD_INDEX_DB      SQLite file of the hash -> URL index (default upload_index.db)
+    UPLOAD_MAX_SIDE      longest side after downscaling, 0 to upload originals (default 1536)
+    UPLOAD_JPEG_QUALITY  quality of recompressed JPEGs (default 88)
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from .media_store import media_store
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_PATH = os.getenv("UPLOAD_INDEX_DB", "upload_index.db")
+UPLOAD_MAX_SIDE = int(os.getenv("UPLOAD_MAX_SIDE", "1536"))
+UPLOAD_JPEG_QUALITY = int(os.getenv("UPLOAD_JPEG_QUALITY", "88"))
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def upload_key(fileobj: BinaryIO, max_side: int = UPLOAD_MAX_SIDE, quality: int = UPLOAD_JPEG_QUALITY) -> str:
+    """Index key for an uploaded file; changes with the resize settings that shape the stored image"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_BYTES), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return f"{digest.hexdigest()}:{max_side}:{quality}" if max_side else digest.hexdigest()
+
+
+def file_size(fileobj: BinaryIO) -> int:
+    size = fileobj.seek(0, os.SEEK_END)
+    fileobj.seek(0)
+    return size
+
+
+def downscale_image(
+    fileobj: BinaryIO, max_side: int = UPLOAD_MAX_SIDE, quality: int = UPLOAD_JPEG_QUALITY
+) -> Optional[bytes]:
+    """A downscaled, recompressed copy when that is smaller than the original, else None"""
+    if not max_side:
+        return None
+    try:
+        image = Image.open(fileobj)
+        if max(image.size) <= max_side:
+            return None
+        # JPEGs can be decoded at a reduced scale instead of at full resolution
+        image.draft("RGB", (max_side, max_side))
+        # Apply the EXIF Orientation (phone photos) before it is dropped by the re-save
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = BytesIO()
+        # Keep transparency as PNG; everything else becomes JPEG
+        if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+            image.save(buffer, format="PNG", optimize=True)
+        else:
+            image.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f"Could not downscale image, uploading original: {e}")
+        return None
+    finally:
+        fileobj.seek(0)
+    resized = buffer.getvalue()
+    return resized if len(resized) < file_size(fileobj) else None
+
+
+class UploadIndex:
+    """SQLite-backed map from upload key to the stored image URL"""
+
+    def __init__(self, db_path: str = DEFAULT_INDEX_PATH):
+        self.db_path = os.path.abspath(db_path)
+        # Created on first use, so importing the module never creates a database file
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            with self._init_lock:
+                if not self._initialized:
+                    self._init_db()
+                    self._initialized = True
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self) -> None:
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with sqlite3.connect(self.db_path, timeout=30) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS uploads (
+                    upload_key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    original_bytes INTEGER NOT NULL,
+                    uploaded_bytes INTEGER NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+                """
+            )
+
+    def get(self, key: str) -> Optional[Tuple[str, int]]:
+        """(url, uploaded_bytes) of an earlier upload, or None"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT url, uploaded_bytes FROM uploads WHERE upload_key = ?", (key,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def put(self, key: str, url: str, original_bytes: int, uploaded_bytes: int) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?)",
+                (key, url, original_bytes, uploaded_bytes, datetime.now(timezone.utc).isoformat()),
+            )
+
+
+upload_index = UploadIndex()
+
+
+def store_upload(fileobj: BinaryIO, content_type: Optional[str] = None) -> Dict[str, Any]:
+    """Store an uploaded image (or reuse an identical earlier upload) and return its URL
+
+    "bytes" is the size of the stored (possibly downscaled) file, "original_bytes"
+    the size of the upload as received.
+    """
+    key = upload_key(fileobj)
+    # URLs from one backend are no use after switching to another
+    index_key = f"{media_store.name}:{key}"
+    original_bytes = file_size(fileobj)
+    stored = upload_index.get(index_key)
+    if stored:
+        url, uploaded_bytes = stored
+        return {"url": url, "key": key, "reused": True, "bytes": uploaded_bytes, "original_bytes": original_bytes}
+
+    resized = downscale_image(fileobj)
+    if resized is not None:
+        content_type = "image/png" if resized.startswith(b"\x89PNG") else "image/jpeg"
+        url = media_store.put(BytesIO(resized), content_type, key.replace(":", "_"))
+        uploaded_bytes = len(resized)
+    else:
+        url = media_store.put(fileobj, content_type, key.replace(":", "_"))
+        uploaded_bytes = original_bytes
+
+    upload_index.put(index_key, url, original_bytes, uploaded_bytes)
+    logger.info(f"Stored upload {key[:12]} in {media_store.name} ({original_bytes} -> {uploaded_bytes} bytes)")
+    return {"url": url, "key": key, "reused": False, "bytes": uploaded_bytes, "original_bytes": original_bytes}
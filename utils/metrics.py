@@ -0,0 +1,353 @@
+"""
+Prometheus text-format metrics for the API server.
+
+Counters and histograms are plain in-process values updated under a lock;
+anything derived from other components (queue depth, thread count, cache hit
+ratios, memory) is registered as a collector and only computed when /metrics
+is scraped, so nothing runs when nobody is scraping.
+"""
+
+import math
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Request and step latencies (seconds)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Replicate predictions run for minutes when generating video
+REPLICATE_BUCKETS = (1, 5, 10, 30, 60, 120, 180, 300, 450, 600, 900, 1200)
+POLL_COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 150, 200, 300)
+
+# A plan run with no step activity for this long is no longer counted as in flight
+PLAN_RUN_STALE_SECONDS = int(os.getenv("METRICS_PLAN_RUN_STALE_SECONDS", "1800"))
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return "{" + inner + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Sample]:
+        return []
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> ([per-bucket counts], sum, count)
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = [(key, (list(e[0]), e[1], e[2])) for key, e in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class CollectedGauge(_Metric):
+    """Gauge whose samples come from a callback evaluated at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+    ):
+        super().__init__(name, documentation)
+        self.collect = collect
+
+    def samples(self) -> Iterable[Sample]:
+        try:
+            results = list(self.collect())
+        except Exception:
+            return []
+        return [(self.name, labels, value) for labels, value in results]
+
+
+class CollectedCounter(CollectedGauge):
+    """Counter whose running totals come from a callback evaluated at scrape time"""
+
+    kind = "counter"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+    ) -> CollectedGauge:
+        """Register a gauge computed only when /metrics is scraped"""
+        return self.register(CollectedGauge(name, documentation, collect))
+
+    def counter_collector(
+        self,
+        name: str,
+        documentation: str,
+        collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]],
+    ) -> CollectedCounter:
+        """Register a counter read only when /metrics is scraped; `collect` returns running totals"""
+        return self.register(CollectedCounter(name, documentation, collect))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests_total = registry.counter(
+    "ugc_http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")
+)
+http_request_seconds = registry.histogram(
+    "ugc_http_request_duration_seconds",
+    "Time until the response starts, by route (streaming bodies excluded)",
+    ("route", "method"),
+)
+http_requests_in_flight = registry.gauge(
+    "ugc_http_requests_in_flight", "HTTP requests currently being handled"
+)
+plan_step_seconds = registry.histogram(
+    "ugc_plan_step_duration_seconds", "Wall time of plan steps", ("plan", "step")
+)
+plan_step_tokens_total = registry.counter(
+    "ugc_plan_step_tokens_total", "LLM tokens used by plan steps", ("plan", "step", "direction")
+)
+replicate_call_seconds = registry.histogram(
+    "ugc_replicate_tool_call_duration_seconds",
+    "Time spent in Replicate tool calls, by model version",
+    ("model",),
+    buckets=REPLICATE_BUCKETS,
+)
+replicate_prediction_seconds = registry.histogram(
+    "ugc_replicate_prediction_duration_seconds",
+    "Time from first poll until a Replicate prediction finished",
+    ("status",),
+    buckets=REPLICATE_BUCKETS,
+)
+replicate_prediction_polls = registry.histogram(
+    "ugc_replicate_prediction_polls",
+    "Number of status polls per Replicate prediction",
+    ("status",),
+    buckets=POLL_COUNT_BUCKETS,
+)
+requests_shed_total = registry.counter(
+    "ugc_requests_shed_total", "Requests rejected with 503 because an upstream circuit was open", ("tool",)
+)
+
+
+class PlanRunTracker:
+    """Tracks plan runs that have started and not finished, for the in-flight gauge"""
+
+    def __init__(self, stale_seconds: float = PLAN_RUN_STALE_SECONDS):
+        self.stale_seconds = stale_seconds
+        self._lock = threading.Lock()
+        # plan_run_id -> (plan name, last activity)
+        self._runs: Dict[str, Tuple[str, float]] = {}
+
+    def update(self, plan_run_id: str, plan_name: str, finished: bool) -> None:
+        """Instrumentation run listener"""
+        with self._lock:
+            if finished:
+                self._runs.pop(plan_run_id, None)
+            else:
+                self._runs[plan_run_id] = (plan_name, time.time())
+
+    def collect(self) -> List[Tuple[Dict[str, str], float]]:
+        cutoff = time.time() - self.stale_seconds
+        counts: Dict[str, int] = {}
+        with self._lock:
+            # Runs that errored out never report completion; expire them
+            for run_id, (plan_name, last_seen) in list(self._runs.items()):
+                if last_seen < cutoff:
+                    del self._runs[run_id]
+                    continue
+                counts[plan_name] = counts.get(plan_name, 0) + 1
+        return [({"plan": name}, count) for name, count in counts.items()]
+
+
+plan_runs = PlanRunTracker()
+registry.collector("ugc_plan_runs_in_flight", "Plan runs currently executing", plan_runs.collect)
+registry.collector(
+    "ugc_process_threads", "Live Python threads", lambda: [({}, threading.active_count())]
+)
+
+
+def _process_memory():
+    with open("/proc/self/statm") as f:
+        pages = f.read().split()
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    return [({"type": "virtual"}, int(pages[0]) * page_size), ({"type": "resident"}, int(pages[1]) * page_size)]
+
+
+registry.collector("ugc_process_memory_bytes", "Process memory", _process_memory)
+
+
+def hit_ratio(hits: float, misses: float) -> float:
+    total = hits + misses
+    return hits / total if total else 0.0
+
+
+def observe_step(record) -> None:
+    """Instrumentation listener: feed finished StepRecords into the histograms"""
+    plan_step_seconds.observe(record.wall_seconds, plan=record.plan_name, step=record.step_name)
+    if record.input_tokens:
+        plan_step_tokens_total.inc(
+            record.input_tokens, plan=record.plan_name, step=record.step_name, direction="input"
+        )
+    if record.output_tokens:
+        plan_step_tokens_total.inc(
+            record.output_tokens, plan=record.plan_name, step=record.step_name, direction="output"
+        )
+    if record.replicate_seconds:
+        model = record.replicate_models[-1] if record.replicate_models else "unknown"
+        replicate_call_seconds.observe(record.replicate_seconds, model=model)
+
+
+def observe_prediction(summary) -> None:
+    """Instrumentation listener: feed polled prediction summaries into the histograms"""
+    status = summary.get("status") or "unknown"
+    replicate_prediction_seconds.observe(summary["seconds"], status=status)
+    replicate_prediction_polls.observe(summary["polls"], status=status)
@@ -0,0 +1,74 @@
+"""
+Registry of built plans so execution hooks can resolve stable step names.
+
+Hooks receive the legacy plan Portia runs, whose steps only carry the free-text
+task and a "$step_X_output" key. Plans built with PlanBuilderV2 are registered
+here so hooks can map the current step index back to its `step_name`.
+
+Entries are keyed by plan id and label. Plans built per request (sheets rows)
+would add an id key each time, so only the most recently registered
+MAX_REGISTERED_PLANS keys are kept.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+MAX_REGISTERED_PLANS = 256
+
+_lock = threading.Lock()
+_plan_steps: "OrderedDict[str, List[str]]" = OrderedDict()
+
+
+def register_plan(plan: Any) -> Any:
+    """Remember the step names of a built PlanBuilderV2 plan and return the plan"""
+    names = [
+        getattr(step, "step_name", None) or f"step_{i}"
+        for i, step in enumerate(getattr(plan, "steps", []) or [])
+    ]
+    with _lock:
+        for key in (getattr(plan, "id", None), getattr(plan, "label", None)):
+            if key:
+                _plan_steps[str(key)] = names
+                _plan_steps.move_to_end(str(key))
+        while len(_plan_steps) > MAX_REGISTERED_PLANS:
+            _plan_steps.popitem(last=False)
+    return plan
+
+
+def step_names_for(plan: Any) -> Optional[List[str]]:
+    """Step names for a running (legacy) plan, if it was registered"""
+    plan_context = getattr(plan, "plan_context", None)
+    keys = (
+        getattr(plan, "id", None),
+        getattr(plan, "label", None),
+        getattr(plan_context, "query", None),
+    )
+    with _lock:
+        for key in keys:
+            if key and str(key) in _plan_steps:
+                _plan_steps.move_to_end(str(key))
+                return _plan_steps[str(key)]
+    return None
+
+
+def plan_display_name(plan: Any) -> str:
+    plan_context = getattr(plan, "plan_context", None)
+    return (
+        getattr(plan, "label", None)
+        or getattr(plan_context, "query", None)
+        or f"Plan {getattr(plan, 'id', '')}"
+    )
+
+
+def describe_step(plan: Any, plan_run: Any, step: Any) -> Tuple[int, str, int]:
+    """Return (index, step_name, total_steps) for the step being executed"""
+    index = getattr(plan_run, "current_step_index", 0) or 0
+    names = step_names_for(plan)
+    if names is None:
+        total = len(getattr(plan, "steps", []) or [])
+        output_key = getattr(step, "output", None) or ""
+        name = output_key.strip("$").replace("_output", "") or f"step_{index}"
+        return index, name, total
+    name = names[index] if index < len(names) else f"step_{index}"
+    return index, name, len(names)
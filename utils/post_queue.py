@@ -0,0 +1,291 @@
+"""
+Local scheduled-post queue with a rate-limited dispatcher.
+
+Posts are persisted to SQLite (indexed by date_time) and kept in an in-memory
+priority heap ordered by due time. A single dispatcher thread sleeps until the
+head of the heap is due, checks the per-channel rate limits and hands the post
+to the publish callable (the Make.com sheet plan in production).
+"""
+
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = os.getenv("SCHEDULED_POSTS_DB", "scheduled_posts.db")
+
+# Per-channel limits: at most `max_posts` publishes within `window_seconds`
+DEFAULT_CHANNEL_RATE_LIMITS = {
+    "instagram": {"max_posts": 1, "window_seconds": 60},
+    "twitter": {"max_posts": 2, "window_seconds": 60},
+}
+
+MAX_PUBLISH_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 30
+
+
+def parse_iso_utc(date_time: str) -> float:
+    """Parse the "2025-08-23T11:30:00.000Z" format into a UTC epoch timestamp"""
+    value = date_time.strip()
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def channels_for(channel: str) -> List[str]:
+    """Expand a SchedulingData channel into the platforms it posts to"""
+    if channel == "both":
+        return ["instagram", "twitter"]
+    return [channel]
+
+
+class ChannelRateLimiter:
+    """Sliding-window publish limits per channel"""
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None):
+        self.limits = limits or DEFAULT_CHANNEL_RATE_LIMITS
+        self._history: Dict[str, deque] = {}
+
+    def next_allowed_at(self, channel: str, now: float) -> float:
+        """Earliest time a post for `channel` may be published"""
+        allowed_at = now
+        for platform in channels_for(channel):
+            limit = self.limits.get(platform)
+            if not limit:
+                continue
+            history = self._history.setdefault(platform, deque())
+            window = limit["window_seconds"]
+            while history and history[0] <= now - window:
+                history.popleft()
+            if len(history) >= limit["max_posts"]:
+                allowed_at = max(allowed_at, history[0] + window)
+        return allowed_at
+
+    def record(self, channel: str, at: float) -> None:
+        for platform in channels_for(channel):
+            self._history.setdefault(platform, deque()).append(at)
+
+
+class ScheduledPostQueue:
+    """Persistent scheduled-post queue with a heap-driven dispatcher thread"""
+
+    def __init__(
+        self,
+        publish: Callable[[Dict[str, Any]], Any],
+        db_path: str = DEFAULT_QUEUE_PATH,
+        rate_limits: Optional[Dict[str, Dict[str, float]]] = None,
+    ):
+        self.publish = publish
+        self.db_path = os.path.abspath(db_path)
+        self.rate_limiter = ChannelRateLimiter(rate_limits)
+        self._heap: List[tuple] = []
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._init_db()
+        self._load_pending()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self) -> None:
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scheduled_posts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    media_url TEXT NOT NULL,
+                    instagram_caption TEXT NOT NULL,
+                    twitter_post TEXT,
+                    channel TEXT NOT NULL,
+                    date_time TEXT NOT NULL,
+                    due_at REAL NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    created_at TEXT NOT NULL,
+                    published_at TEXT
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_scheduled_posts_date_time "
+                "ON scheduled_posts(date_time)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_scheduled_posts_status "
+                "ON scheduled_posts(status)"
+            )
+
+    def _load_pending(self) -> None:
+        """Rebuild the heap from posts that were pending when the process stopped"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, due_at FROM scheduled_posts WHERE status = 'pending' "
+                "ORDER BY date_time"
+            ).fetchall()
+        # Heap entries are (ready_at, due_at, id) so deferred posts keep their date order
+        self._heap = [(row["due_at"], row["due_at"], row["id"]) for row in rows]
+        heapq.heapify(self._heap)
+        if rows:
+            logger.info(f"Loaded {len(rows)} pending scheduled posts from {self.db_path}")
+
+    def enqueue(self, data: Any) -> int:
+        """Add a SchedulingData (or equivalent dict) to the queue and return its id"""
+        post = data.model_dump() if hasattr(data, "model_dump") else dict(data)
+        due_at = parse_iso_utc(post["date_time"])
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO scheduled_posts
+                    (media_url, instagram_caption, twitter_post, channel, date_time, due_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    post["media_url"],
+                    post["instagram_caption"],
+                    post.get("twitter_post") or "",
+                    post["channel"],
+                    post["date_time"],
+                    due_at,
+                    datetime.now(timezone.utc).isoformat(),
+                ),
+            )
+            post_id = cursor.lastrowid
+        with self._condition:
+            heapq.heappush(self._heap, (due_at, due_at, post_id))
+            self._condition.notify()
+        logger.info(f"Queued scheduled post {post_id} for {post['date_time']}")
+        return post_id
+
+    def get(self, post_id: int) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM scheduled_posts WHERE id = ?", (post_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def list_posts(self, status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        query = "SELECT * FROM scheduled_posts"
+        params: tuple = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        query += " ORDER BY date_time LIMIT ?"
+        with self._connect() as conn:
+            rows = conn.execute(query, params + (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def depth(self) -> int:
+        """Number of posts waiting to be dispatched"""
+        with self._condition:
+            return len(self._heap)
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._dispatch_loop, name="scheduled-post-dispatcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def _wait_for_due_entry(self) -> Optional[tuple]:
+        """Block (holding the condition) until the heap head is due; None once stopped"""
+        while self._running:
+            if not self._heap:
+                self._condition.wait()
+                continue
+            ready_at = self._heap[0][0]
+            now = time.time()
+            if ready_at > now:
+                self._condition.wait(timeout=ready_at - now)
+                continue
+            return self._heap[0]
+        return None
+
+    def _next_due_post(self) -> Optional[int]:
+        """Block until a post is due and allowed by its channel limits"""
+        while True:
+            with self._condition:
+                entry = self._wait_for_due_entry()
+            if entry is None:
+                return None
+            _, due_at, post_id = entry
+            # Read the row without the condition so enqueue()/cancel() never wait on disk I/O
+            post = self.get(post_id)
+            with self._condition:
+                if not self._heap or self._heap[0] != entry:
+                    # The heap changed while the row was read; look at the new head
+                    continue
+                if not post or post["status"] != "pending":
+                    heapq.heappop(self._heap)
+                    continue
+
+                now = time.time()
+                allowed_at = self.rate_limiter.next_allowed_at(post["channel"], now)
+                if allowed_at > now:
+                    # Defer within the heap only; the stored date_time stays as requested
+                    heapq.heapreplace(self._heap, (allowed_at, due_at, post_id))
+                    continue
+
+                heapq.heappop(self._heap)
+                self.rate_limiter.record(post["channel"], now)
+                return post_id
+
+    def _dispatch_loop(self) -> None:
+        while self._running:
+            post_id = self._next_due_post()
+            if post_id is None:
+                break
+            self._publish(post_id)
+
+    def _publish(self, post_id: int) -> None:
+        post = self.get(post_id)
+        if not post:
+            return
+        try:
+            logger.info(f"Publishing scheduled post {post_id} to {post['channel']}")
+            self.publish(post)
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE scheduled_posts SET status = 'published', attempts = attempts + 1, "
+                    "published_at = ?, last_error = NULL WHERE id = ?",
+                    (datetime.now(timezone.utc).isoformat(), post_id),
+                )
+        except Exception as e:
+            attempts = post["attempts"] + 1
+            status = "failed" if attempts >= MAX_PUBLISH_ATTEMPTS else "pending"
+            logger.error(f"Publishing scheduled post {post_id} failed (attempt {attempts}): {e}")
+            with self._connect() as conn:
+                conn.execute(
+                    "UPDATE scheduled_posts SET status = ?, attempts = ?, last_error = ? WHERE id = ?",
+                    (status, attempts, str(e), post_id),
+                )
+            if status == "pending":
+                with self._condition:
+                    heapq.heappush(
+                        self._heap,
+                        (time.time() + RETRY_BACKOFF_SECONDS * attempts, post["due_at"], post_id),
+                    )
+                    self._condition.notify()
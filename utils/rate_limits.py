@@ -0,0 +1,295 @@
+"""
+Shared outbound rate limits for Replicate, Make.com and OpenAI.
+
+Every call takes a token from the token buckets that apply to it (per provider
+and tool, optionally per Replicate model version) and Replicate predictions
+also hold a concurrency slot from creation until a create or poll response
+reports a terminal status. Callers over the limit wait in arrival order instead
+of failing, so bursts turn into queueing rather than 429 retry storms.
+
+Tool calls are limited by `rate_limiter.tool_interceptor` (see
+tool_wrappers.py); the OpenAI models use `rate_limiter.bucket("openai")` as
+their LangChain rate limiter.
+
+Tuning (environment):
+    RATE_LIMITS                  JSON {"key": {"rate": per_second, "burst": n}} merged
+                                 over DEFAULT_RATE_LIMITS; keys are "openai", "make",
+                                 "replicate:create_predictions",
+                                 "replicate:get_predictions" or "replicate:<version>"
+    MAX_CONCURRENT_PREDICTIONS   predictions in flight per model version (default 8)
+    PREDICTION_CONCURRENCY       JSON {"<version>": n} per-version overrides
+    PREDICTION_SLOT_TTL_SECONDS  release slots of predictions never seen finishing
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from langchain_core.rate_limiters import BaseRateLimiter
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Replicate allows 600 prediction creates and 3000 other requests per minute
+DEFAULT_RATE_LIMITS: Dict[str, Dict[str, float]] = {
+    "replicate:create_predictions": {"rate": 10, "burst": 10},
+    "replicate:get_predictions": {"rate": 50, "burst": 50},
+    "make": {"rate": 2, "burst": 5},
+    "openai": {"rate": 8, "burst": 16},
+}
+RATE_LIMITS = {**DEFAULT_RATE_LIMITS, **json.loads(os.getenv("RATE_LIMITS", "{}"))}
+MAX_CONCURRENT_PREDICTIONS = int(os.getenv("MAX_CONCURRENT_PREDICTIONS", "8"))
+PREDICTION_CONCURRENCY: Dict[str, int] = json.loads(os.getenv("PREDICTION_CONCURRENCY", "{}"))
+PREDICTION_SLOT_TTL_SECONDS = float(os.getenv("PREDICTION_SLOT_TTL_SECONDS", "1200"))
+
+TERMINAL_STATUSES = {"succeeded", "failed", "canceled"}
+# A create waiting for a slot re-checks for expired slots this often
+SLOT_WAIT_SECONDS = 5
+
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+
+class TokenBucket(BaseRateLimiter):
+    """Token bucket that hands out tokens in arrival order (a GCRA schedule)"""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._interval = 1.0 / rate
+        self._tolerance = (self.burst - 1) * self._interval
+        self._theoretical_arrival = 0.0
+        self._lock = threading.Lock()
+        self.stats = {"acquired": 0, "waited": 0, "wait_seconds": 0.0}
+
+    def reserve(self, blocking: bool = True) -> Optional[float]:
+        """Reserve the next token and return the seconds to wait for it (None if not blocking and busy)"""
+        with self._lock:
+            now = time.monotonic()
+            arrival = max(self._theoretical_arrival, now)
+            wait = max(arrival - self._tolerance - now, 0.0)
+            if wait and not blocking:
+                return None
+            self._theoretical_arrival = arrival + self._interval
+            self.stats["acquired"] += 1
+            if wait:
+                self.stats["waited"] += 1
+                self.stats["wait_seconds"] += wait
+            return wait
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        wait = self.reserve(blocking)
+        if wait is None:
+            return False
+        if wait:
+            time.sleep(wait)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        import asyncio
+
+        wait = self.reserve(blocking)
+        if wait is None:
+            return False
+        if wait:
+            await asyncio.sleep(wait)
+        return True
+
+
+class FairSemaphore:
+    """Counting semaphore that grants slots in arrival order; any thread may release"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters: Deque[threading.Event] = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        with self._lock:
+            if self.in_use < self.limit and not self._waiters:
+                self.in_use += 1
+                return True
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        if waiter.wait(timeout):
+            return True
+        with self._lock:
+            # The slot may have been handed over between the timeout and taking the lock
+            if waiter.is_set():
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                # Hand the slot straight to the next waiter so it cannot be overtaken
+                self._waiters.popleft().set()
+            else:
+                self.in_use = max(self.in_use - 1, 0)
+
+    def waiting(self) -> int:
+        with self._lock:
+            return len(self._waiters)
+
+
+def tool_provider(tool_id: str) -> Tuple[str, str]:
+    """("replicate", "create_predictions") for a Portia MCP tool id"""
+    host, _, name = tool_id.rpartition(":")
+    if "replicate.com" in host:
+        return "replicate", name
+    if "make.com" in host:
+        return "make", name
+    return host.rsplit(":", 1)[-1], name
+
+
+def response_fields(result: Any) -> Dict[str, Any]:
+    """Best-effort dict view of a tool result (dict, pydantic model or JSON text)"""
+    value = getattr(result, "value", result)
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    if isinstance(value, dict) and isinstance(value.get("content"), list):
+        # Raw MCP results wrap the JSON text in content items
+        texts = [item.get("text") for item in value["content"] if isinstance(item, dict)]
+        value = next((text for text in texts if text), "")
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, (str, bytes)):
+        text = value.decode("utf-8", "replace") if isinstance(value, bytes) else value
+        match = _JSON_OBJECT.search(text)
+        if match:
+            try:
+                parsed = json.loads(match.group(0))
+                return parsed if isinstance(parsed, dict) else {}
+            except ValueError:
+                return {}
+    return {}
+
+
+class RateLimiter:
+    """Token buckets and prediction slots shared by every Portia instance in the process"""
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, Dict[str, float]]] = None,
+        max_concurrent_predictions: int = MAX_CONCURRENT_PREDICTIONS,
+        prediction_concurrency: Optional[Dict[str, int]] = None,
+        slot_ttl: float = PREDICTION_SLOT_TTL_SECONDS,
+    ):
+        self.limits = RATE_LIMITS if limits is None else limits
+        self.max_concurrent_predictions = max_concurrent_predictions
+        self.prediction_concurrency = PREDICTION_CONCURRENCY if prediction_concurrency is None else prediction_concurrency
+        self.slot_ttl = slot_ttl
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._slots: Dict[str, FairSemaphore] = {}
+        # prediction id -> (version, acquired_at)
+        self._held: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, key: str) -> Optional[TokenBucket]:
+        """The token bucket configured for `key`, or None when it is unlimited"""
+        limit = self.limits.get(key)
+        if not limit:
+            return None
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket(limit["rate"], limit.get("burst", 1))
+            return self._buckets[key]
+
+    def _prediction_slots(self, version: str) -> FairSemaphore:
+        with self._lock:
+            if version not in self._slots:
+                limit = self.prediction_concurrency.get(version, self.max_concurrent_predictions)
+                self._slots[version] = FairSemaphore(limit)
+            return self._slots[version]
+
+    def _take_tokens(self, keys: List[str]) -> None:
+        for key in keys:
+            bucket = self.bucket(key)
+            if bucket:
+                bucket.acquire()
+
+    # Prediction slots
+
+    def _expire_slots(self) -> None:
+        cutoff = time.time() - self.slot_ttl
+        with self._lock:
+            expired = [pid for pid, (_, acquired_at) in self._held.items() if acquired_at < cutoff]
+        for prediction_id in expired:
+            logger.warning(f"Releasing prediction slot for {prediction_id}, not seen finishing")
+            self.prediction_finished(prediction_id)
+
+    def prediction_finished(self, prediction_id: str) -> None:
+        with self._lock:
+            held = self._held.pop(prediction_id, None)
+        if held:
+            self._prediction_slots(held[0]).release()
+
+    def _acquire_slot(self, version: str) -> None:
+        slots = self._prediction_slots(version)
+        # Wait in short rounds so slots of predictions never seen finishing expire meanwhile
+        while True:
+            self._expire_slots()
+            if slots.acquire(timeout=SLOT_WAIT_SECONDS):
+                return
+
+    def _after_prediction_response(
+        self, result: Any, version: Optional[str] = None, prediction_id: Optional[str] = None
+    ) -> None:
+        fields = response_fields(result)
+        # Polls name the prediction in their args; jq-filtered responses may not carry the id
+        prediction_id = prediction_id or fields.get("id")
+        status = fields.get("status")
+        if version is None:
+            if prediction_id and status in TERMINAL_STATUSES:
+                self.prediction_finished(prediction_id)
+            return
+        if not prediction_id or status in TERMINAL_STATUSES:
+            self._prediction_slots(version).release()
+            return
+        with self._lock:
+            self._held[prediction_id] = (version, time.time())
+
+    # Tool integration
+
+    def tool_interceptor(self, tool, ctx, args: Dict[str, Any], call_next) -> Any:
+        provider, name = tool_provider(tool.id)
+        keys = [provider, f"{provider}:{name}"]
+        if provider != "replicate" or name != "create_predictions":
+            self._take_tokens(keys)
+            result = call_next(args)
+            if provider == "replicate" and name == "get_predictions":
+                prediction_id = args.get("prediction_id") or args.get("id")
+                self._after_prediction_response(result, prediction_id=prediction_id and str(prediction_id))
+            return result
+
+        version = str(args.get("version") or args.get("model") or "default")
+        self._acquire_slot(version)
+        try:
+            self._take_tokens(keys + [f"replicate:{version}"])
+            result = call_next(args)
+        except Exception:
+            self._prediction_slots(version).release()
+            raise
+        self._after_prediction_response(result, version)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets = dict(self._buckets)
+            slots = dict(self._slots)
+        return {
+            "buckets": {key: dict(bucket.stats) for key, bucket in buckets.items()},
+            "predictions": {
+                version: {"in_use": sem.in_use, "limit": sem.limit, "waiting": sem.waiting()}
+                for version, sem in slots.items()
+            },
+        }
+
+
+rate_limiter = RateLimiter()
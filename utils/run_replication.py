@@ -0,0 +1,86 @@
+"""
+Background replication of finished plan runs to Portia cloud storage.
+
+With PORTIA_STORAGE=memory|disk every step reads and writes plan-run state
+locally. When PORTIA_REPLICATE_RUNS_TO_CLOUD is set, the main Portia instance's
+after_plan_run hook hands each finished run to a RunReplicator, whose worker
+thread saves the plan and the run to cloud storage off the request path.
+Ephemeral plans (prediction polling) run on a separate instance and are never
+replicated.
+"""
+
+import logging
+import queue
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PENDING = 1000
+
+
+class RunReplicator:
+    """Bounded queue of finished runs copied to cloud storage by one worker thread"""
+
+    def __init__(self, config: Any, max_pending: int = DEFAULT_MAX_PENDING):
+        self.config = config
+        self._queue: "queue.Queue[Optional[Tuple[Any, Any]]]" = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._storage = None
+        self.stats: Dict[str, int] = {"replicated": 0, "failed": 0, "dropped": 0}
+
+    def _cloud_storage(self):
+        if self._storage is None:
+            from portia.storage import PortiaCloudStorage
+
+            self._storage = PortiaCloudStorage(config=self.config)
+        return self._storage
+
+    def submit(self, plan: Any, plan_run: Any) -> None:
+        """Queue a finished run; drops it (and logs) when the queue is full"""
+        self.start()
+        try:
+            self._queue.put_nowait((plan, plan_run))
+        except queue.Full:
+            self.stats["dropped"] += 1
+            logger.warning(f"Replication queue full, not replicating plan run {plan_run.id}")
+
+    def after_plan_run(self, plan, plan_run, output) -> None:
+        """ExecutionHooks.after_plan_run callback"""
+        self.submit(plan, plan_run)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._replicate_loop, name="plan-run-replicator", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5) -> None:
+        """Replicate what is already queued (up to `timeout`) and stop the worker"""
+        if not self._thread:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=timeout)
+
+    def _replicate_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            plan, plan_run = item
+            try:
+                storage = self._cloud_storage()
+                storage.save_plan(plan)
+                storage.save_plan_run(plan_run)
+                self.stats["replicated"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning(f"Failed to replicate plan run {plan_run.id} to cloud storage: {e}")
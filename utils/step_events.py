@@ -0,0 +1,84 @@
+"""
+Versioned step events streamed by the realtime endpoints.
+
+Every step_started / step_completed event carries:
+
+    v             EVENT_SCHEMA_VERSION
+    type          "step_started" | "step_completed"
+    plan_run_id
+    step_id       the stable PlanBuilderV2 step_name ("generate_captions")
+    step_index    0-based index of the step in the built plan
+    total_steps   number of steps in the built plan (both branches of an if_)
+    tool_id       tool the step calls, if any
+    message       one-line status for event logs
+    output        step_completed only: the step's structured output
+                  (a pydantic output_schema is sent as its JSON object)
+    preview       step_completed only: short human-readable text of the output
+
+Clients key off step_id and read fields from output instead of matching the
+step's free-text task or re-parsing a truncated string.
+"""
+
+import json
+from typing import Any, Dict
+
+from pydantic import BaseModel
+
+from .plan_steps import describe_step
+
+EVENT_SCHEMA_VERSION = 2
+PREVIEW_CHARS = 200
+
+
+def structured_output(output: Any) -> Any:
+    """JSON-friendly value of a step output"""
+    value = getattr(output, "value", output)
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if isinstance(value, str):
+        stripped = value.strip()
+        if stripped[:1] in ("{", "["):
+            try:
+                return json.loads(stripped)
+            except ValueError:
+                pass
+        return value
+    try:
+        return json.loads(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def output_preview(value: Any) -> str:
+    """Short text shown to people; a single-field object previews as that field"""
+    if isinstance(value, dict) and len(value) == 1:
+        value = next(iter(value.values()))
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    return text if len(text) <= PREVIEW_CHARS else text[: PREVIEW_CHARS - 1] + "…"
+
+
+def _step_fields(event_type: str, plan: Any, plan_run: Any, step: Any) -> Dict[str, Any]:
+    index, step_id, total = describe_step(plan, plan_run, step)
+    return {
+        "v": EVENT_SCHEMA_VERSION,
+        "type": event_type,
+        "plan_run_id": str(getattr(plan_run, "id", "")),
+        "step_id": step_id,
+        "step_index": index,
+        "total_steps": total,
+        "tool_id": getattr(step, "tool_id", None),
+        "message": f"{'Starting' if event_type == 'step_started' else 'Completed'} step {index + 1}/{total}: {step_id}",
+    }
+
+
+def step_started_event(plan: Any, plan_run: Any, step: Any) -> Dict[str, Any]:
+    return _step_fields("step_started", plan, plan_run, step)
+
+
+def step_completed_event(plan: Any, plan_run: Any, step: Any, output: Any) -> Dict[str, Any]:
+    value = structured_output(output)
+    return {
+        **_step_fields("step_completed", plan, plan_run, step),
+        "output": value,
+        "preview": output_preview(value),
+    }
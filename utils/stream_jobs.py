@@ -0,0 +1,259 @@
+"""
+Background consumers for generation jobs started from the Streamlit app.
+
+Streaming a job in the Streamlit script thread blocks the whole page for the
+length of the render, so a user can follow only one job at a time. A
+JobTracker (one per Streamlit session, kept in st.session_state) instead runs
+each job on its own worker thread: the worker holds the SSE connection and
+folds every event into the job's state under the tracker's lock. The page only
+reads snapshots of that state, so it stays responsive and a dashboard can poll
+any number of jobs on rerun.
+
+The same fold (fold_ugc_event) drives the foreground flow, applied to
+st.session_state, so both views agree on progress and results.
+
+Tuning (environment):
+    JOBS_MAX_ACTIVE   jobs per session streaming at once; later ones wait queued (default 12)
+    JOBS_MAX_EVENTS   events kept per job for its log (default 200)
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, MutableMapping, Optional
+
+import requests
+
+from .http_pool import get_session
+
+logger = logging.getLogger(__name__)
+
+JOBS_MAX_ACTIVE = int(os.getenv("JOBS_MAX_ACTIVE", "12"))
+JOBS_MAX_EVENTS = int(os.getenv("JOBS_MAX_EVENTS", "200"))
+
+# Connection/read timeouts of a job's request (the UGC stream can run for 20 minutes)
+JOB_TIMEOUT = (10, 1200)
+
+UGC = "ugc"
+PRODUCT_AD = "product_ad"
+
+FINISHED_STATUSES = {"completed", "error", "cancelled"}
+
+
+def step_progress(event: Dict[str, Any], ceiling: float) -> float:
+    """Progress for a step event from its plan-derived index and total"""
+    total_steps = event.get("total_steps") or 1
+    return min((event.get("step_index", 0) + 1) / total_steps * ceiling, ceiling)
+
+
+def parse_sse_line(line: str) -> Optional[Dict[str, Any]]:
+    """Parse a single SSE line"""
+    if line.startswith("data: "):
+        try:
+            return json.loads(line[6:])  # Remove "data: " prefix
+        except json.JSONDecodeError:
+            return {"type": "error", "message": f"Invalid JSON: {line}"}
+    return None
+
+
+def fold_ugc_event(state: MutableMapping[str, Any], event: Dict[str, Any]) -> bool:
+    """Fold one UGC stream event into `state`; True once the stream is finished"""
+    state["streaming_events"].append({**event, "timestamp": time.strftime("%H:%M:%S")})
+
+    if event["type"] == "started":
+        state["current_step_name"] = "Initializing..."
+        state["progress"] = 0.05
+
+    elif event["type"] == "step_started":
+        state["current_step_name"] = f"Starting: {event.get('step_id', 'unknown step')}"
+
+    elif event["type"] == "step_completed":
+        step_id = event.get("step_id", "unknown step")
+        output = event.get("output")
+
+        # Keep product description and dialog for social sharing
+        if isinstance(output, dict):
+            if step_id == "generate_product_description" and output.get("description"):
+                state["generated_product_description"] = output["description"]
+            elif step_id == "generate_final_dialog" and output.get("dialog"):
+                state["generated_dialog"] = output["dialog"]
+
+        state["current_step_name"] = f"Completed: {step_id}"
+        # Max 80% until video completion
+        state["progress"] = step_progress(event, 0.8)
+
+    elif event["type"] == "plan_completed":
+        state["current_step_name"] = "Plan completed - generating video..."
+        state["progress"] = 0.85
+        if event.get("prediction_id"):
+            state["prediction_id"] = event["prediction_id"]
+
+    elif event["type"] == "video_polling_started":
+        state["current_step_name"] = "Polling for video completion..."
+        state["progress"] = 0.9
+
+    elif event["type"] == "video_completed":
+        if event.get("video_url"):
+            state["final_video_url"] = event["video_url"]
+        state["current_step_name"] = "✅ Video generation completed!"
+        state["progress"] = 1.0
+        state["execution_status"] = "completed"
+        # Enable social sharing option
+        state["show_social_sharing"] = True
+        return True
+
+    elif event["type"] == "video_failed":
+        state["current_step_name"] = f"❌ Video generation failed: {event.get('message', 'Unknown error')}"
+        state["execution_status"] = "error"
+        return True
+
+    elif event["type"] == "error":
+        state["current_step_name"] = f"❌ Error: {event.get('message', 'Unknown error')}"
+        state["execution_status"] = "error"
+        return True
+
+    return False
+
+
+def new_job_state(job_id: str, kind: str, label: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": job_id,
+        "kind": kind,
+        "label": label,
+        "payload": payload,
+        "execution_status": "queued",
+        "current_step_name": "Queued",
+        "progress": 0.0,
+        "streaming_events": deque(maxlen=JOBS_MAX_EVENTS),
+        "final_video_url": None,
+        "prediction_id": None,
+        "generated_product_description": "",
+        "generated_dialog": "",
+        "show_social_sharing": False,
+        "created_at": time.time(),
+        "finished_at": None,
+    }
+
+
+class JobTracker:
+    """Jobs of one Streamlit session, each consumed by a background worker thread"""
+
+    def __init__(self, base_url: str, session: Optional[requests.Session] = None, max_active: int = JOBS_MAX_ACTIVE):
+        self.base_url = base_url
+        self.session = session or get_session()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._responses: Dict[str, requests.Response] = {}
+        self._slots = threading.BoundedSemaphore(max_active)
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, label: str, payload: Dict[str, Any]) -> str:
+        """Start a job in the background and return its id"""
+        job_id = uuid.uuid4().hex[:8]
+        with self._lock:
+            self._jobs[job_id] = new_job_state(job_id, kind, label, payload)
+        threading.Thread(target=self._run, args=(job_id,), name=f"job-{job_id}", daemon=True).start()
+        return job_id
+
+    def _fold(self, job: Dict[str, Any], event: Dict[str, Any]) -> bool:
+        """Apply an event to a job unless it was cancelled; True when the job should stop"""
+        # Checked and applied under one lock, so a cancel is never overwritten by a late event
+        with self._lock:
+            if job["execution_status"] == "cancelled":
+                return True
+            return fold_ugc_event(job, event)
+
+    def _run(self, job_id: str) -> None:
+        job = self._jobs[job_id]
+        with self._slots:
+            with self._lock:
+                if job["execution_status"] == "cancelled":
+                    return
+                job["execution_status"] = "running"
+                job["current_step_name"] = "Starting..."
+            try:
+                if job["kind"] == UGC:
+                    self._consume_ugc_stream(job_id, job)
+                else:
+                    self._run_product_ad(job)
+                with self._lock:
+                    if job["execution_status"] == "running":
+                        job["execution_status"] = "completed"
+                        job["current_step_name"] = "✅ Execution completed!"
+            except Exception as e:
+                with self._lock:
+                    cancelled = job["execution_status"] == "cancelled"
+                if not cancelled:
+                    logger.warning(f"Job {job_id} failed: {e}")
+                    self._fold(job, {"type": "error", "message": str(e)})
+            finally:
+                with self._lock:
+                    self._responses.pop(job_id, None)
+                    job["finished_at"] = time.time()
+
+    def _consume_ugc_stream(self, job_id: str, job: Dict[str, Any]) -> None:
+        response = self.session.post(
+            f"{self.base_url}/execute-ugc-realtime", json=job["payload"], stream=True, timeout=JOB_TIMEOUT
+        )
+        with self._lock:
+            self._responses[job_id] = response
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                event = parse_sse_line(line.decode("utf-8")) if line else None
+                if event and self._fold(job, event):
+                    break
+
+    def _run_product_ad(self, job: Dict[str, Any]) -> None:
+        with self._lock:
+            job["current_step_name"] = "Generating product ad..."
+        # One blocking request: cancelling only stops following it, the server still finishes the ad
+        response = self.session.post(f"{self.base_url}/execute-product-ad", json=job["payload"], timeout=JOB_TIMEOUT)
+        response.raise_for_status()
+        result = response.json()
+        if result.get("status") == "completed":
+            self._fold(job, {
+                "type": "video_completed",
+                "video_url": result.get("video_url"),
+                "message": "Product Ad generation completed!",
+            })
+        else:
+            self._fold(job, {
+                "type": "video_failed",
+                "message": f"Product Ad generation failed: {result.get('error', 'Unknown error')}",
+            })
+
+    def cancel(self, job_id: str) -> None:
+        """Stop following a job; closes its stream if one is open"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["execution_status"] in FINISHED_STATUSES:
+                return
+            running_product_ad = job["kind"] == PRODUCT_AD and job["execution_status"] == "running"
+            job["execution_status"] = "cancelled"
+            job["current_step_name"] = (
+                "Cancelled (the product ad still finishes on the server)" if running_product_ad else "Cancelled"
+            )
+            response = self._responses.get(job_id)
+        if response is not None:
+            response.close()
+
+    def clear_finished(self) -> None:
+        with self._lock:
+            for job_id in [j for j, job in self._jobs.items() if job["execution_status"] in FINISHED_STATUSES]:
+                del self._jobs[job_id]
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Copies of every job's state, oldest first, safe to render from the script thread"""
+        with self._lock:
+            return [
+                {**job, "streaming_events": list(job["streaming_events"])}
+                for job in sorted(self._jobs.values(), key=lambda job: job["created_at"])
+            ]
+
+    def active(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["execution_status"] not in FINISHED_STATUSES)
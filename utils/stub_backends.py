@@ -0,0 +1,401 @@
+"""
+Offline stand-ins for the Replicate and Make.com MCP tools and for the LLM.
+
+Enabled with PORTIA_OFFLINE=1 (see utils/config.py). The stub tools keep the
+real tool ids, sleep for a configurable latency and return canned responses;
+predictions move through starting -> processing -> succeeded across polls. The
+stub model answers structured-output requests by reusing matching fields from
+JSON found in the conversation, so ids created by create_predictions flow
+through to the polling plans like they do in production.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import re
+import threading
+import time
+import typing
+import uuid
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Any, Dict, List, Optional, Type
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+from portia import InMemoryToolRegistry, Tool, ToolRunContext
+from portia.model import GenerativeModel, LLMProvider, Message
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+REPLICATE_CREATE_PREDICTIONS = "portia:mcp:custom:mcp.replicate.com:create_predictions"
+REPLICATE_GET_PREDICTIONS = "portia:mcp:custom:mcp.replicate.com:get_predictions"
+MAKE_ADD_ROW_TO_SHEET = "portia:mcp:custom:us2.make.com:s2825571_on_demand_add_row_to_sheet"
+
+# Latency defaults (seconds); per-tool overrides go in STUB_TOOL_LATENCIES as JSON
+DEFAULT_TOOL_LATENCY = float(os.getenv("STUB_TOOL_LATENCY_SECONDS", "0.05"))
+DEFAULT_LLM_LATENCY = float(os.getenv("STUB_LLM_LATENCY_SECONDS", "0.0"))
+DEFAULT_POLLS_TO_COMPLETE = int(os.getenv("STUB_POLLS_TO_COMPLETE", "3"))
+
+STUB_VIDEO_URL = "https://stub.local/replicate/ugc-video.mp4"
+STUB_IMAGE_URL = "https://stub.local/replicate/avatar.png"
+
+# Canned prediction output per model version; anything else gets the video URL
+CANNED_OUTPUTS: Dict[str, Any] = {
+    "openai/gpt-4o": [
+        "A glossy white bottle of shampoo with a black cap ",
+        "and bold red brand lettering on the front.",
+    ],
+    "706321a35bebe81c99cb83a6b6db6b1cc0b7281f8da9be48a438de5e0aea3183": [STUB_IMAGE_URL],
+}
+
+
+def _tool_latencies() -> Dict[str, float]:
+    return json.loads(os.getenv("STUB_TOOL_LATENCIES", "{}"))
+
+
+def apply_jq_filter(data: Dict[str, Any], jq_filter: Optional[str]) -> Any:
+    """Apply the two jq shapes the plans use: ".field" and "{a: .a, b: .b}" """
+    if not jq_filter:
+        return data
+    jq_filter = jq_filter.strip()
+    if re.fullmatch(r"\.\w+", jq_filter):
+        return data.get(jq_filter[1:])
+    if jq_filter.startswith("{") and jq_filter.endswith("}"):
+        result = {}
+        for part in jq_filter[1:-1].split(","):
+            key, _, path = part.partition(":")
+            result[key.strip()] = data.get(path.strip().lstrip("."))
+        return result
+    return data
+
+
+class StubPredictionStore:
+    """In-memory Replicate predictions that complete after a number of polls"""
+
+    def __init__(self, polls_to_complete: int = DEFAULT_POLLS_TO_COMPLETE):
+        self.polls_to_complete = polls_to_complete
+        self._lock = threading.Lock()
+        self._predictions: Dict[str, Dict[str, Any]] = {}
+
+    def create(self, version: Optional[str], wait: bool) -> Dict[str, Any]:
+        prediction = {
+            "id": f"stub{uuid.uuid4().hex[:20]}",
+            "version": version,
+            "status": "starting",
+            "output": None,
+            "polls": 0,
+        }
+        if wait:
+            self._complete(prediction)
+        with self._lock:
+            self._predictions[prediction["id"]] = prediction
+        return dict(prediction)
+
+    def poll(self, prediction_id: str) -> Dict[str, Any]:
+        with self._lock:
+            # Ids invented by the LLM still resolve, so plans never hang offline
+            prediction = self._predictions.setdefault(
+                prediction_id,
+                {"id": prediction_id, "version": None, "status": "starting", "output": None, "polls": 0},
+            )
+            prediction["polls"] += 1
+            if prediction["status"] != "succeeded":
+                if prediction["polls"] >= self.polls_to_complete:
+                    self._complete(prediction)
+                else:
+                    prediction["status"] = "processing"
+            return dict(prediction)
+
+    @staticmethod
+    def _complete(prediction: Dict[str, Any]) -> None:
+        prediction["status"] = "succeeded"
+        prediction["output"] = CANNED_OUTPUTS.get(prediction["version"] or "", STUB_VIDEO_URL)
+
+
+class _LenientArgs(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+
+class CreatePredictionArgs(_LenientArgs):
+    version: Optional[str] = Field(default=None, description="Model version id")
+    input: Optional[Dict[str, Any]] = Field(default=None, description="Model input")
+    jq_filter: Optional[str] = Field(default=None, description="jq filter applied to the response")
+    Prefer: Optional[str] = Field(default=None, description="'wait' or 'wait=N'")
+
+
+class GetPredictionArgs(_LenientArgs):
+    prediction_id: Optional[str] = Field(default=None, description="Prediction id")
+    id: Optional[str] = Field(default=None, description="Prediction id")
+    jq_filter: Optional[str] = Field(default=None, description="jq filter applied to the response")
+
+
+class AddRowArgs(_LenientArgs):
+    media_url: Optional[str] = None
+    instagram_caption: Optional[str] = None
+    date_time: Optional[str] = None
+    twitter_post: Optional[str] = None
+    channel: Optional[str] = None
+
+
+class _StubTool(Tool[str]):
+    latency_seconds: float = DEFAULT_TOOL_LATENCY
+
+    def _sleep(self) -> None:
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+
+
+class StubCreatePredictionsTool(_StubTool):
+    id: str = REPLICATE_CREATE_PREDICTIONS
+    name: str = "create_predictions"
+    description: str = "Offline stub of Replicate create_predictions"
+    args_schema: Type[BaseModel] = CreatePredictionArgs
+    output_schema: tuple[str, str] = ("str", "JSON prediction")
+    store: Any = None
+
+    def run(self, ctx: ToolRunContext, **kwargs: Any) -> str:
+        self._sleep()
+        prefer = (kwargs.get("Prefer") or "").strip()
+        # "Prefer: wait" blocks until done; "wait=N" returns while still starting
+        prediction = self.store.create(kwargs.get("version"), wait=prefer == "wait")
+        prediction.pop("polls", None)
+        return json.dumps(apply_jq_filter(prediction, kwargs.get("jq_filter")))
+
+
+class StubGetPredictionsTool(_StubTool):
+    id: str = REPLICATE_GET_PREDICTIONS
+    name: str = "get_predictions"
+    description: str = "Offline stub of Replicate get_predictions"
+    args_schema: Type[BaseModel] = GetPredictionArgs
+    output_schema: tuple[str, str] = ("str", "JSON prediction status")
+    store: Any = None
+
+    def run(self, ctx: ToolRunContext, **kwargs: Any) -> str:
+        self._sleep()
+        prediction_id = kwargs.get("prediction_id") or kwargs.get("id") or "unknown"
+        prediction = self.store.poll(str(prediction_id))
+        prediction.pop("polls", None)
+        jq_filter = kwargs.get("jq_filter") or "{status: .status, output: .output}"
+        return json.dumps(apply_jq_filter(prediction, jq_filter))
+
+
+class StubAddRowToSheetTool(_StubTool):
+    id: str = MAKE_ADD_ROW_TO_SHEET
+    name: str = "s2825571_on_demand_add_row_to_sheet"
+    description: str = "Offline stub of the Make.com add-row-to-sheet scenario"
+    args_schema: Type[BaseModel] = AddRowArgs
+    output_schema: tuple[str, str] = ("str", "Make.com scenario result")
+    rows: Any = None
+
+    def run(self, ctx: ToolRunContext, **kwargs: Any) -> str:
+        self._sleep()
+        row_number = next(self.rows)
+        return json.dumps({"status": "success", "row": row_number})
+
+
+def create_stub_tool_registry(
+    polls_to_complete: int = DEFAULT_POLLS_TO_COMPLETE,
+    latencies: Optional[Dict[str, float]] = None,
+) -> InMemoryToolRegistry:
+    """Registry with stub versions of every MCP tool the plans use"""
+    latencies = {**_tool_latencies(), **(latencies or {})}
+    store = StubPredictionStore(polls_to_complete)
+    tools = [
+        StubCreatePredictionsTool(store=store),
+        StubGetPredictionsTool(store=store),
+        StubAddRowToSheetTool(rows=itertools.count(1)),
+    ]
+    for tool in tools:
+        tool.latency_seconds = latencies.get(tool.id, DEFAULT_TOOL_LATENCY)
+    return InMemoryToolRegistry.from_local_tools(tools)
+
+
+# Stub LLM
+
+
+def _json_objects(texts: List[str]) -> List[Dict[str, Any]]:
+    """JSON objects embedded in the given texts, most recent first"""
+    decoder = json.JSONDecoder()
+    found = []
+    for text in reversed(texts):
+        for match in re.finditer(r"\{", text or ""):
+            try:
+                value, _ = decoder.raw_decode(text[match.start():])
+            except ValueError:
+                continue
+            if isinstance(value, dict):
+                found.append(value)
+    return found
+
+
+def _placeholder(name: str, annotation: Any) -> Any:
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+    if origin is typing.Union:
+        non_none = [arg for arg in args if arg is not type(None)]
+        return _placeholder(name, non_none[0]) if non_none else None
+    if origin is typing.Literal:
+        return args[0]
+    if origin in (list, List):
+        return []
+    if origin in (dict, Dict):
+        return {}
+    if isinstance(annotation, type):
+        if issubclass(annotation, BaseModel):
+            return synthesize_model(annotation, [])
+        if issubclass(annotation, Enum):
+            return next(iter(annotation))
+        if issubclass(annotation, bool):
+            return True
+        if issubclass(annotation, (int, float)):
+            return annotation(0)
+        if issubclass(annotation, list):
+            return []
+        if issubclass(annotation, dict):
+            return {}
+    lowered = name.lower()
+    if "url" in lowered:
+        return STUB_IMAGE_URL
+    if lowered == "channel":
+        return "both"
+    if lowered == "status":
+        return "starting"
+    if lowered in ("date_time", "datetime"):
+        return (datetime.now(timezone.utc) + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    if lowered == "extracted_time":
+        return "in 1 hour"
+    if lowered == "id":
+        return f"stub{uuid.uuid4().hex[:20]}"
+    return f"stub {name.replace('_', ' ')}"
+
+
+def synthesize_model(schema: Type[BaseModel], texts: List[str]) -> BaseModel:
+    """Build a valid `schema` instance, preferring values found as JSON in `texts`"""
+    candidates = _json_objects(texts)
+    values = {}
+    for name, field in schema.model_fields.items():
+        for candidate in candidates:
+            if name in candidate and candidate[name] is not None:
+                values[name] = candidate[name]
+                break
+        else:
+            if field.is_required():
+                values[name] = _placeholder(name, field.annotation)
+    try:
+        return schema.model_validate(values)
+    except ValidationError:
+        return schema.model_validate(
+            {
+                name: _placeholder(name, field.annotation)
+                for name, field in schema.model_fields.items()
+                if field.is_required()
+            }
+        )
+
+
+def _approx_tokens(texts: List[str]) -> int:
+    return sum(len(text or "") for text in texts) // 4
+
+
+def _message_texts(messages: List[Any]) -> List[str]:
+    texts = []
+    for message in messages:
+        content = getattr(message, "content", message)
+        texts.append(content if isinstance(content, str) else json.dumps(content, default=str))
+    return texts
+
+
+class StubChatModel(BaseChatModel):
+    """LangChain chat model that calls the bound tool once, then returns its result"""
+
+    latency_seconds: float = DEFAULT_LLM_LATENCY
+    bound_tools: List[Any] = Field(default_factory=list)
+
+    @property
+    def _llm_type(self) -> str:
+        return "portia-offline-stub"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "StubChatModel":
+        return self.model_copy(update={"bound_tools": list(tools)})
+
+    def with_structured_output(self, schema: Any, **kwargs: Any) -> RunnableLambda:
+        def respond(value: Any) -> Any:
+            if self.latency_seconds > 0:
+                time.sleep(self.latency_seconds)
+            messages = value if isinstance(value, list) else getattr(value, "messages", [value])
+            return synthesize_model(schema, _message_texts(messages))
+
+        return RunnableLambda(respond)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+        texts = _message_texts(messages)
+        tool_results = [m for m in messages if isinstance(m, ToolMessage)]
+        if self.bound_tools and not tool_results:
+            tool = self.bound_tools[0]
+            name = getattr(tool, "name", None) or tool.get("function", {}).get("name")
+            args_schema = getattr(tool, "args_schema", None)
+            args = {}
+            if isinstance(args_schema, type) and issubclass(args_schema, BaseModel):
+                args = synthesize_model(args_schema, texts).model_dump(exclude_none=True)
+            message = AIMessage(
+                content="",
+                tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:12]}"}],
+            )
+        else:
+            content = tool_results[-1].content if tool_results else "stub response"
+            message = AIMessage(content=content if isinstance(content, str) else json.dumps(content))
+        input_tokens = _approx_tokens(texts)
+        output_tokens = _approx_tokens(_message_texts([message])) or 1
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={
+                "model_name": "stub-llm",
+                "token_usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens},
+            },
+        )
+
+
+class StubGenerativeModel(GenerativeModel):
+    """Portia GenerativeModel backed by StubChatModel"""
+
+    provider: LLMProvider = LLMProvider.OPENAI
+
+    def __init__(self, latency_seconds: float = DEFAULT_LLM_LATENCY):
+        super().__init__(model_name="stub-llm")
+        self.latency_seconds = latency_seconds
+
+    def _sleep(self) -> None:
+        if self.latency_seconds > 0:
+            time.sleep(self.latency_seconds)
+
+    def get_response(self, messages: List[Message]) -> Message:
+        self._sleep()
+        candidates = _json_objects(_message_texts(messages))
+        content = json.dumps(candidates[0]) if candidates else "stub response"
+        return Message(role="assistant", content=content)
+
+    def get_structured_response(self, messages: List[Message], schema: Type[BaseModel]) -> BaseModel:
+        self._sleep()
+        return synthesize_model(schema, _message_texts(messages))
+
+    async def aget_response(self, messages: List[Message]) -> Message:
+        return await asyncio.to_thread(self.get_response, messages)
+
+    async def aget_structured_response(
+        self, messages: List[Message], schema: Type[BaseModel]
+    ) -> BaseModel:
+        return await asyncio.to_thread(self.get_structured_response, messages, schema)
+
+    def to_langchain(self) -> BaseChatModel:
+        return StubChatModel(latency_seconds=self.latency_seconds)
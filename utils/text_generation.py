@@ -0,0 +1,49 @@
+"""
+Provider switch for the GPT-4o text steps: product description, auto dialog and captions.
+
+By default these steps go through Replicate. An agent LLM turn writes a
+create_predictions call with version "openai/gpt-4o", Replicate queues it and
+proxies it to OpenAI, and the agent reshapes the returned text into the step's
+schema. That is two model hops plus Replicate queueing for one completion.
+
+With TEXT_GENERATION_PROVIDER=openai the plans send these prompts straight to
+the OpenAI model that utils.config configures (shared connection pool, OpenAI
+rate limit, cassettes and offline stubs included), asking for the step's schema
+as structured output. Text-only steps become plain llm_steps. The product
+description needs the product image, so it calls generate_structured() from a
+function step with the image URL as an image part.
+
+Plans are built once per process, so changing the provider needs a restart.
+
+Tuning (environment):
+    TEXT_GENERATION_PROVIDER  replicate or openai (default replicate)
+"""
+
+import logging
+import os
+from typing import Sequence, Type, TypeVar
+
+from langchain_core.messages import HumanMessage, SystemMessage
+from pydantic import BaseModel
+
+from .config import get_config
+
+logger = logging.getLogger(__name__)
+
+TEXT_GENERATION_PROVIDERS = ("replicate", "openai")
+TEXT_GENERATION_PROVIDER = os.getenv("TEXT_GENERATION_PROVIDER", "replicate").lower()
+if TEXT_GENERATION_PROVIDER not in TEXT_GENERATION_PROVIDERS:
+    logger.warning(f"Unknown TEXT_GENERATION_PROVIDER={TEXT_GENERATION_PROVIDER!r}, using replicate")
+    TEXT_GENERATION_PROVIDER = "replicate"
+
+SchemaT = TypeVar("SchemaT", bound=BaseModel)
+
+
+def generate_structured(
+    schema: Type[SchemaT], system_prompt: str, prompt: str, image_urls: Sequence[str] = ()
+) -> SchemaT:
+    """One call to the configured model, parsed into `schema`"""
+    content = [{"type": "text", "text": prompt}]
+    content += [{"type": "image_url", "image_url": {"url": url}} for url in image_urls if url]
+    model = get_config().get_default_model().to_langchain().with_structured_output(schema)
+    return model.invoke([SystemMessage(content=system_prompt), HumanMessage(content=content)])
@@ -0,0 +1,57 @@
+"""
+Interceptor chain around Portia tools.
+
+`wrap_registry()` replaces every tool in a registry with an InterceptedTool that
+keeps the original id, name, description and args schema, and routes each call
+through a list of interceptors before reaching the real tool. An interceptor is
+
+    def interceptor(tool, ctx, args, call_next):
+        ...
+        return call_next(args)
+
+and can time, record, replay, throttle or short-circuit the call.
+"""
+
+from typing import Any, Callable, Dict, Iterable, List
+
+from portia import InMemoryToolRegistry, Tool, ToolRunContext
+
+ToolInterceptor = Callable[[Tool, ToolRunContext, Dict[str, Any], Callable[[Dict[str, Any]], Any]], Any]
+
+
+class InterceptedTool(Tool[Any]):
+    """Proxy that runs a tool through a chain of interceptors"""
+
+    inner: Any = None
+    interceptors: List[Any] = []
+
+    def run(self, ctx: ToolRunContext, **kwargs: Any) -> Any:
+        def call(index: int, args: Dict[str, Any]) -> Any:
+            if index == len(self.interceptors):
+                return self.inner.run(ctx, **args)
+            return self.interceptors[index](self.inner, ctx, args, lambda next_args: call(index + 1, next_args))
+
+        return call(0, kwargs)
+
+
+def wrap_tool(tool: Tool, interceptors: Iterable[ToolInterceptor]) -> InterceptedTool:
+    if isinstance(tool, InterceptedTool):
+        return tool.model_copy(update={"interceptors": tool.interceptors + list(interceptors)})
+    return InterceptedTool(
+        id=tool.id,
+        name=tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+        output_schema=tool.output_schema,
+        should_summarize=getattr(tool, "should_summarize", False),
+        inner=tool,
+        interceptors=list(interceptors),
+    )
+
+
+def wrap_registry(registry: Any, interceptors: Iterable[ToolInterceptor]) -> InMemoryToolRegistry:
+    """Registry with every tool of `registry` wrapped by `interceptors` (outermost first)"""
+    interceptors = list(interceptors)
+    return InMemoryToolRegistry.from_local_tools(
+        [wrap_tool(tool, interceptors) for tool in registry.get_tools()]
+    )